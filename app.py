@@ -1,336 +1,14 @@
 
 import streamlit as st
-import akshare as ak
 import pandas as pd
 import numpy as np
-import plotly.express as px
 import plotly.graph_objects as go
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import time, os, re
 
 from common import *
-
-
-@st.cache_data(ttl=3600, show_spinner=False)
-def get_stock_list() -> pd.DataFrame:
-    df=pd.read_csv(r'stock_list1.csv', header=0)
-    return df
-@st.cache_data(ttl=3600, show_spinner=False)
-# col_maps_dict {report_name: df in sheet_name['ths', 'em', 'sina', 'item', 'item_group']}
-# CROSS_REPORT only have 'item'. {CROSS_REPORT: 'item'}
-def get_col_maps_dict() -> dict[str, pd.DataFrame]:
-    sheet_map = {PROFIT_BY_REPORT: 'profit',
-                 CASH_BY_REPORT: 'cash',
-                 BALANCE_BY_REPORT: 'balance',
-                 PROFIT_BY_QUARTER: 'profit',
-                 CASH_BY_QUARTER: 'cash',
-
-                 PROFIT_PCT_BY_REPORT: 'profit',
-                 PROFIT_PCT_BY_QUARTER: 'profit',
-                 CASH_PCT_BY_REPORT: 'cash',
-                 CASH_PCT_BY_QUARTER: 'cash',
-                 BALANCE_PCT_BY_REPORT: 'balance',
-
-                 CROSS_REPORT: 'cross',
-                 }
-    # sheets_df is a dict. {sheet_name: df in each sheet}
-    sheets_df_dict = pd.read_excel(r'col_maps.xlsx', sheet_name=list(sheet_map.values()), header=0)
-    # st.write(sheets_df_dict)
-    col_maps_dict = {k: sheets_df_dict[v] for k, v in sheet_map.items()}
-    return col_maps_dict
-
-# 资产负债表 - 报告期
-@st.cache_data(ttl=3600, show_spinner=False)
-def get_balance_sheet_by_report(code: str, source: str = 'ths') -> pd.DataFrame:
-    if source == 'ths':
-        return ak.stock_financial_debt_ths(symbol=code, indicator="按报告期")
-    elif source == 'em':
-        return ak.stock_balance_sheet_by_report_em(symbol=add_prefix_to_code(code))
-    elif source == 'sina':
-        return ak.stock_financial_report_sina(stock=code, symbol="资产负债表")
-    else:
-        return pd.DataFrame()
-# 利润表 - 报告期和季度, sina 没有提供按季度的报表
-@st.cache_data(ttl=3600, show_spinner=False)
-def get_profit_sheet_by_report(code: str, source: str = 'ths') -> pd.DataFrame:
-    if source == 'ths':
-        return ak.stock_financial_benefit_ths(symbol=code, indicator="按报告期")
-    elif source == 'em':
-        return ak.stock_profit_sheet_by_report_em(symbol=add_prefix_to_code(code))
-    elif source == 'sina':
-        return ak.stock_financial_report_sina(stock=code, symbol="利润表")
-    else:
-        return pd.DataFrame()
-@st.cache_data(ttl=3600, show_spinner=False)
-def get_profit_sheet_by_quarterly(code: str, source: str = 'ths') -> pd.DataFrame:
-    if source == 'ths':
-        return ak.stock_financial_benefit_ths(symbol=code, indicator="按单季度")
-    elif source == 'em':
-        return ak.stock_profit_sheet_by_quarterly_em(symbol=add_prefix_to_code(code))
-    else:
-        return pd.DataFrame()
-# 现金流量表 - 报告期和季度, sina 没有提供按季度的报表
-@st.cache_data(ttl=3600, show_spinner=False)
-def get_cash_sheet_by_report(code: str, source: str = 'ths') -> pd.DataFrame:
-    if source == 'ths':
-        return ak.stock_financial_cash_ths(symbol=code, indicator="按报告期")
-    elif source == 'em':
-        return ak.stock_cash_flow_sheet_by_report_em(symbol=add_prefix_to_code(code))
-    elif source == 'sina':
-        return ak.stock_financial_report_sina(stock=code, symbol="现金流量表")
-    else:
-        return pd.DataFrame()
-@st.cache_data(ttl=3600, show_spinner=False)
-def get_cash_sheet_by_quarterly(code: str, source: str = 'ths') -> pd.DataFrame:
-    if source == 'ths':
-        return ak.stock_financial_cash_ths(symbol=code, indicator="按单季度")
-    elif source == 'em':
-        return ak.stock_cash_flow_sheet_by_quarterly_em(symbol=add_prefix_to_code(code))
-    else:
-        return pd.DataFrame()
-    
-# thread function to get report
-# return value {report_name: report_df, ...}
-@st.cache_data(ttl=3600, show_spinner=False)
-def get_all_reports_concurrently(code: str, source: str = 'ths') -> dict[str, pd.DataFrame]:
-    # five reports as 
-    tasks = [(PROFIT_BY_REPORT, get_profit_sheet_by_report, (code, source)),
-             (CASH_BY_REPORT,get_cash_sheet_by_report, (code, source)),
-             (BALANCE_BY_REPORT, get_balance_sheet_by_report, (code, source))]
-            # 单季度数据后面自行计算，不从网上抓取了
-            #  (PROFIT_BY_QUARTER, get_profit_sheet_by_quarterly, (code, source)),
-            #  (CASH_BY_QUARTER, get_cash_sheet_by_quarterly, (code, source))
-    results= {}
-    futures_to_tasks = {}
-    with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
-            for name, func, args in tasks:
-                futures_to_tasks[executor.submit(func, *args)] = (name,func.__name__, *args)
-            # futures_to_tasks = {executor.submit(func, *args): name for name, func, args in tasks}
-
-    for future in as_completed(futures_to_tasks.keys()):
-        report_name, func_name, code, source = futures_to_tasks[future]
-        try:
-            # st.write(report_name, func_name, code, source )
-            results[report_name] = future.result()
-        except Exception as e:
-            # 捕获异常，返回空 DataFrame
-            st.error(f"❌ {report_name}下载失败，参数 （{code}，{source}）。错误代码：{str(e)}")
-            results[report_name] = pd.DataFrame()
-    
-    # sort reports in results, 按照代码定义区的定义返回reports
-    results = {report_name: results[report_name] for report_name, _, _ in tasks}
-    return results
-
-# 计算报表新列，生成单季度和同比报表, reports使用的是全局变量
-@st.cache_data(ttl=3600, show_spinner=False)
-def reports_download_and_calculate(stock_code: str, st_data_source:str, col_maps_dict: dict):
-     ### 从st_data_source下载原始报表
-     # reports_raw = {k: v for k, v in get_all_reports_concurrently(stock_code, DATA_SOURCE[st_data_source]).items()}
-    reports_raw = get_all_reports_concurrently(stock_code, DATA_SOURCE[st_data_source])
-    reports = reports_raw #{k: v.copy() for k, v in reports_raw.items()}
-
-    ### 先格式化来自(ths, em, sina)的三张原始财务报表，统一格式，方便后续进行操作
-    for report_name in [BALANCE_BY_REPORT, PROFIT_BY_REPORT, CASH_BY_REPORT]:
-        df = reports[report_name]
-        reports[report_name] = format_report(df, df_col_maps=col_maps_dict[report_name], source=DATA_SOURCE[st_data_source])
-
-    ### [利润表-报告期] 增加新列关键指标key_cols
-    # 需要的表在这里先都计算好，后面再统一进行筛选
-    # 利润表 先计算[利润表-报告期]自定义新列。然后计算 [利润表-单季度]df，[利润表-报告期同比]df， [利润表-单季度同比]df'，自定义新列会被新的df继承
-    df = reports[PROFIT_BY_REPORT]
-    # 银行和保险行业的报表项目与传统项目不一样，先判断是否存在列名，再进行计算
-    if '营业总收入' in df.columns:
-        df['*营业总收入'] = df['营业总收入']
-    # 2018年以前 研发费用属于管理费用，没有研发费用这一列，数据都是np.nan，需要用0来填充，否则计算出来的也是np.nan
-    if '研发费用' in df.columns:
-        df['研发费用'] = df['研发费用'].fillna(0)
-    ### 利润表-报告期 中增加新的列
-    if {'营业总收入','营业成本'}.issubset(df.columns):
-        df['*毛利润'] = df.eval("`营业总收入` - `营业成本`")
-    if {'营业总收入', '营业税金及附加', '营业成本', '销售费用', '管理费用', '研发费用', '财务费用'}.issubset(df.columns):
-        df['*核心利润'] = df.eval("`营业总收入` - `营业税金及附加` - `营业成本` - `销售费用` - `管理费用` - `研发费用` - `财务费用`")
-    # 2018年以前 研发费用属于管理费用，没有研发费用这一列
-    elif {'营业总收入', '营业税金及附加', '营业成本', '销售费用', '管理费用', '财务费用'}.issubset(df.columns):
-        df['*核心利润'] = df.eval("`营业总收入` - `营业税金及附加` - `营业成本` - `销售费用` - `管理费用` -  - `财务费用`")
-    if '营业利润' in df.columns:
-        df['*营业利润'] = df['营业利润']
-    if '净利润' in df.columns:
-        df['*净利润'] = df['净利润']
-    if '归母净利润' in df.columns:
-        df['*归母净利润'] = df['归母净利润']
-    if '扣非净利润' in df.columns:
-        df['*扣非净利润'] = df['扣非净利润']
-    # 需判断计算得到的key_cols是否在df中存在，然后把key_cols放到前面
-    key_cols = [col for col in ['*营业总收入', '*毛利润', '*核心利润', '*营业利润', '*净利润', '*归母净利润', '*扣非净利润'] if col in df.columns]
-    for idx, col in enumerate(key_cols):
-        # 第一列为报告期，关键指标依次插入到报告期后面
-        idx += 1
-        df.insert(idx, col, df.pop(col))
-    ### 计算 [利润表-单季度]df
-    reports[PROFIT_BY_QUARTER] = get_quarter_report(df, REPORT_DATE)
-    ### 计算 [利润表-报告期同比]df 和 [利润表-单季度同比]df，添加报告期列，保存到reports[PROFIT_PCT_BY_REPORT]和reports[PROFIT_PCT_BY_QUARTER]
-    reports[PROFIT_PCT_BY_REPORT] = reports[PROFIT_BY_REPORT].select_dtypes(include=(float, int)).apply(safe_yoy)
-    reports[PROFIT_PCT_BY_REPORT] = pd.concat([df[REPORT_DATE], reports[PROFIT_PCT_BY_REPORT] ], axis=1)
-    reports[PROFIT_PCT_BY_QUARTER] = reports[PROFIT_BY_QUARTER].select_dtypes(include=(float, int)).apply(safe_yoy)
-    reports[PROFIT_PCT_BY_QUARTER] = pd.concat([df[REPORT_DATE], reports[PROFIT_PCT_BY_QUARTER] ], axis=1)
-    ### 计算 [利润表-报告期 和 利润表-单季度 的各种利润率和费用率]。这些指标不可进行同比计算，需要放到同比计算之后
-    for report_name in [PROFIT_BY_REPORT, PROFIT_BY_QUARTER]:
-        df = reports[report_name]
-        if {'*毛利润', '营业总收入'}.issubset(df.columns):
-            df['毛利润率[%]'] = df.eval('`*毛利润`/ `营业总收入` * 100')
-        if {'*核心利润', '营业总收入'}.issubset(df.columns):
-            df['核心利润率[%]'] = df.eval('`*核心利润`/ `营业总收入` * 100')
-        if {'*营业利润', '营业总收入'}.issubset(df.columns):
-            df['营业利润率[%]'] = df.eval('`*营业利润`/ `营业总收入` * 100')     
-        if {'*净利润', '营业总收入'}.issubset(df.columns):
-            df['净利润率[%]'] = df.eval('`*净利润`/ `营业总收入` * 100') 
-        if {'销售费用', '营业总收入'}.issubset(df.columns):
-            df['销售费用率[%]'] = df.eval('`销售费用`/ `营业总收入` * 100')
-        if {'管理费用', '营业总收入'}.issubset(df.columns):
-            df['管理费用率[%]'] = df.eval('`管理费用`/ `营业总收入` * 100') 
-        if {'研发费用', '营业总收入'}.issubset(df.columns):
-            df['研发费用率[%]'] = df.eval('`研发费用`/ `营业总收入` * 100') 
-        if {'财务费用', '营业总收入'}.issubset(df.columns):
-            df['财务费用率[%]'] = df.eval('`财务费用`/ `营业总收入` * 100')
-        if {'营业总收入', '销售费用', '管理费用', '研发费用', '财务费用'}.issubset(df.columns):
-            df['四费费率[%]'] = df.eval("(`销售费用` + `管理费用` + `研发费用` + `财务费用`)/`营业总收入`*100")
-        elif {'营业总收入', '销售费用', '管理费用', '财务费用'}.issubset(df.columns):
-            df['三费费率[%]'] = df.eval("(`销售费用` + `管理费用` + `财务费用`)/`营业总收入`*100")
-    #####################################
-    ### 计算 [现金流量表-报告期同比] 
-    df= reports[CASH_BY_REPORT]
-    reports[CASH_PCT_BY_REPORT] = df.select_dtypes(include=(float, int)).apply(safe_yoy)
-    reports[CASH_PCT_BY_REPORT] = pd.concat([df[REPORT_DATE], reports[CASH_PCT_BY_REPORT] ], axis=1)
-    ### 计算 [现金流量表-单季度] 和 [现金流量表-单季度同比]
-    reports[CASH_BY_QUARTER] = get_quarter_report(df, REPORT_DATE)
-    df= reports[CASH_BY_QUARTER]
-    reports[CASH_PCT_BY_QUARTER] = df.select_dtypes(include=(float, int)).apply(safe_yoy)
-    reports[CASH_PCT_BY_QUARTER] = pd.concat([df[REPORT_DATE], reports[CASH_PCT_BY_QUARTER] ], axis=1) 
-    ### 计算 [资产负债表-报告期同比]
-    df= reports[BALANCE_BY_REPORT]
-    reports[BALANCE_PCT_BY_REPORT] = df.select_dtypes(include=(float, int)).apply(safe_yoy)
-    reports[BALANCE_PCT_BY_REPORT] = pd.concat([df[REPORT_DATE], reports[BALANCE_PCT_BY_REPORT] ], axis=1)
-
-    ### 计算 [综合分析] 报表。先从各原始报表中取需要的数据列，再merg和sort
-    profit_cols = [REPORT_DATE, '*营业总收入', '*毛利润', '*核心利润', '*营业利润', '*净利润', '营业成本']
-    balance_cols = [REPORT_DATE, '资产总计', '负债合计', '归属于母公司股东权益总计', '股东权益合计', 
-                    '应收票据及应收账款', '其中:应收账款', '应收款项融资', '存货', '固定资产合计', '商誉',
-                    '应付票据及应付账款', '其中:应付账款', '预收款项', '合同负债', '短期借款','长期借款', '应付债券']
-    cash_cols = [REPORT_DATE, '期末现金及现金等价物余额']  #, '销售商品、提供劳务收到的现金', '经营活动产生的现金流量净额',
-    #              '投资活动产生的现金流量净额', '筹资活动产生的现金流量净额']
-    df1 = reports[PROFIT_BY_REPORT][[col for col in profit_cols if col in reports[PROFIT_BY_REPORT].columns]]
-    df2 = reports[BALANCE_BY_REPORT][[col for col in balance_cols if col in reports[BALANCE_BY_REPORT].columns]]
-    df3 = reports[CASH_BY_REPORT][[col for col in cash_cols if col in reports[CASH_BY_REPORT].columns]]
-    reports[CROSS_REPORT] = pd.merge(left=df1, right=df2, how='outer', on=REPORT_DATE)
-    df = reports[CROSS_REPORT]
-    df = pd.merge(left=df, right=df3, how='outer', on=REPORT_DATE)
-    df = df.sort_values(by=REPORT_DATE, axis=0, ascending=False).reset_index(drop=True)
-    # 应收应付总额比[%]
-    if {'应收票据及应收账款', '应收款项融资', '应付票据及应付账款'}.issubset(df.columns):
-        df['应收应付总额比[%]'] = df.eval("(`应收票据及应收账款` + `应收款项融资` - `应付票据及应付账款`)/(`应收票据及应收账款` + `应收款项融资`) *100")
-    elif {'应收票据及应收账款', '应付票据及应付账款'}.issubset(df.columns):
-        df['应收应付总额比[%]'] = df.eval("(`应收票据及应收账款`  - `应付票据及应付账款`)/`应收票据及应收账款` *100")
-    # 应收总额营收比[%]'
-    if {'*营业总收入', '应收票据及应收账款', '应收款项融资'}.issubset(df.columns):
-        df['应收总额营收比[%]'] = (df['应收票据及应收账款'] + df['应收款项融资']) / df['*营业总收入'] * 100
-    elif {'*营业总收入', '应收票据及应收账款'}.issubset(df.columns):
-        df['应收总额营收比[%]'] = (df['应收票据及应收账款']) / df['*营业总收入'] * 100
-    # 存货营业成本比[%]
-    if {'存货', '营业成本'}.issubset(df.columns):
-        df['存货营业成本比[%]'] = df['存货']/df['营业成本'] * 100
-    # 预收总额营收比[%]
-    if '*营业总收入' in df.columns:
-        df['预收总额营收比[%]'] = 0
-        for item in [col for col in ['预收款项', '合同负债'] if col in df.columns]:
-            df[item] = df[item].fillna(0)  # 避免na计算后产生na
-            df['预收总额营收比[%]'] = df['预收总额营收比[%]'] + df[item]/df['*营业总收入']*100
-    # 有息负债
-    df['有息负债'] = 0
-    for item in [col for col in ['短期借款','长期借款', '应付债券'] if col in df.columns]:
-        df[item] = df[item].fillna(0)  # 避免na计算后产生na
-        if item in df.columns:
-            df['有息负债'] = df['有息负债'] + df[item]
-    # 有息负债现金等价物比[%]
-    if {'有息负债', '期末现金及现金等价物余额'}.issubset(df.columns):
-        df['有息负债现金等价物比[%]'] = df['有息负债']/df['期末现金及现金等价物余额'] * 100
-    # 资产负债率[%]
-    if {'负债合计', '资产总计'}.issubset(df.columns):
-        df['资产负债率[%]'] = df['负债合计']/df['资产总计'] * 100
-    # 固定资产总资产比[%]
-    if {'固定资产合计', '资产总计'}.issubset(df.columns):
-        df['固定资产总资产比[%]'] = df['固定资产合计']/df['资产总计'] * 100
-    ## 计算资产周转率和资产周转天数
-    # 总资产周转率 = 营业收入 / 资产总计-平均资产
-    # 固定资产周转率 = 营业收入 / 固定资产合计-平均资产
-    # 应收账款周转率 = 营业收入 / 应收账款-平均资产产
-    # 存货产周转率 = 营业成本 / 存货-平均资产
-    # 应付账款周转率 = 营业成本 / 应付账款-平均资产
-    # 现金周转天数 = 应收周转天数 + 存货周转天数 - 应付账款周转天数
-    df['year'] = df[REPORT_DATE].dt.year
-    df['quarter'] = df[REPORT_DATE].dt.quarter
-    # 定义周转率映射字典。{周转率名称: 资产负债表项目名称, ...}
-    cols_dict = {'总资产': '资产总计', 
-                 '固定资产': '固定资产合计', 
-                 '应收账款': '其中:应收账款',   # '应收票据及应收账款'   '其中:应收账款'
-                 '存货': '存货', 
-                 '应付账款': '其中:应付账款',
-                 'tmp1' :'股东权益合计'}
-    for key, col in cols_dict.items():
-        if col in df.columns:
-            # year_end_asset是series类型，只包含每年第四季度的资产总计，可以使用get(index)方法得到资产，index不存在返回NaN
-            year_end_asset = df[df['quarter']==4].set_index('year')[col]
-            # 从year_end_asset series中获取去年年末资产值，使用get方法不存在返回NaN
-            df[col + '-去年末'] = df['year'].map(lambda year: year_end_asset.get(year-1))
-            df[col + '-平均'] = (df[col] + df[col + '-去年末'])/2
-            # 计算周转率
-            if col in ['资产总计', '固定资产合计', '其中:应收账款']:
-                df[key + '周转率'] = df['*营业总收入'] / df[col + '-平均']
-                # 使用周转率计算周转天数, i为quater
-                for i in range(1, 5):
-                    mask = df['quarter']==i
-                    df.loc[mask, key + '周转天数'] = df.loc[mask, key + '周转率'].map(lambda x: 360/x/4*i)
-            elif col in ['存货', '其中:应付账款']:
-                df[key + '周转率'] = df['营业成本'] / df[col + '-平均']
-                # 使用周转率计算周转天数, i为quater
-                for i in range(1, 5):
-                    mask = df['quarter']==i
-                    df.loc[mask, key + '周转天数'] = df.loc[mask, key + '周转率'].map(lambda x: 360/x/4*i)
-            
-            # pop删除临时列
-            df.pop(col + '-去年末')
-            # df.pop(col + '-平均')
-            # st.write(df1)
-    if {'应收账款周转天数', '存货周转天数', '应付账款周转天数'}.issubset(df.columns):
-        df['现金周转天数'] = df.eval('`应收账款周转天数` + `存货周转天数` - `应付账款周转天数`')
-    # pop删除临时列
-    df.pop('year')
-    df.pop('quarter')
-    ## 计算杜邦分析指标
-    if {'*净利润', '股东权益合计-平均'}.issubset(df.columns):
-        df['净资产收益率[%]'] = df['*净利润'] / df['股东权益合计-平均'] * 100
-    if {'*净利润', '资产总计-平均'}.issubset(df.columns):
-        df['总资产收益率[%]'] = df['*净利润'] / df['资产总计-平均'] * 100
-    if {'*净利润', '*营业总收入'}.issubset(df.columns):
-        df['净利润率[%]'] = df['*净利润'] / df['*营业总收入'] * 100
-    if {'资产总计-平均', '股东权益合计-平均'}.issubset(df.columns):
-        df['权益乘数'] = df['资产总计-平均'] / df['股东权益合计-平均']
-
-    ## 自定义列排序
-    # cal_cols = [col for col in ['应收应付总额比[%]', '应收总额营收比[%]', '存货营业成本比[%]', '预收总额营收比[%]',  
-    #             '有息负债', '有息负债现金等价物比[%]', '资产负债率[%]', '固定资产总资产比[%]'] if col in df.columns]
-    # for idx, col in enumerate(cal_cols):
-    #     # 第一列为报告期，关键指标依次插入到报告期后面
-    #     idx += 1
-    #     df.insert(idx, col, df.pop(col))
-    cross_items = col_maps_dict[CROSS_REPORT]['item'].to_list()
-    # col_maps中的列放到前面，没在里面的放到后面
-    col_orders = [c for c in cross_items if c in df.columns] + [c for c in df.columns if c not in cross_items]
-    df = df[col_orders]
-    reports[CROSS_REPORT] = df  # merge函数产生新的dataframe，需要把df再赋值回去
-    # st.write( reports[CROSS_REPORT])
-    # st.stop()
-     #####################################
-    return reports
+from report_data import *
+from report_calc import compare_metric
+from instrumentation import get_metrics, start_exporters
 
 
 ##########################################################################################
@@ -338,9 +16,40 @@ def reports_download_and_calculate(stock_code: str, st_data_source:str, col_maps
 ##########################################################################################
 st.set_page_config(page_title="📈Financial Report", layout="wide")
 st.title("📈Financial Reprot Analysis")
+# 设置了环境变量METRICS_PORT或METRICS_LOG时导出性能统计，只在第一次运行时启动
+start_exporters()
+
+# 性能调试面板：进程内累计的下载、计算、画图耗时和缓存命中次数（到上一次运行为止）
+def show_metrics_panel():
+    metrics = get_metrics()
+    snapshot = metrics.snapshot()
+    labels_str = lambda labels: ' '.join(f'{k}={v}' for k, v in labels.items())
+    if snapshot['timers']:
+        df_timers = pd.DataFrame([{'name': t['name'], 'labels': labels_str(t['labels']), 'count': t['count'],
+                                   'total[s]': t['sum'], 'mean[ms]': t['sum'] / t['count'] * 1000, 'max[ms]': t['max'] * 1000}
+                                  for t in snapshot['timers']]).sort_values('total[s]', ascending=False)
+        st.dataframe(df_timers, hide_index=True, height=300)
+    caches = {}
+    for c in snapshot['counters']:
+        if c['name'].endswith('cache_requests_total'):
+            labels = dict(c['labels'])
+            result = labels.pop('result')
+            caches.setdefault((c['name'], labels_str(labels)), {'hit': 0, 'miss': 0})[result] += c['value']
+    if caches:
+        df_caches = pd.DataFrame([{'cache': labels if name == 'cache_requests_total' else f'report_views {labels}', 'hit': v['hit'], 'miss': v['miss'], 'hit rate[%]': v['hit'] / (v['hit'] + v['miss']) * 100}
+                                  for (name, labels), v in caches.items()])
+        st.dataframe(df_caches, hide_index=True)
+    col1, col2 = st.columns(2)
+    col1.download_button('Prometheus', metrics.to_prometheus(), file_name='metrics.prom', mime='text/plain')
+    col2.download_button('JSON', metrics.to_json(), file_name='metrics.json', mime='application/json')
 
 with st.sidebar:
-    st_data_source = st.selectbox('select data source:', ['ths', 'east money', 'sina'], 0)
+    st_data_source = st.selectbox('select data source:', list(DATA_SOURCE) + [AUTO_SOURCE], 0)
+    # 自动选择数据源时，可以用其他数据源补齐缺失的字段，需要等待所有数据源下载完成
+    st_merge_sources = st.checkbox('合并多个数据源的字段', False) if st_data_source == AUTO_SOURCE else False
+    if st.checkbox('🐞性能调试', False):
+        with st.expander('性能统计', expanded=True):
+            show_metrics_panel()
     # st_slide_years = st.slider()
     # st_sheet_type = st.selectbox('select sheet type')
 
@@ -351,6 +60,70 @@ with st.spinner('⏳ 正在加载表格...'):
     col_maps_dict = get_col_maps_dict()
     df_stock_list['code'] = df_stock_list["code"].astype(str).str.zfill(6)
 
+### =========================== 多股对比 ================================================
+with st.sidebar:
+    st_compare_mode = st.toggle('🆚多股对比', False)
+if st_compare_mode:
+    st_compare_codes = st.text_input("ℹ️Please input stock codes to compare, separated by space or comma (eg: 600519 000858 000568):")
+    # 去重，只保留股票列表中存在的代码
+    compare_codes = [code.zfill(6) for code in re.split(r'[\s,，]+', st_compare_codes.strip()) if code]
+    compare_codes = [code for code in dict.fromkeys(compare_codes) if code in set(df_stock_list['code'])]
+    st_compare_metrics = st.multiselect('选择对比指标：', options=list(COMPARE_METRICS), default=['*核心利润', '净资产收益率[%]', '现金周转天数'])
+    st_compare_years = st.slider('对比年数：', min_value=1, max_value=20, value=5)
+    if not compare_codes:
+        st.stop()
+    with st.spinner(f"⏳ 正在下载和计算{len(compare_codes)}只股票的数据，请稍候..."):
+        reports_by_code = load_reports_for_codes(tuple(compare_codes), DATA_SOURCE.get(st_data_source, AUTO_SOURCE), col_maps_dict)
+    missing_codes = [code for code in compare_codes if code not in reports_by_code]
+    if missing_codes:
+        st.error(f"❌ {', '.join(missing_codes)} 数据下载失败")
+    code_names = dict(zip(df_stock_list['code'], df_stock_list['name']))
+    # 每个指标一张图，多只股票的数据按报告期对齐
+    df_latest = pd.DataFrame()
+    for metric in st_compare_metrics:
+        report_name = COMPARE_METRICS[metric]
+        df = compare_metric(reports_by_code, report_name, metric)
+        if df.empty:
+            continue
+        df = df[df.index.year > df.index.year.max() - st_compare_years]
+        df.columns = [f'{code_names[code]}({code})' for code in df.columns]
+        df_latest[metric] = df.iloc[0]
+        st.plotly_chart(plot_compare_lines(df, f'{metric} - {report_name}', height=350), width='stretch')
+    # 最新报告期的指标并排显示
+    if not df_latest.empty:
+        st.dataframe(df_to_str(df_latest.T), width='stretch')
+    st.stop()
+
+### =========================== 全市场筛选 ================================================
+with st.sidebar:
+    st_screen_mode = st.toggle('🔎全市场筛选', False)
+if st_screen_mode:
+    # 自动选择数据源时没有保存计算好的报表，使用第一个数据源
+    screen_source = DATA_SOURCE.get(st_data_source, AUTO_SOURCES[0])
+    with st.spinner('⏳ 正在加载全市场指标...'):
+        screener = get_screener(screen_source)
+    if screener.table.empty:
+        st.warning(f'存储中没有{screen_source}的预计算报表，请先运行 python precompute.py --source {screen_source}')
+        st.stop()
+    col1, col2, col3, col4 = st.columns(4)
+    screen_metrics = list(SCREEN_METRICS)
+    st_sort_by = col1.selectbox('排序指标：', options=screen_metrics, index=screen_metrics.index('核心利润单季同比[%]'))
+    st_screen_date = col2.selectbox('报告期：', options=['最新'] + [date.strftime('%Y-%m-%d') for date in screener.report_dates()])
+    st_screen_top = col3.number_input('显示数量：', min_value=10, max_value=1000, value=50, step=10)
+    st_screen_ascending = col4.toggle('升序', False)
+    # 每个筛选指标一行，最小值和最大值为空时不限制
+    filters = {}
+    for metric in st.multiselect('筛选条件：', options=screen_metrics):
+        col1, col2 = st.columns(2)
+        filters[metric] = (col1.number_input(f'{metric} ≥', value=None), col2.number_input(f'{metric} ≤', value=None))
+    df_screen = screener.screen(st_sort_by, top=int(st_screen_top), ascending=st_screen_ascending, filters=filters,
+                                report_date=None if st_screen_date == '最新' else pd.Timestamp(st_screen_date))
+    df_screen.insert(0, 'name', df_screen.index.map(dict(zip(df_stock_list['code'], df_stock_list['name']))))
+    df_screen[REPORT_DATE] = df_screen[REPORT_DATE].dt.strftime('%Y-%m-%d')
+    st.caption(f'{screen_source}，{len(screener.codes)}只股票，百分位为在全部有数据的股票中的排名')
+    st.dataframe(df_screen.round(2), width='stretch')
+    st.stop()
+
 st_stock_code = st.text_input("ℹ️Please input stock code, name or initial (eg: 600519 or 贵州茅台 or gzmt):")
 
 # variable declaration under if statement for future use
@@ -360,24 +133,8 @@ stock_selected_row = None
 # filter df_stock_list with input as filter condition
 st_stock_code = st_stock_code.strip()
 if st_stock_code:
-    ### 用cache_data包裹df_stock_list, 来提升执行效率。输入股票代码和df_stock_list信息，返回筛选后的股票代码
-    @st.cache_data(ttl=3600)
-    def get_df_stock_list_filterd(st_stock_code: str, df_stock_list: pd.DataFrame):
-        st_stock_code = st_stock_code
-        # filter df with input
-        # df_stock_list_filtered = df_stock_list[(df_stock_list['code'].str.contains(st_stock_code, regex=False)) | 
-        #                 df_stock_list['name'].str.contains(st_stock_code, regex=False) | df_stock_list['initial'].str.contains(st_stock_code.upper(), regex=False)]
-        query_filter_expr = (
-            "code.str.contains(@st_stock_code, regex=False, na=False) "  # don't match na
-            "or name.str.contains(@st_stock_code, regex=False, na=False) "
-            "or initial.str.contains(@st_stock_code.upper(), regex=False, na=False)"
-        )
-        df_stock_list_filtered = df_stock_list.query(query_filter_expr, engine='python')
-        df_stock_list_filtered.reset_index(drop=True, inplace=True)
-        df_stock_list_filtered.index += 1  # index for web-user should start from 1
-        return df_stock_list_filtered
-    
-    df_stock_list_filtered = get_df_stock_list_filterd(st_stock_code, df_stock_list)
+    ### 用预先建立的索引搜索股票代码、名称和拼音首字母，结果按匹配程度排序
+    df_stock_list_filtered = get_stock_search_index().search(st_stock_code)
     # show df_stock_list_filterd if not empty else show "no stock found"
     if not df_stock_list_filtered.empty:
         st.success(f"✅  {len(df_stock_list_filtered)} stock codes found as bellow:")
@@ -412,8 +169,17 @@ with st.spinner("⏳ 正在下载数据，请稍候..."):
     # stock_balance_sheet_by_report = get_balance_sheet_by_report(stock_code, DATA_SOURCE[st_data_source])
     # reports_raw = {k: v for k, v in get_all_reports_concurrently(stock_code, DATA_SOURCE[st_data_source]).items()}
     # 使用参数stock_code和st_data_source，下载财务报表。然后，计算报表新列，生成单季度和同比报表，使用cache_data修饰提升运行性能
-    reports = reports_download_and_calculate(stock_code, st_data_source, col_maps_dict)
-st.success("✅ 数据下载完成！")
+    report_views = get_report_views(stock_code, st_data_source, col_maps_dict, st_merge_sources)
+    reports = report_views.reports
+if st_data_source == AUTO_SOURCE:
+    st.caption(f'数据源：{reports.source}' + (f'，补齐字段：{", ".join(reports.fill_reports)}' if reports.fill_reports else ''))
+# 下载线程中的失败在主线程中显示
+source = reports.source if st_data_source == AUTO_SOURCE else DATA_SOURCE[st_data_source]
+fetch_failures = get_fetch_failures(stock_code, source)
+for report_name, error in fetch_failures.items():
+    st.error(f"❌ {report_name}下载失败，参数 （{stock_code}，{source}）。错误代码：{error}")
+if not fetch_failures:
+    st.success("✅ 数据下载完成！")
 
 
 ### ==================================== sidebar筛选选项 =========================================
@@ -431,11 +197,8 @@ def st_quaters_filter_change():
 # 设置年份过滤
 with st.sidebar:
     # st.markdown('---')
-    # 拼接三张原始报表的报告期列，获得最大年份和最小年份
-    all_years = pd.concat([reports[report_name][REPORT_DATE] for report_name in [PROFIT_BY_REPORT, CASH_BY_REPORT, BALANCE_BY_REPORT]])
-    # all_years = pd.to_datetime(all_years, errors='coerce')
-    min_year = all_years.dt.year.min()
-    max_year = all_years.dt.year.max()
+    # 三张原始报表报告期的最大年份和最小年份
+    min_year, max_year = report_views.year_range()
     # slider 默认值设为全范围
     st_years_filter = st.slider(
         '选择报表时间范围：',
@@ -451,6 +214,8 @@ with st.sidebar:
     # checkbox 图表类别中 显示图表的值  显示图表同比
     st_cb_show_report = st.checkbox('图表显示值', True)
     st_cb_show_pct = st.checkbox('图表显示同比', True)
+    # 选择的列较多时，所有图表合并成一个figure，减少浏览器中的图表数量
+    st_cb_chart_grid = st.checkbox('🧩合并为一个图表', False)
 
     st.markdown('---')
     st_na_invisible = st.checkbox('🙈隐藏空行', True)
@@ -461,24 +226,9 @@ with st.sidebar:
 
 ### ===================================  对报表进行筛选 ==========================================
 ### 对各报表进行筛选 1. slider年份筛选   2. 季度筛选   3. 隐藏空值筛选   4. col_maps中item列筛选
-start_year, end_year = st_years_filter
-
-for report_name, df in reports.items():
-    # 年份筛选
-    df = df[df[REPORT_DATE].dt.year.between(start_year, end_year)]
-    # 季度筛选
-    df = df[df[REPORT_DATE].dt.quarter.isin(st_quarters_filter)]
-    if st_Q_latest and df.iloc[0][REPORT_DATE]!=reports[report_name].iloc[0][REPORT_DATE]:
-        new_row = reports[report_name].iloc[[0]]
-        df = pd.concat([new_row, df], axis=0)
-    reports_filtered[report_name] = df  
-    if st_na_invisible:
-        reports_filtered[report_name] = reports_filtered[report_name].dropna(how='all', axis=1)
-    # 下面7张表需要进行col_maps筛选和排序。CROSS_REPORT报表计算需要的列没在col_maps中，可以隐藏。
-    if st_show_col_maps_only and report_name in [PROFIT_BY_REPORT, CASH_BY_REPORT, BALANCE_BY_REPORT, 
-                                PROFIT_BY_QUARTER, CASH_BY_QUARTER, PROFIT_PCT_BY_REPORT, PROFIT_PCT_BY_QUARTER,
-                                CASH_PCT_BY_REPORT, CASH_PCT_BY_QUARTER, BALANCE_PCT_BY_REPORT, CROSS_REPORT]:
-        reports_filtered[report_name] = reports_filtered[report_name][[col for col in col_maps_dict[report_name]['item'] if col in reports_filtered[report_name].columns]]
+# 只有显示的报表才会筛选，筛选条件不变的报表直接使用缓存的筛选结果
+reports_filtered = report_views.filtered(st_years_filter, st_quarters_filter, latest=st_Q_latest,
+                                         na_invisible=st_na_invisible, col_maps_only=st_show_col_maps_only)
 
 ### ======================================= 数据可视化  ==========================================
 # 报表可视化category的segmented_control，使用on_change函数监测控件值，为空的话重置为前一个值
@@ -494,6 +244,45 @@ def st_category_change():
         st.session_state.st_category = st.session_state.st_category_pre
     st.session_state.st_category_pre = st.session_state.st_category
 
+# 图表缓存在report_views中，key为(报表, 筛选条件, 列, 标题, 高度)，只改变其他控件时不需要重新画图
+def plot_bar_cached(report_name: str, col: str, title_suffix: str) -> go.Figure:
+    return reports_filtered.cached(report_name, ('bar', col, title_suffix, st_chart_height),
+                                   lambda: plot_bar_quarter_go(reports_filtered[report_name], col, title_suffix=title_suffix, height=st_chart_height))
+
+# 画出report1中cols列的值和report2中的同比。st_cb_chart_grid为True时所有图表画在一个figure中
+def show_bar_charts(report1: str, report2: str, cols: list[str], title_suffix: str):
+    charts = []
+    for col in cols:
+        if st_cb_show_report:
+            charts.append((report1, col, title_suffix))
+        # 有些col在主df里面有，同比计算后可能没有，需要进行判断再画
+        if st_cb_show_pct and col in reports_filtered[report2].columns:
+            charts.append((report2, col, title_suffix + '同比'))
+    if not st_cb_chart_grid:
+        for report_name, col, suffix in charts:
+            st.plotly_chart(plot_bar_cached(report_name, col, suffix), width='stretch')
+    elif charts:
+        # 缓存在report1下，key包含所有子图
+        fig = reports_filtered.cached(report1, ('grid', tuple(charts), st_chart_height),
+                                      lambda: plot_bar_quarter_grid_go([(reports_filtered[report_name], col, suffix) for report_name, col, suffix in charts],
+                                                                       height=st_chart_height))
+        st.plotly_chart(fig, width='stretch')
+
+# 单季度报表中缺少上一季度、无法计算的单元格显示的内容，和没有数据的 '-' 区分
+UNDERIVABLE_STR = '缺上季'
+
+# 表格显示处理：格式化为字符串，转置，报告期设置成列名
+# underivable为ReportViews.underivable的mask，这些单元格显示UNDERIVABLE_STR
+def table_for_display(df: pd.DataFrame, underivable: pd.DataFrame | None = None) -> pd.DataFrame:
+    # 格式化'报告期'列显示格式，数字转成 万亿 亿 万 单位的字符串，空值替换为 '-'
+    df_table = df_to_str(df)
+    if underivable is not None:
+        df_table = df_table.mask(underivable.to_numpy(), UNDERIVABLE_STR)
+    df_table = df_table.T
+    # 报告期设置成列名columns
+    df_table.columns = df_table.iloc[0]
+    return df_table[1:]
+
 @st.fragment
 def show_report_category():
     # 使用st.tabs没有局部刷新功能，改变tabs下的任何控件都会执行所有tabs下的代码，切换tab不再执行任何代码，切换会快，但是改变控件会耗时。st.tabs和st.segmented_control各有利弊
@@ -512,11 +301,10 @@ def show_report_category():
         # 图表 利润表-报告期 和 利润表-单季度
         if st_report_choice==PROFIT_BY_REPORT or st_report_choice==PROFIT_BY_QUARTER:
             if st_report_choice==PROFIT_BY_REPORT:
-                df_plot1 = reports_filtered[PROFIT_BY_REPORT].copy()
-                df_plot2 = reports_filtered[PROFIT_PCT_BY_REPORT].copy()
+                report1, report2 = PROFIT_BY_REPORT, PROFIT_PCT_BY_REPORT
             if st_report_choice==PROFIT_BY_QUARTER:
-                df_plot1 = reports_filtered[PROFIT_BY_QUARTER].copy()
-                df_plot2 = reports_filtered[PROFIT_PCT_BY_QUARTER].copy()
+                report1, report2 = PROFIT_BY_QUARTER, PROFIT_PCT_BY_QUARTER
+            df_plot1 = reports_filtered[report1]
             ### 使用multiselect 过滤
             cols = df_plot1.select_dtypes(include=['float', 'int']).columns
             # default_cols需要检测要显示的列是否存在，有些数据缺失可能没有计算出这些列（如银行和保险行业）
@@ -525,95 +313,75 @@ def show_report_category():
             # 所以使用key参数的session_state没有记忆功能，重新创建会重新初始化。可以在此处创建一个命名与本控件无关的session变量来保存和调用记忆。
             st_selected_cols = st.multiselect('选择要显示的列：', options=cols, default=default_cols)
             title_suffix = st_report_choice[st_report_choice.index('-')+1::]
-            for col in st_selected_cols:
-                if st_cb_show_report:
-                    fig1 = plot_bar_quarter_go(df_plot1, col, title_suffix=title_suffix, height=st_chart_height)
-                    st.plotly_chart(fig1, width='stretch')
-                # 有些col在主df里面有，同比计算后可能没有，需要进行判断再画
-                if st_cb_show_pct and col in df_plot2.columns:
-                    fig2 = plot_bar_quarter_go(df_plot2, col, title_suffix=title_suffix + '同比', height=st_chart_height)
-                    st.plotly_chart(fig2, width='stretch')
+            show_bar_charts(report1, report2, st_selected_cols, title_suffix)
 
         # 图表 现金流量表-报告期 和 现金流量表-单季度
         if st_report_choice==CASH_BY_REPORT or st_report_choice==CASH_BY_QUARTER:
             if st_report_choice==CASH_BY_REPORT:
-                df_plot1 = reports_filtered[CASH_BY_REPORT].copy()
-                df_plot2 = reports_filtered[CASH_PCT_BY_REPORT].copy()
+                report1, report2 = CASH_BY_REPORT, CASH_PCT_BY_REPORT
             if st_report_choice==CASH_BY_QUARTER:
-                df_plot1 = reports_filtered[CASH_BY_QUARTER].copy()
-                df_plot2 = reports_filtered[CASH_PCT_BY_QUARTER].copy()
+                report1, report2 = CASH_BY_QUARTER, CASH_PCT_BY_QUARTER
+            df_plot1 = reports_filtered[report1]
             ### 使用multiselect 过滤
             cols = df_plot1.select_dtypes(include=['float', 'int']).columns
             default_cols = [col for col in ['销售商品、提供劳务收到的现金', '购建固定资产、无形资产和其他长期资产支付的现金', '取得子公司及其他营业单位支付的现金净额', 
                         '经营活动产生的现金流量净额', '投资活动产生的现金流量净额','筹资活动产生的现金流量净额'] if col in cols]
             st_selected_cols = st.multiselect('请选择要显示的列：', options=cols, default=default_cols)
             title_suffix = st_report_choice[st_report_choice.index('-')+1::]
-            for col in st_selected_cols:
-                if st_cb_show_report:
-                    fig1 = plot_bar_quarter_go(df_plot1, col, title_suffix=title_suffix, height=st_chart_height)
-                    st.plotly_chart(fig1, width='stretch')
-                # 有些col在主df里面有，同比计算后可能没有，需要进行判断再画
-                if st_cb_show_pct and col in df_plot2.columns:
-                    fig2 = plot_bar_quarter_go(df_plot2, col, title_suffix=title_suffix + '同比', height=st_chart_height)
-                    st.plotly_chart(fig2, width='stretch')
+            show_bar_charts(report1, report2, st_selected_cols, title_suffix)
         
         # 图表 资产负债表-报告期
         if st_report_choice==BALANCE_BY_REPORT:
             ### 画资产和负债的饼图
-            fig1, fig2 = plot_pie_balance(col_maps_dict=col_maps_dict, df_balance=reports_filtered[BALANCE_BY_REPORT], height=400)
+            cols_date = reports_filtered[BALANCE_BY_REPORT][REPORT_DATE].dt.strftime('%Y-%m').to_list()
+            st_date = st.selectbox('选择资产负债表饼图日期：', options=cols_date)
+            fig1, fig2 = plot_pie_balance(col_maps_dict=col_maps_dict, df_balance=reports_filtered[BALANCE_BY_REPORT],
+                                          date_index=cols_date.index(st_date), height=400)
             col1, col2 = st.columns(2)
             col1.plotly_chart(fig1)
             col2.plotly_chart(fig2)
 
-            df_plot1 = reports_filtered[BALANCE_BY_REPORT].copy()
-            df_plot2 = reports_filtered[BALANCE_PCT_BY_REPORT].copy()
+            report1, report2 = BALANCE_BY_REPORT, BALANCE_PCT_BY_REPORT
+            df_plot1 = reports_filtered[report1]
             ### 使用multiselect 过滤
             cols = df_plot1.select_dtypes(include=['float', 'int']).columns
             default_cols = [col for col in ['应收票据及应收账款', '应收款项融资', '存货', 
                         '固定资产合计', '在建工程合计','商誉', '合同负债', '预收款项'] if col in cols]
             st_selected_cols = st.multiselect('请选择要显示的列：', options=cols, default=default_cols)
             title_suffix = st_report_choice[st_report_choice.index('-')+1::]
-            for col in st_selected_cols:
-                if st_cb_show_report:
-                    fig1 = plot_bar_quarter_go(df_plot1, col, title_suffix=title_suffix, height=st_chart_height)
-                    st.plotly_chart(fig1, width='stretch')
-                # 有些col在主df里面有，同比计算后可能没有，需要进行判断再画
-                if st_cb_show_pct and col in df_plot2.columns:
-                    fig2 = plot_bar_quarter_go(df_plot2, col, title_suffix=title_suffix + '同比', height=st_chart_height)
-                    st.plotly_chart(fig2, width='stretch') 
+            show_bar_charts(report1, report2, st_selected_cols, title_suffix) 
 
 
     # with tab3_tables:
     if st_category == CATEGORY_OPTIONS[2]:
-        for report_name, df in reports_filtered.items():
-            with st.expander(f'{report_name}'):
-                df_filtered = df
-                # 下面进行网页显示处理
-                # 格式化'报告期'列显示格式
-                df_filtered = df_filtered.map(value_to_str)
-                # df转置并设置第一行报告期为列名
-                df_filtered = df_filtered.T
-                # 报告期设置成列名columns
-                df_filtered.columns = df_filtered.iloc[0]
-                df_filtered = df_filtered[1:]
-                # 显示，空值替换为 '-'
-                st_table_selected_rows = st.dataframe(df_filtered.map(value_to_str), on_select='rerun',
-                    column_config={
-                    "_index": st.column_config.Column(
-                    "报告期",  # 可以在这里设置索引列的新标题
-                    width=120 if '现金流量表' in report_name else 100,  # 调整宽度，例如 "small", "medium", "large"
-                    ),
-                    # 也可以在这里配置其他数据列...
-                    })
-                # 画出表格中选中的数据行，行row对应df的列row+1
-                if len(st_table_selected_rows['selection']['rows']) > 0:
-                    for row in st_table_selected_rows['selection']['rows']:
-                        if df.iloc[:,row+1].dtype not in ['float', 'int']:
-                            st.markdown(f'"{df.columns[row+1]}" 不是数值类型')
-                        else:
-                            # 显示的table是df的转置，df的列对应table的行row+1
-                            fig1 = plot_bar_quarter_go(df, df.columns[row+1], title_suffix=f'[{report_name}]', height=st_chart_height)
-                            st.plotly_chart(fig1, width='stretch')
+        # 只显示选中的一张报表，其他报表不做格式化，也不发送到浏览器
+        st_table_choice = st.segmented_control('选择报表：', options=list(reports_filtered), default=PROFIT_BY_QUARTER, key='st_table_choice')
+        if st_table_choice is not None:
+            report_name = st_table_choice
+            df = reports_filtered[report_name]
+            # 格式化和转置后的表格缓存在report_views中，筛选条件不变时不重新计算
+            underivable = reports_filtered.underivable(report_name)
+            df_filtered = reports_filtered.cached(report_name, ('table',), lambda: table_for_display(df, underivable))
+            if underivable is not None and underivable.to_numpy().any():
+                st.caption(f'"{UNDERIVABLE_STR}"：有累计值，但缺少同一年的上一季度报告，无法计算单季度值')
+            # 显示
+            st_table_selected_rows = st.dataframe(df_filtered, on_select='rerun',
+                column_config={
+                "_index": st.column_config.Column(
+                "报告期",  # 可以在这里设置索引列的新标题
+                width=120 if '现金流量表' in report_name else 100,  # 调整宽度，例如 "small", "medium", "large"
+                ),
+                # 也可以在这里配置其他数据列...
+                })
+            # 画出表格中选中的数据行，行row对应df的列row+1
+            if len(st_table_selected_rows['selection']['rows']) > 0:
+                for row in st_table_selected_rows['selection']['rows']:
+                    if df.iloc[:,row+1].dtype.kind not in 'fi':
+                        st.markdown(f'"{df.columns[row+1]}" 不是数值类型')
+                    else:
+                        # 显示的table是df的转置，df的列对应table的行row+1
+                        fig1 = plot_bar_cached(report_name, df.columns[row+1], f'[{report_name}]')
+                        st.plotly_chart(fig1, width='stretch')
 
 show_report_category()
 
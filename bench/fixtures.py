@@ -0,0 +1,164 @@
+# 性能测试用的原始报表fixture，每个fixture是一只代表性股票在一个数据源的三张原始报表（get_all_reports_concurrently的返回值）
+# 保存在bench/fixtures/<profile>-<source>.json.gz，性能测试只读取这些文件，不访问网络
+# 注意：仓库中的fixture是没有网络时用--synthetic按col_maps生成的模拟数据（文件中synthetic为true），不是真实下载的报表
+# 模拟数据的字段和格式与akshare返回的一致，数值是随机的；有网络时用--record重新录制真实数据
+# 用法:
+#   python -m bench.fixtures --record [--profiles bank] [--sources ths]   联网下载真实数据，覆盖fixture文件
+#   python -m bench.fixtures --synthetic                                  没有网络时按col_maps生成模拟数据
+import argparse
+import gzip
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from common import *
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+FIXTURE_SOURCES = list(DATA_SOURCE.values())
+RAW_REPORT_NAMES = [PROFIT_BY_REPORT, CASH_BY_REPORT, BALANCE_BY_REPORT]
+
+# 代表性股票 {profile: (股票代码, 保留的最新报告期数)}，报告期数为None时全部保留
+# 银行和保险没有营业成本、存货、流动资产合计等一般企业的字段，新股只有几个报告期（用贵州茅台最新的6个报告期模拟）
+FIXTURE_PROFILES = {
+    'industrial': ('600519', None),
+    'bank': ('600036', None),
+    'insurer': ('601318', None),
+    'new_listing': ('600519', 6),
+}
+
+# 模拟数据：每个profile的报告期数和全部为空的字段（col_maps中的item）
+SYNTHETIC_PERIODS = {'industrial': 40, 'bank': 40, 'insurer': 40, 'new_listing': 6}
+FINANCIAL_MISSING = ['营业成本', '营业税金及附加', '销售费用', '研发费用', '存货', '应收票据及应收账款', '其中:应收账款',
+                     '应付票据及应付账款', '其中:应付账款', '合同负债', '预收款项', '流动资产合计', '非流动资产合计',
+                     '流动负债合计', '非流动负债合计', '购买商品、接受劳务支付的现金', '销售商品、提供劳务收到的现金']
+SYNTHETIC_MISSING = {'bank': FINANCIAL_MISSING, 'insurer': FINANCIAL_MISSING + ['吸收存款及同业存放', '发放委托贷款及垫款']}
+
+
+def fixture_names() -> list[str]:
+    return [f'{profile}-{source}' for profile in FIXTURE_PROFILES for source in FIXTURE_SOURCES]
+
+
+def fixture_path(name: str) -> str:
+    return os.path.join(FIXTURE_DIR, f'{name}.json.gz')
+
+
+def _json_value(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, pd.Timestamp):
+        return str(value)
+    raise TypeError(f'{type(value)} is not JSON serializable')
+
+
+def save_fixture(name: str, reports_raw: dict[str, pd.DataFrame], synthetic: bool):
+    """按行保存原始值（ths的'亿''万'字符串和False空值保持不变），读取后和akshare返回的df相同。synthetic标记是否为模拟数据"""
+    data = {'synthetic': synthetic}
+    for report_name in RAW_REPORT_NAMES:
+        df = reports_raw[report_name].astype(object)
+        df = df.where(df.notna(), None)
+        data[report_name] = {'columns': df.columns.to_list(), 'data': df.to_numpy().tolist()}
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    with gzip.open(fixture_path(name), 'wt', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, default=_json_value)
+
+
+def _read_fixture(name: str) -> dict:
+    with gzip.open(fixture_path(name), 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def is_synthetic(name: str) -> bool:
+    """fixture是否为模拟数据，没有标记的旧文件按模拟数据处理"""
+    return _read_fixture(name).get('synthetic', True)
+
+
+def load_fixture(name: str) -> dict[str, pd.DataFrame]:
+    data = _read_fixture(name)
+    return {report_name: pd.DataFrame(data[report_name]['data'], columns=data[report_name]['columns'])
+            for report_name in RAW_REPORT_NAMES}
+
+
+def record_fixture(profile: str, source: str) -> dict[str, pd.DataFrame]:
+    """联网下载profile对应股票的原始报表"""
+    from report_data import get_all_reports_concurrently
+    code, periods = FIXTURE_PROFILES[profile]
+    reports_raw = get_all_reports_concurrently(code, source)
+    if periods is not None:
+        reports_raw = {report_name: df.head(periods) for report_name, df in reports_raw.items()}
+    return reports_raw
+
+
+def _ths_str(value: float):
+    if np.isnan(value):
+        return False
+    if abs(value) >= 1e8:
+        return f'{value / 1e8:.2f}亿'
+    if abs(value) >= 1e4:
+        return f'{value / 1e4:.2f}万'
+    return f'{value:.2f}'
+
+
+def synthetic_fixture(profile: str, source: str, col_maps_dict: dict, seed: int = 0) -> dict[str, pd.DataFrame]:
+    """
+    按col_maps中source的列名生成模拟的原始报表，格式和akshare返回的一致
+    利润表和现金流量表是年内累计值，资产负债表是时点值，5%的值为空
+    """
+    rng = np.random.default_rng([seed, list(FIXTURE_PROFILES).index(profile), FIXTURE_SOURCES.index(source)])
+    dates = pd.date_range(end='2025-09-30', periods=SYNTHETIC_PERIODS[profile], freq='QE')[::-1]
+    missing = set(SYNTHETIC_MISSING.get(profile, []))
+    reports_raw = {}
+    for report_name in RAW_REPORT_NAMES:
+        df_col_maps = col_maps_dict[report_name].dropna(subset=[source])
+        date_col = df_col_maps[source].iloc[0]
+        data = {}
+        for col, item in zip(df_col_maps[source].iloc[1:], df_col_maps['item'].iloc[1:]):
+            if report_name == BALANCE_BY_REPORT:
+                values = rng.uniform(1e7, 5e10, len(dates))
+            else:
+                # 按单季度值生成，同一年内累加（dates为降序）
+                quarter = pd.Series(rng.uniform(-1e8, 3e9, len(dates)), index=dates).iloc[::-1]
+                values = quarter.groupby(quarter.index.year).cumsum().iloc[::-1].to_numpy(copy=True)
+            values[rng.random(len(dates)) < 0.05] = np.nan
+            if item in missing:
+                values[:] = np.nan
+            data[col] = values
+        df = pd.DataFrame(data)
+        if source == 'ths':
+            df = pd.DataFrame({col: [_ths_str(value) for value in values] for col, values in data.items()}, dtype=object)
+            df.insert(0, date_col, dates.strftime('%Y-%m-%d'))
+        elif source == 'em':
+            df.insert(0, date_col, dates.strftime('%Y-%m-%d 00:00:00'))
+            df.insert(0, 'SECUCODE', FIXTURE_PROFILES[profile][0] + '.SH')
+            df['TOTAL_OPERATE_INCOME_YOY'] = rng.uniform(-50, 50, len(dates))
+        else:
+            df.insert(0, date_col, dates.strftime('%Y%m%d'))
+        reports_raw[report_name] = df
+    return reports_raw
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='录制或生成性能测试用的原始报表fixture')
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('--record', action='store_true', help='联网下载真实的原始报表')
+    mode.add_argument('--synthetic', action='store_true', help='按col_maps生成模拟的原始报表')
+    parser.add_argument('--profiles', nargs='*', default=list(FIXTURE_PROFILES), choices=list(FIXTURE_PROFILES))
+    parser.add_argument('--sources', nargs='*', default=FIXTURE_SOURCES, choices=FIXTURE_SOURCES)
+    args = parser.parse_args(argv)
+
+    from report_data import get_col_maps_dict
+    col_maps_dict = get_col_maps_dict()
+    for profile in args.profiles:
+        for source in args.sources:
+            name = f'{profile}-{source}'
+            reports_raw = record_fixture(profile, source) if args.record else synthetic_fixture(profile, source, col_maps_dict)
+            if any(df.empty for df in reports_raw.values()):
+                print(f'❌ {name}: 原始报表下载失败，保留原来的fixture')
+                continue
+            save_fixture(name, reports_raw, synthetic=args.synthetic)
+            print(f'{name}: {[len(df) for df in reports_raw.values()]} rows{" (synthetic)" if args.synthetic else ""} -> {fixture_path(name)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+# 离线性能测试：用bench/fixtures中的原始报表（模拟数据，见bench/fixtures.py）测试每只股票计算流程中各个步骤的耗时和内存峰值，不访问网络
+# 耗时只能和同一台机器上的结果比较：先在改动前用--save-baseline保存本机的基线bench/baseline.local.json（不提交），改动后再运行比较
+# 超过基线的容差时返回非0退出码。基线是其他机器（environment不同）的结果时，只显示比较结果，--strict时才返回非0
+# bench/baseline.json是提交到仓库的参考结果，可以用 --baseline bench/baseline.json 对比数量级
+# 用法:
+#   python -m bench.run --save-baseline          在改动前保存本机的基线
+#   python -m bench.run                          测试全部fixture，和本机的基线比较
+#   python -m bench.run --fixtures bank-em --stages calculate_reports --repeat 20
+#   python -m bench.run --startup                另外测试冷启动和app第一次显示页面的耗时（bench/startup.py）
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from common import *
+from report_calc import (LazyReports, REPORT_NODES, calculate_reports, compact_reports, format_raw_reports,
+                         add_profit_key_cols)
+from report_view import ReportViews
+from bench.fixtures import fixture_names, load_fixture, is_synthetic
+from bench.startup import STARTUP_STAGES, run_startup
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.local.json')
+# 最短耗时超过基线的TIME_TOLERANCE倍，并且多出TIME_MIN_DELTA_MS毫秒以上，算作性能退化。内存峰值同理
+# 最短耗时受其他进程的干扰最小，比较前按calibrate()的结果换算机器速度的差异
+# 超过容差的步骤重新测试一次（confirm），取两次中的最短耗时再比较，避免偶然的干扰造成误报
+TIME_TOLERANCE = 1.5
+TIME_MIN_DELTA_MS = 2.0
+MEMORY_TOLERANCE = 1.25
+MEMORY_MIN_DELTA_KB = 256
+
+YOY_INPUTS = ['_profit_key', '_profit_quarter', CASH_BY_REPORT, CASH_BY_QUARTER, BALANCE_BY_REPORT]
+
+
+def prepare(name: str, col_maps_dict: dict) -> dict:
+    """各个步骤的输入，在计时之外准备好"""
+    source = name.split('-')[1]
+    reports_raw = load_fixture(name)
+    lazy = LazyReports(reports_raw, col_maps_dict, source)
+    reports = lazy.materialize()
+    return {'source': source, 'raw': reports_raw, 'lazy': lazy, 'reports': reports}
+
+
+# 测试的步骤 {步骤名: func(inputs, col_maps_dict)}，按计算流程的顺序
+STAGES = {
+    'format_report': lambda d, cm: format_raw_reports(d['raw'], cm, d['source']),
+    'add_profit_key_cols': lambda d, cm: add_profit_key_cols(d['lazy'].node('_profit')),
+    'get_quarter_report': lambda d, cm: [get_quarter_report(d['lazy'].node(node), REPORT_DATE) for node in ['_profit_key', CASH_BY_REPORT]],
+    'get_yoy_report': lambda d, cm: [get_yoy_report(d['lazy'].node(node), REPORT_DATE) for node in YOY_INPUTS],
+    'safe_yoy': lambda d, cm: [safe_yoy(s) for _, s in d['reports'][PROFIT_BY_QUARTER].select_dtypes('number').items()],
+    'cross_report': lambda d, cm: REPORT_NODES[CROSS_REPORT][0](d['lazy'], *[d['lazy'].node(dep) for dep in REPORT_NODES[CROSS_REPORT][1]]),
+    'calculate_reports': lambda d, cm: calculate_reports(d['raw'], cm, d['source']),
+    'compact_reports': lambda d, cm: compact_reports(d['reports']),
+    'report_views': lambda d, cm: [ReportViews(d['reports'], cm).view(report_name, (2000, 2100), (1, 2, 3, 4)) for report_name in REPORT_NAMES],
+    'plot_bar_quarter_go': lambda d, cm: [plot_bar_quarter_go(d['reports'][PROFIT_BY_QUARTER], col)
+                                          for col in d['reports'][PROFIT_BY_QUARTER].columns if col.startswith('*')],
+    'df_to_str': lambda d, cm: [df_to_str(df) for df in d['reports'].values()],
+}
+
+
+def time_stage(func, inputs: dict, col_maps_dict: dict, repeat: int) -> list[float]:
+    """运行repeat次，返回每次的耗时(ms)。先运行一次预热，不计时"""
+    func(inputs, col_maps_dict)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(inputs, col_maps_dict)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def memory_peak(func, inputs: dict, col_maps_dict: dict) -> float:
+    """运行一次的内存分配峰值(KB)。tracemalloc会让代码变慢，所以和计时分开运行"""
+    tracemalloc.start()
+    try:
+        func(inputs, col_maps_dict)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024
+
+
+def calibrate(repeat: int = 5) -> float:
+    """固定的python和numpy计算的最短耗时(ms)，用来估计当前机器（和当前负载下）的速度"""
+    rng = np.random.default_rng(0)
+    values = rng.random((400, 400))
+    def work():
+        sum(i * i for i in range(200_000))
+        np.sort(values, axis=0)
+        ['%.2f' % v for v in values[:50].ravel().tolist()]
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        work()
+        times.append((time.perf_counter() - start) * 1000)
+    return min(times)
+
+
+def run(names: list[str], stages: list[str], repeat: int, memory: bool = True) -> dict[str, dict]:
+    """返回 {'fixture/stage': {'median_ms', 'min_ms', 'peak_kb'}}"""
+    from report_data import get_col_maps_dict
+    col_maps_dict = get_col_maps_dict()
+    results = {}
+    for name in names:
+        inputs = prepare(name, col_maps_dict)
+        for stage in stages:
+            times = time_stage(STAGES[stage], inputs, col_maps_dict, repeat)
+            result = {'median_ms': round(statistics.median(times), 3), 'min_ms': round(min(times), 3)}
+            if memory:
+                result['peak_kb'] = round(memory_peak(STAGES[stage], inputs, col_maps_dict), 1)
+            results[f'{name}/{stage}'] = result
+    return results
+
+
+def confirm(results: dict[str, dict], keys: list[str], repeat: int):
+    """重新测试keys的耗时，min_ms更新为两次测试中的最短耗时"""
+    from report_data import get_col_maps_dict
+    col_maps_dict = get_col_maps_dict()
+    by_fixture = {}
+    for key in keys:
+        name, stage = key.split('/')
+        by_fixture.setdefault(name, []).append(stage)
+    for name, stages in by_fixture.items():
+        if name == 'startup':
+            times = {key: result['min_ms'] for key, result in run_startup(stages, repeat).items()}
+        else:
+            inputs = prepare(name, col_maps_dict)
+            times = {f'{name}/{stage}': min(time_stage(STAGES[stage], inputs, col_maps_dict, repeat)) for stage in stages}
+        for key, min_ms in times.items():
+            results[key]['min_ms'] = round(min(results[key]['min_ms'], min_ms), 3)
+
+
+def compare(results: dict[str, dict], baseline: dict[str, dict], speed: float = 1.0) -> dict[str, list[str]]:
+    """和基线比较，返回 {key: [性能退化的说明]}。speed为当前机器相对基线机器的耗时比例"""
+    regressions = {}
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        base_ms = base['min_ms'] * speed
+        # 冷启动时导入了基线中没有导入的慢模块（akshare、matplotlib...）
+        new_modules = set(result.get('modules', [])) - set(base.get('modules', []))
+        if new_modules:
+            regressions.setdefault(key, []).append(f'{key}: imports {sorted(new_modules)} on startup')
+        if result['min_ms'] > base_ms * TIME_TOLERANCE and result['min_ms'] - base_ms > TIME_MIN_DELTA_MS:
+            regressions.setdefault(key, []).append(f'{key}: {base_ms:.2f}ms -> {result["min_ms"]:.2f}ms')
+        if ('peak_kb' in result and 'peak_kb' in base and result['peak_kb'] > base['peak_kb'] * MEMORY_TOLERANCE
+                and result['peak_kb'] - base['peak_kb'] > MEMORY_MIN_DELTA_KB):
+            regressions.setdefault(key, []).append(f'{key}: {base["peak_kb"]:.0f}KB -> {result["peak_kb"]:.0f}KB')
+    return regressions
+
+
+def print_results(results: dict[str, dict], baseline: dict[str, dict]):
+    print(f'{"fixture/stage":<45}{"median ms":>12}{"min ms":>10}{"peak KB":>10}{"baseline min ms":>17}')
+    for key, result in results.items():
+        base = baseline.get(key, {})
+        print(f'{key:<45}{result["median_ms"]:>12.2f}{result["min_ms"]:>10.2f}{result.get("peak_kb", np.nan):>10.0f}'
+              f'{base.get("min_ms", np.nan):>17.2f}')
+
+
+def environment() -> dict:
+    return {'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+            'machine': platform.machine(), 'processor': platform.processor(), 'node': platform.node()}
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description='离线测试报表计算各个步骤的耗时和内存峰值')
+    parser.add_argument('--fixtures', nargs='*', default=fixture_names(), choices=fixture_names())
+    parser.add_argument('--stages', nargs='*', default=list(STAGES), choices=list(STAGES))
+    parser.add_argument('--repeat', type=int, default=5, help='每个步骤计时的次数，和基线比较最短耗时')
+    parser.add_argument('--no-memory', action='store_true', help='不测试内存峰值')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='基线文件，默认为本机的bench/baseline.local.json')
+    parser.add_argument('--strict', action='store_true', help='基线是其他机器的结果时，性能退化也返回非0')
+    parser.add_argument('--save-baseline', action='store_true', help='保存结果为新的基线，不比较')
+    parser.add_argument('--output', default=None, help='结果另外保存为json文件')
+    parser.add_argument('--startup', action='store_true', help='另外测试冷启动的耗时，每次在新的进程中运行')
+    args = parser.parse_args(argv)
+
+    synthetic = [name for name in args.fixtures if is_synthetic(name)]
+    if synthetic:
+        print(f'ℹ️ synthetic fixtures (not recorded data): {synthetic}')
+    calibration_ms = calibrate()
+    results = run(args.fixtures, args.stages, args.repeat, memory=not args.no_memory)
+    if args.startup:
+        results.update(run_startup(list(STARTUP_STAGES), args.repeat))
+    output = {'environment': environment(), 'calibration_ms': round(calibration_ms, 3), 'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(output, f, indent=1)
+    if args.save_baseline:
+        print_results(results, {})
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(output, f, indent=1)
+        print(f'baseline saved to {args.baseline}')
+        return 0
+
+    try:
+        with open(args.baseline, encoding='utf-8') as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        print_results(results, {})
+        print(f'no baseline {args.baseline}, run with --save-baseline before the change to compare on this machine')
+        return 0
+    print_results(results, saved['results'])
+    same_machine = saved['environment'] == environment()
+    if not same_machine:
+        print(f'⚠️ baseline environment {saved["environment"]} differs from {environment()}, '
+              f'timings are not comparable{"" if args.strict else ", regressions are informational"}')
+    speed = calibration_ms / saved['calibration_ms']
+    print(f'calibration {calibration_ms:.2f}ms, baseline {saved["calibration_ms"]:.2f}ms, speed ratio {speed:.2f}')
+    regressions = compare(results, saved['results'], speed)
+    if regressions:
+        print(f'confirming {len(regressions)} stages over the tolerance')
+        confirm(results, list(regressions), args.repeat)
+        regressions = compare(results, saved['results'], speed)
+    regressions = [message for messages in regressions.values() for message in messages]
+    for regression in regressions:
+        print(f'{"❌" if same_machine or args.strict else "⚠️"} regression {regression}')
+    return 1 if regressions and (same_machine or args.strict) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+# 冷启动性能测试：每次在新的python进程中运行，测试导入、读取col_maps和app第一次显示页面（time-to-first-paint）的耗时
+# 结果的key为 'startup/<stage>'，和bench.run的结果一起保存和比较基线（python -m bench.run --startup）
+# 用法:
+#   python -m bench.startup --repeat 5          只测试冷启动
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 每个步骤在子进程中运行的代码，setup不计时，code的耗时(ms)由子进程输出
+STARTUP_STAGES = {
+    # app.py启动时导入的模块（streamlit、pandas、plotly...），akshare和matplotlib应该在用到时才导入
+    'import_modules': ('', 'import common, report_data'),
+    # 读取预编译的col_maps.json
+    'col_maps': ('from col_maps import load_col_maps', 'load_col_maps()'),
+    # app第一次运行到等待输入股票代码，包括app的导入和页面渲染（streamlit本身由AppTest在计时前导入），不访问网络
+    'first_paint': ('from streamlit.testing.v1 import AppTest',
+                    "AppTest.from_file('app.py', default_timeout=60).run()"),
+}
+
+_CHILD = '''
+import sys, time, json, warnings, logging
+warnings.filterwarnings('ignore')
+logging.disable(logging.WARNING)
+{setup}
+start = time.perf_counter()
+{code}
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({{'ms': elapsed, 'modules': sorted(m for m in ('akshare', 'matplotlib', 'openpyxl', 'plotly.express') if m in sys.modules)}}))
+'''
+
+
+def time_startup(stage: str) -> dict:
+    """在新的进程中运行一次，返回 {'ms', 'modules'}，modules为已经导入的慢模块"""
+    setup, code = STARTUP_STAGES[stage]
+    result = subprocess.run([sys.executable, '-c', _CHILD.format(setup=setup, code=code)], cwd=REPO_DIR,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def run_startup(stages: list[str], repeat: int) -> dict[str, dict]:
+    """返回 {'startup/stage': {'median_ms', 'min_ms'}}，和bench.run.run的结果格式相同"""
+    results = {}
+    for stage in stages:
+        runs = [time_startup(stage) for _ in range(repeat)]
+        times = [r['ms'] for r in runs]
+        results[f'startup/{stage}'] = {'median_ms': round(statistics.median(times), 3), 'min_ms': round(min(times), 3),
+                                       'modules': runs[-1]['modules']}
+    return results
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='测试冷启动各个步骤的耗时，每次在新的进程中运行')
+    parser.add_argument('--stages', nargs='*', default=list(STARTUP_STAGES), choices=list(STARTUP_STAGES))
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+    for key, result in run_startup(args.stages, args.repeat).items():
+        print(f'{key:<30}{result["median_ms"]:>10.1f} ms median{result["min_ms"]:>10.1f} ms min   loaded: {result["modules"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+# 用本地的桩数据源检查fetch_scheduler的限流、并发、超时、重试和合并相同请求，不访问网络
+# 任何一项检查失败时返回非0退出码
+# 用法:
+#   python -m bench.stub_fetch
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from fetch_scheduler import FetchScheduler, FetchTimeout
+
+
+class StubSource:
+    """
+    桩下载函数 func(code, source)，每次调用等待latency秒后返回一行的df
+    前fail_first次调用抛出异常，hang中的股票代码等待hang_seconds秒（模拟挂起的akshare请求）
+    记录调用次数和同时进行的调用数的最大值
+    """
+    def __init__(self, latency: float = 0.02, fail_first: int = 0, hang: set[str] = frozenset(), hang_seconds: float = 1.0):
+        self.latency = latency
+        self.fail_first = fail_first
+        self.hang = hang
+        self.hang_seconds = hang_seconds
+        self.calls = 0
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, code: str, source: str) -> pd.DataFrame:
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            time.sleep(self.hang_seconds if code in self.hang else self.latency)
+            if call <= self.fail_first:
+                raise ConnectionError(f'stub failure {call}')
+            return pd.DataFrame({'code': [code], 'source': [source]})
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+def _scheduler(concurrency: int = 3, rate: float = 1000, timeout: float = 5, retries: int = 2) -> FetchScheduler:
+    return FetchScheduler(rates={'stub': rate, 'default': rate}, concurrency={'stub': concurrency, 'default': concurrency},
+                          timeout=timeout, retries=retries, backoff=0.01)
+
+
+def _fetch_all(scheduler: FetchScheduler, stub: StubSource, codes: list[str]) -> list:
+    """每只股票一个线程同时调用，返回结果或异常"""
+    def fetch(code):
+        try:
+            return scheduler.call(('stub', code), 'stub', stub, code, 'stub')
+        except Exception as e:
+            return e
+    with ThreadPoolExecutor(max_workers=len(codes)) as executor:
+        return list(executor.map(fetch, codes))
+
+
+def check_coalescing() -> str | None:
+    stub = StubSource(latency=0.2)
+    results = _fetch_all(_scheduler(), stub, ['600519'] * 8)
+    if stub.calls != 1 or not all(result is results[0] for result in results):
+        return f'8 concurrent requests for one key made {stub.calls} calls'
+
+
+def check_concurrency() -> str | None:
+    stub = StubSource(latency=0.05)
+    results = _fetch_all(_scheduler(concurrency=3), stub, [f'{i:06d}' for i in range(20)])
+    if stub.max_running > 3 or any(isinstance(result, Exception) for result in results):
+        return f'max {stub.max_running} concurrent calls with limit 3'
+
+
+def check_rate() -> str | None:
+    stub = StubSource(latency=0)
+    start = time.monotonic()
+    _fetch_all(_scheduler(rate=20), stub, [f'{i:06d}' for i in range(11)])
+    elapsed = time.monotonic() - start
+    # 令牌桶最多1个令牌，11个请求至少需要10/20秒
+    if elapsed < 0.45:
+        return f'11 requests at 20/s took {elapsed:.2f}s'
+
+
+def check_retry() -> str | None:
+    stub = StubSource(fail_first=2)
+    results = _fetch_all(_scheduler(retries=2), stub, ['600519'])
+    if isinstance(results[0], Exception) or stub.calls != 3:
+        return f'2 failures with 2 retries: {results[0]!r}, {stub.calls} calls'
+    stub = StubSource(fail_first=10)
+    results = _fetch_all(_scheduler(retries=1), stub, ['600519'])
+    if not isinstance(results[0], ConnectionError) or stub.calls != 2:
+        return f'persistent failure with 1 retry: {results[0]!r}, {stub.calls} calls'
+
+
+def check_hung_calls() -> str | None:
+    # 2个名额，2个挂起的请求超时后仍然占用名额，其他请求要等挂起的请求返回后才开始，同时运行的调用不超过2个
+    stub = StubSource(hang={'000001', '000002'}, hang_seconds=0.6)
+    scheduler = _scheduler(concurrency=2, timeout=0.2, retries=0)
+    results = _fetch_all(scheduler, stub, ['000001', '000002'])
+    if not all(isinstance(result, FetchTimeout) for result in results) or scheduler.abandoned != 2:
+        return f'hung calls: {results}, abandoned {scheduler.abandoned}'
+    results = _fetch_all(scheduler, stub, ['600519', '600036'])
+    if stub.max_running > 2:
+        return f'max {stub.max_running} concurrent calls with limit 2 while calls hang'
+    time.sleep(0.6)
+    results = _fetch_all(scheduler, stub, ['600519', '600036'])
+    if any(isinstance(result, Exception) for result in results) or scheduler.abandoned != 0:
+        return f'after hung calls returned: {results}, abandoned {scheduler.abandoned}'
+
+
+CHECKS = {
+    'coalescing': check_coalescing,
+    'concurrency': check_concurrency,
+    'rate': check_rate,
+    'retry': check_retry,
+    'hung_calls': check_hung_calls,
+}
+
+
+def main() -> int:
+    failed = 0
+    for name, check in CHECKS.items():
+        error = check()
+        print(f'❌ {name}: {error}' if error else f'✅ {name}')
+        failed += error is not None
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
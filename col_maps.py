@@ -0,0 +1,60 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+# col_maps.xlsx的预编译文件，不依赖streamlit
+# 读取xlsx需要openpyxl，每次冷启动要几百毫秒，这里把用到的sheet转成col_maps.json，读取只要几毫秒
+# col_maps.json中保存xlsx的sha256，xlsx修改后（hash不同）自动重新生成，没有openpyxl或没有xlsx时直接使用json
+# 用法: python col_maps.py   修改col_maps.xlsx后重新生成col_maps.json
+COL_MAPS_XLSX = 'col_maps.xlsx'
+COL_MAPS_JSON = 'col_maps.json'
+COL_MAPS_SHEETS = ['profit', 'cash', 'balance', 'cross']
+
+
+def _sha256(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def build_col_maps(xlsx_path: str = COL_MAPS_XLSX, json_path: str = COL_MAPS_JSON) -> dict[str, pd.DataFrame]:
+    """读取xlsx中COL_MAPS_SHEETS的sheet，保存为json，返回 {sheet_name: df}"""
+    sheets = pd.read_excel(xlsx_path, sheet_name=COL_MAPS_SHEETS, header=0)
+    data = {'xlsx_sha256': _sha256(xlsx_path), 'sheets': {}}
+    for sheet_name, df in sheets.items():
+        data['sheets'][sheet_name] = {
+            'columns': [str(col) for col in df.columns],
+            'float_columns': [str(col) for col in df.columns if df[col].dtype.kind == 'f'],
+            'data': df.astype(object).where(df.notna(), None).to_numpy().tolist(),
+        }
+    # 只读的部署环境写不了文件时，仍然返回读取的结果
+    try:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=0)
+    except OSError:
+        pass
+    return sheets
+
+
+def _sheet_from_json(sheet: dict) -> pd.DataFrame:
+    df = pd.DataFrame(sheet['data'], columns=sheet['columns'])
+    return df.astype({col: float for col in sheet['float_columns']})
+
+
+def load_col_maps(xlsx_path: str = COL_MAPS_XLSX, json_path: str = COL_MAPS_JSON) -> dict[str, pd.DataFrame]:
+    """返回 {sheet_name: df}，和 pd.read_excel(xlsx_path, sheet_name=COL_MAPS_SHEETS) 相同"""
+    data = None
+    if os.path.exists(json_path):
+        with open(json_path, encoding='utf-8') as f:
+            data = json.load(f)
+        if os.path.exists(xlsx_path) and data.get('xlsx_sha256') != _sha256(xlsx_path):
+            data = None
+    if data is None:
+        return build_col_maps(xlsx_path, json_path)
+    return {sheet_name: _sheet_from_json(data['sheets'][sheet_name]) for sheet_name in COL_MAPS_SHEETS}
+
+
+if __name__ == '__main__':
+    sheets = build_col_maps()
+    print(f'{COL_MAPS_XLSX} -> {COL_MAPS_JSON}: {[(sheet_name, len(df)) for sheet_name, df in sheets.items()]}')
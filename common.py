@@ -1,21 +1,22 @@
 import re
 import pandas as pd
 import numpy as np
-import plotly.express as px
 import plotly.graph_objects as go
+from plotly.colors import qualitative
 from plotly.subplots import make_subplots
-import matplotlib.pyplot as plt
-from matplotlib.ticker import FuncFormatter
-import streamlit as st
-
-plt.rcParams['font.sans-serif'] = ['SimHei']
-plt.rcParams['axes.unicode_minus'] = False
+# matplotlib和plotly.express导入很慢，只有少数函数用到，在函数里才导入，加快app冷启动和每次rerun
 
 # =======================   variable declaration  ======================================
 # ======================================================================================
 # data source used by akshare - 'shown on web': 'called by function'
 # 代码中所有source都是按照这个定义的，web上显示的可以改动，代码调用的是固定的不要改动
 DATA_SOURCE = {'ths': 'ths', 'east money': 'em', 'sina': 'sina'}
+# 自动选择数据源：按AUTO_SOURCES的顺序请求，前一个数据源AUTO_HEDGE_DELAY秒内没有完成或者失败时，同时请求下一个，使用最先完整返回的数据
+# 总共等待AUTO_TIMEOUT秒。AUTO_SOURCE不是akshare的数据源，不在DATA_SOURCE中
+AUTO_SOURCE = 'auto'
+AUTO_SOURCES = ['ths', 'em', 'sina']
+AUTO_HEDGE_DELAY = 3.0
+AUTO_TIMEOUT = 60.0
 CROSS_REPORT = '综合分析'
 PROFIT_BY_REPORT = '利润表-报告期'
 CASH_BY_REPORT = '现金流量表-报告期'
@@ -51,6 +52,8 @@ reports = {CROSS_REPORT: pd.DataFrame(),
            CASH_PCT_BY_QUARTER: pd.DataFrame(),    #计算得到现金流量表单季度同比数据
            BALANCE_PCT_BY_REPORT: pd.DataFrame(),  #计算得到资产负债表报告期同比数据
            }
+# 所有报表的名字，按上面reports的顺序
+REPORT_NAMES = list(reports.keys())
 # 经过sidebar选项筛选的报表数据，用于可视化显示
 reports_filtered = {CROSS_REPORT: pd.DataFrame(),
                     PROFIT_BY_REPORT: pd.DataFrame(),       # 经过格式化的原始数据
@@ -67,6 +70,32 @@ reports_filtered = {CROSS_REPORT: pd.DataFrame(),
                     BALANCE_PCT_BY_REPORT: pd.DataFrame(),  #计算得到资产负债表报告期同比数据
                     }
 
+# 多股对比可以选择的指标 {指标名: 指标所在的报表}
+COMPARE_METRICS = {'*营业总收入': PROFIT_BY_QUARTER,
+                   '*核心利润': PROFIT_BY_QUARTER,
+                   '*净利润': PROFIT_BY_QUARTER,
+                   '毛利润率[%]': PROFIT_BY_QUARTER,
+                   '核心利润率[%]': PROFIT_BY_QUARTER,
+                   '净资产收益率[%]': CROSS_REPORT,
+                   '总资产收益率[%]': CROSS_REPORT,
+                   '资产负债率[%]': CROSS_REPORT,
+                   '应收账款周转天数': CROSS_REPORT,
+                   '存货周转天数': CROSS_REPORT,
+                   '现金周转天数': CROSS_REPORT,
+                   }
+
+# 全市场筛选使用的指标 {指标名: (指标所在的报表, 报表中的列名)}，单季同比来自单季度同比报表
+SCREEN_METRICS = {'净资产收益率[%]': (CROSS_REPORT, '净资产收益率[%]'),
+                  '总资产收益率[%]': (CROSS_REPORT, '总资产收益率[%]'),
+                  '毛利润率[%]': (PROFIT_BY_QUARTER, '毛利润率[%]'),
+                  '核心利润率[%]': (PROFIT_BY_QUARTER, '核心利润率[%]'),
+                  '现金周转天数': (CROSS_REPORT, '现金周转天数'),
+                  '资产负债率[%]': (CROSS_REPORT, '资产负债率[%]'),
+                  '营业总收入单季同比[%]': (PROFIT_PCT_BY_QUARTER, '*营业总收入'),
+                  '核心利润单季同比[%]': (PROFIT_PCT_BY_QUARTER, '*核心利润'),
+                  '归母净利润单季同比[%]': (PROFIT_PCT_BY_QUARTER, '*归母净利润'),
+                  }
+
 # const used to generate quarter and year columns for chart ploting
 YEAR = '年份'
 QUARTER = '季度'
@@ -90,10 +119,14 @@ def add_prefix_to_code(code: str) -> str:
 #             res = 'xxxx'
 #         finally:
 #             return res
+# ths数字文本的正则和中文单位乘数
+THS_NUM_PATTERN = r'^([-+]?\d*\.?\d*)(万亿|亿|千万|百万|万|千)?$'
+THS_UNIT_MAP = {'万亿':1000000000000, '亿': 100000000, '千万': 10000000, '百万': 1000000, '万': 10000, '千': 1000}
+
 # 带亿等数字文本转纯数字 
 # 用于将ths的原始数据转成纯数字
 def ths_str_to_num(value: str|float|int) -> float:
-    match = re.match(r'^([-+]?\d*\.?\d*)(万亿|亿|千万|百万|万|千)?$', str(value).strip())
+    match = re.match(THS_NUM_PATTERN, str(value).strip())
     if not match:  # 报告期无法匹配到，直接返回
         return value
     if match.group(2) is None:  # 只有1个捕获组的说明没有汉字单位，转成float
@@ -105,8 +138,58 @@ def ths_str_to_num(value: str|float|int) -> float:
             return float(value)
     num = float(match.group(1))
     unit = match.group(2)
-    unit_map = {'万亿':1000000000000, '亿': 100000000, '千万': 10000000, '百万': 1000000, '万': 10000, '千': 1000}
-    return num * unit_map[unit]
+    return num * THS_UNIT_MAP[unit]
+
+# ths_str_to_num 的向量化版本，按列处理整个df，结果与 df.map(ths_str_to_num) 相同
+# 所有文本列拼成一个numpy字符串数组，用np.char做去单位、格式校验，再用单位乘数表换算，最后按列还原
+def ths_df_to_num(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    # 数字列直接转float，日期列不处理
+    dtypes = df.dtypes
+    num_cols = [c for c, t in dtypes.items() if pd.api.types.is_numeric_dtype(t) and not pd.api.types.is_bool_dtype(t)]
+    text_cols = [c for c, t in dtypes.items() if c not in num_cols and not pd.api.types.is_datetime64_any_dtype(t)]
+    if num_cols:
+        df[num_cols] = df[num_cols].astype(float)
+    if not text_cols:
+        return df
+    values = df[text_cols].to_numpy(dtype=object).copy()
+    flat = values.ravel(order='F')
+    text = np.char.strip(flat.astype(str))   # 与 str(value).strip() 相同, nan/None/False 都变成不能匹配的文本
+    # 去掉末尾的单位字符，再根据去掉的长度和结尾判断是哪个单位，不在THS_UNIT_MAP中的单位组合无效
+    num_part = np.char.rstrip(text, '万亿千百')
+    unit_len = np.char.str_len(text) - np.char.str_len(num_part)
+    mult = np.where(unit_len == 0, 1.0, np.nan)
+    for unit, value in THS_UNIT_MAP.items():
+        mult[(unit_len == len(unit)) & np.char.endswith(text, unit)] = value
+    # 数字部分等价于正则 [-+]?\d*\.?\d*，并且至少要有一位数字，排除 '' '.' '-' 这类匹配到但不能转float的情况，这些值保持不变
+    valid = ~np.isnan(mult) & (np.char.strip(num_part, '0123456789.+-') == '') & (np.char.strip(num_part, '.+-') != '')
+    valid &= np.char.count(num_part, '.') <= 1
+    signs = np.char.count(num_part, '+') + np.char.count(num_part, '-')
+    valid &= (signs == 0) | ((signs == 1) & (np.char.lstrip(num_part, '+-') != num_part))   # 正负号只能在最前面
+    flat[valid] = num_part[valid].astype(object).astype(float) * mult[valid]   # 经object转float比直接从numpy字符串转快
+    values = flat.reshape(values.shape, order='F')
+    df[text_cols] = pd.DataFrame(values, index=df.index, columns=text_cols, dtype=object).infer_objects()
+    return df
+
+# em和sina的数字转float，结果与 df.map(lambda v: float(v) if isinstance(v, (float, int)) else v) 相同
+# 按列判断类型：数字列直接astype(float)，纯文本列不变，混合类型的列才逐个元素处理
+def number_df_to_float(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    for col in df.columns:
+        s = df[col]
+        if pd.api.types.is_numeric_dtype(s):   # bool也是int的子类，一并转成float
+            df[col] = s.astype(float)
+        elif pd.api.types.is_datetime64_any_dtype(s):
+            continue
+        else:
+            kind = pd.api.types.infer_dtype(s, skipna=True)
+            if kind in ('floating', 'integer', 'mixed-integer-float', 'boolean'):
+                df[col] = pd.to_numeric(s).astype(float)
+            elif kind in ('string', 'empty', 'date', 'datetime', 'datetime64'):
+                df[col] = s.infer_objects()
+            else:
+                df[col] = s.map(lambda v: float(v) if isinstance(v, (float, int)) else v)
+    return df
 
 # 用于st web显示，把df所有值变成string，便于显示
 def value_to_str(value: float|int|str) -> str:
@@ -136,6 +219,39 @@ def value_to_str(value: float|int|str) -> str:
     # 其余类型，使用str函数转换
     return str(value)
 
+# value_to_str的按列向量化版本，结果与 s.map(value_to_str) 相同
+# 数字用np掩码按 万亿 亿 万 分组，每组一次格式化；日期列用dt.strftime；其他类型逐个调用value_to_str
+NUM_STR_UNITS = [(1e12, 1e12, '%.2f万亿'), (1e8, 1e8, '%.2f亿'), (1e4, 1e4, '%.1f万')]   # (阈值, 除数, 格式)
+def numbers_to_str(values: np.ndarray) -> np.ndarray:
+    """float数组（任意维度）转成字符串数组，np.nan为'-'"""
+    abs_values = np.abs(values)
+    out = np.full(values.shape, '-', dtype=object)
+    rest = ~np.isnan(values)
+    for threshold, divisor, fmt in NUM_STR_UNITS:
+        mask = rest & (abs_values > threshold)
+        out[mask] = [fmt % v for v in (values[mask] / divisor).tolist()]
+        rest &= ~mask
+    out[rest] = ['% .2f' % v for v in values[rest].tolist()]
+    return out
+
+def series_to_str(s: pd.Series) -> pd.Series:
+    if s.dtype.kind in 'iuf':
+        return pd.Series(numbers_to_str(s.to_numpy(dtype=float, na_value=np.nan)), index=s.index, name=s.name, dtype=object)
+    if s.dtype.kind == 'M':
+        return s.dt.strftime('%Y-%m-%d').astype(object).fillna('-')
+    return s.map(value_to_str).astype(object)
+
+def df_to_str(df: pd.DataFrame) -> pd.DataFrame:
+    """df中所有值转成显示用的字符串，相当于 df.map(value_to_str)。所有数字列合并成一个二维数组一次格式化"""
+    out = np.empty(df.shape, dtype=object)
+    num_pos = [i for i, dtype in enumerate(df.dtypes) if dtype.kind in 'iuf']
+    if num_pos:
+        out[:, num_pos] = numbers_to_str(df.iloc[:, num_pos].to_numpy(dtype=float, na_value=np.nan))
+    for i in range(df.shape[1]):
+        if i not in num_pos:
+            out[:, i] = series_to_str(df.iloc[:, i]).to_numpy()
+    return pd.DataFrame(out, index=df.index, columns=df.columns, dtype=object)
+
 # col_maps df.columns - ths, em, sina, item
 # 按照col_maps重命名列名，列进行排序，'报告期'列转成pd.to_datetime。
 # 把数字都转成float，方便后续的相关计算。np.na 保持不变，np.na实际可能是没有值，也可能是代表0。
@@ -156,7 +272,7 @@ def format_report(df: pd.DataFrame, df_col_maps: pd.DataFrame, source: str='em')
     if(source=='em'):
         df = df[[col for col in df.columns if not col.endswith('YOY')]]
         # format number to float
-        df = df.map(lambda v: float(v) if isinstance(v, (float, int)) else v)
+        df = number_df_to_float(df)
     ### ths数据处理，convet ths data to number
     if(source=='ths'):
         # ths 原始数据空值为False，把False用np.nan替代。replace和mask都可以实现
@@ -164,11 +280,12 @@ def format_report(df: pd.DataFrame, df_col_maps: pd.DataFrame, source: str='em')
         df = df.mask(df==False, np.nan)
         # ths 原始数据包含亿和万等中文字符，需要用函数ths_str_to_num转成纯数字
         # ths利润表 资产减值损失，信用减值损 的取值与em和sina是反的，用的话需要取反，这里暂时没处理
-        df = df.map(ths_str_to_num)
+        # 按列向量化处理，结果与 df.map(ths_str_to_num) 相同
+        df = ths_df_to_num(df)
     ### sina数据处理
     if(source=='sina'):
         # format number to float
-        df = df.map(lambda v: float(v) if isinstance(v, (float, int)) else v)
+        df = number_df_to_float(df)
 
     # df = df.replace(np.nan, 0) # 把np.na赋值成0，仅用于对比测试
     # df = df.map(value_to_str)   # 仅用于显示测试
@@ -176,20 +293,51 @@ def format_report(df: pd.DataFrame, df_col_maps: pd.DataFrame, source: str='em')
 
 # return quarter report. df need to format as number, report_date_col_name need to format as pd.to_datetime
 # 由于sina没有单季度报告的数据供抓取，这里都自行进行计算
-# 注意：某些数据为na的话，计算结果也会na，有些单季度计算出来的数据可能会不准。
-# 注意：新股某些季度值会缺失，没有考虑新股季度数值的缺失。
-def get_quarter_report(df: pd.DataFrame, report_date_col_name: str) -> pd.DataFrame:
-    df_number = df.select_dtypes(include=['float', 'int']).copy()
-    # em, ths, sina的时间都是降序，所以用 diff(-1)，axis=0按行处理。所有行都减后面一行的数据。如果原始数据顺序改变，代码要修改
-    df_q = df_number.diff(-1, axis=0) 
-    # 第一季度数据不需要向下减，mask_Q1筛选出第一季度的数据，把数据还原回来
-    mask_Q1 = df[report_date_col_name].dt.month == 3
-    df_q[mask_Q1] = df_number[mask_Q1]   # 得到Q1行mask，恢复Q1行的数据 
-    
-    df_q = pd.concat([df[report_date_col_name], df_q], axis=1)  # 把报告期列加到最前面
+# 按财年分组、组内按季度排序，用同一年上一季度的累计值相减，不依赖行的顺序，结果按原来的行顺序返回
+# 注意：某些数据为na的话，计算结果也会na。上一季度缺失（如新股、outer merge后的空行）的季度无法计算，结果为np.nan
+# return_underivable=True时，同时返回因缺少上一季度报告而无法计算的单元格mask（有累计值，但同一年的上一季度报告不存在）
+# 上一季度报告存在、只是该字段为空时，单季度值也是np.nan，但不在mask中
+# group_col 为多只股票纵向拼接在一起时的股票代码列，None表示只有一只股票。结果中股票代码列在报告期列前面
+def get_quarter_report(df: pd.DataFrame, report_date_col_name: str, return_underivable: bool = False,
+                       group_col: str | None = None) -> pd.DataFrame | tuple[pd.DataFrame, pd.DataFrame]:
+    df_number = df.select_dtypes(include=['float', 'int'])
+    dates = df[report_date_col_name]
+    # 按(股票代码, 报告期)升序排列，同一年的季度排在一起，NaT排在最后
+    if group_col is None:
+        order = np.argsort(dates.to_numpy(), kind='stable')
+    else:
+        group = pd.factorize(df[group_col])[0]
+        order = np.lexsort((dates.to_numpy(), group))
+    year = dates.dt.year.to_numpy(dtype=float)[order]
+    quarter = dates.dt.quarter.to_numpy(dtype=float)[order]
+    values = df_number.to_numpy(dtype=float)[order]
+    # 上一行是同一只股票同一年的上一个季度才可以相减
+    has_prev = np.zeros(len(values), dtype=bool)
+    has_prev[1:] = (year[1:] == year[:-1]) & (quarter[1:] == quarter[:-1] + 1)
+    if group_col is not None:
+        has_prev[1:] &= group[order][1:] == group[order][:-1]
+    prev = np.full_like(values, np.nan)
+    prev[1:] = values[:-1]
+    values_q = np.where(has_prev[:, None], values - prev, np.nan)
+    # 第一季度数据不需要相减，直接使用累计值
+    mask_Q1 = quarter == 1
+    values_q[mask_Q1] = values[mask_Q1]
+    # 还原成原来的行顺序
+    result = np.empty_like(values_q)
+    result[order] = values_q
+    df_q = pd.DataFrame(result, index=df.index, columns=df_number.columns)
+    df_q = pd.concat([dates, df_q], axis=1)  # 把报告期列加到最前面
+    if group_col is not None:
+        df_q.insert(0, group_col, df[group_col])
+    if return_underivable:
+        # 第二至第四季度，并且上一行不是同一年的上一季度，还原成原来的行顺序
+        missing_prev = np.empty(len(values), dtype=bool)
+        missing_prev[order] = ~has_prev & (quarter != 1)
+        underivable = df_number.notna() & missing_prev[:, None]
+        return df_q, underivable
     return df_q
 
-# 注意：新股某些季度值会缺失，没有考虑新股季度数值的缺失。
+# 注意：按行偏移计算，新股某些季度值会缺失时结果会错位，整张报表的同比使用 get_yoy_report
 def safe_yoy(series: pd.Series, periods: int =-4) -> pd.Series:
     """
     计算同比增长，安全处理零和负数。
@@ -197,13 +345,87 @@ def safe_yoy(series: pd.Series, periods: int =-4) -> pd.Series:
     series: pd.Series，数值列
     periods: int, 同比的周期（如季度同比用4）
     """
-    prev = series.shift(periods)
-    def calc(current, previous):
-        if previous == 0:
-            return np.nan  # 避免除零
-        return (current - previous) / abs(previous) * 100  # 用 abs 保证同比符号合理
-    return pd.Series([calc(c, p) for c, p in zip(series, prev)], index=series.index)
-
+    prev = series.shift(periods).to_numpy(dtype=float)
+    return pd.Series(_yoy_values(series.to_numpy(dtype=float), prev), index=series.index)
+
+# 同比计算公式，current和previous可以是一维或二维的np.ndarray
+# previous为0时返回np.nan避免除零，用 abs(previous) 保证同比符号合理
+def _yoy_values(current: np.ndarray, previous: np.ndarray) -> np.ndarray:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        res = (current - previous) / np.abs(previous) * 100
+    res[previous == 0] = np.nan
+    return res
+
+# 计算整张报表所有数字列的同比，返回报告期列+同比数据列。df需要格式化为数字，report_date_col_name需要是pd.to_datetime格式
+# 按报告期对齐：每一行和报告期减一年的那一行比较，不依赖行的顺序，缺失的季度不会导致错位，找不到上一年同期的结果为np.nan
+# group_col 同get_quarter_report，多只股票时按 (股票代码, 报告期) 对齐
+def get_yoy_report(df: pd.DataFrame, report_date_col_name: str, group_col: str | None = None) -> pd.DataFrame:
+    df_number = df.select_dtypes(include=['float', 'int'])
+    dates = df[report_date_col_name]
+    prev_dates = dates - pd.DateOffset(years=1)
+    # 报告期 -> 行号，重复的报告期只保留第一个
+    if group_col is None:
+        index, prev_index = pd.DatetimeIndex(dates), prev_dates
+    else:
+        index = pd.MultiIndex.from_arrays([df[group_col], dates])
+        prev_index = pd.MultiIndex.from_arrays([df[group_col], prev_dates])
+    date_pos = pd.Series(np.arange(len(df)), index=index)
+    date_pos = date_pos[dates.notna().to_numpy() & ~date_pos.index.duplicated()]
+    prev_pos = date_pos.reindex(prev_index).to_numpy()
+    has_prev = ~np.isnan(prev_pos)
+    # 一次二维numpy运算计算所有列
+    values = df_number.to_numpy(dtype=float)
+    prev = np.full_like(values, np.nan)
+    prev[has_prev] = values[prev_pos[has_prev].astype(int)]
+    df_yoy = pd.DataFrame(_yoy_values(values, prev), index=df.index, columns=df_number.columns)
+    df_yoy = pd.concat([dates, df_yoy], axis=1)
+    if group_col is not None:
+        df_yoy.insert(0, group_col, df[group_col])
+    return df_yoy
+
+
+# 按季度分组的bar trace，Q1-Q4各一个trace。x为报告期年份，y为col的数据。plot_bar_quarter_go和plot_bar_quarter_grid_go共用
+def bar_quarter_traces(df: pd.DataFrame, col: str) -> list[go.Bar]:
+    # 只取报告期和col两列，不复制整个df
+    values = df[col]
+    quarters = df[REPORT_DATE].dt.quarter.to_numpy()
+    years = df[REPORT_DATE].dt.year.to_numpy()
+    ### 根据col的数值大小计算文本显示在柱体外部的阈值, 阈值按照最大值的abs来设置
+    threshold = values.abs().max() * 0.3
+    textpos = np.where(values.abs().to_numpy() > threshold, 'inside', 'outside')
+    texts = series_to_str(values).to_numpy()
+    ### 定义颜色映射（可自定义）
+    color_map = {'Q1':"#00CC41",'Q2':"#F86C53",'Q3':"#FAC363",'Q4':"#8B92F7"}
+    traces = []
+    # 分组绘制每个季度，根据阈值计算的结果，按照trace来设置每个柱子文本显示的位置
+    # Plotly 在 group bars（分组柱状图）里，会把同一年份多个季度的柱子拆成多条 trace。
+    for q, quarter in enumerate(['Q1','Q2','Q3','Q4'], start=1):
+        mask = quarters == q
+        traces.append(go.Bar(
+            x=years[mask],
+            y=values[mask],
+            name=quarter,
+            text=texts[mask],
+            textposition=textpos[mask],
+            # insidetextanchor='middle',
+            cliponaxis=False,           # 不裁剪文字
+            marker_color=color_map[quarter],
+            textfont_size=12,  # 文字大小（默认约10，根据需求调整，如12/14/16）
+            textangle=90,  # 文字水平显示（原默认可能倾斜，更易读）
+            insidetextanchor='end',  # 若后续改为内部显示，文字居中 [start, end, middle, left, right]
+            # 设置hover template
+            hovertemplate = '%{x}<br>%{fullData.name}: %{text}<extra></extra>'
+        ))
+    return traces
+
+# bar图的legend，放在图表上方
+BAR_LEGEND = dict(
+    x=0,
+    y=1,                # 往上移（>1 代表在绘图区上方）
+    orientation="h",      # 水平放置
+    yanchor="bottom",     # legend 底部对准 y=1
+    xanchor="left",
+    )
 
 def plot_bar_quarter_go(df: pd.DataFrame, col: str, title_suffix: str = '', height: int = 300) -> go.Figure:
     """
@@ -214,41 +436,14 @@ def plot_bar_quarter_go(df: pd.DataFrame, col: str, title_suffix: str = '', heig
     :param title_suffix: col column name is used as title, title_sufifx is used as suffix if it's not ''.
     :param height: height of the chart
     """
-    df = df.copy()
-    df[QUARTER] = df[REPORT_DATE].dt.quarter.map(lambda x: f'Q{x}')
-    df[YEAR] = df[REPORT_DATE].dt.year
-    ### 根据col的数值大小计算文本显示在柱体外部的阈值, 阈值按照最大值的abs来设置
-    threshold = df[col].abs().max() * 0.3
-    df["textpos"] = df[col].apply(lambda val: 'inside' if abs(val)>threshold else 'outside')
-    ### 定义颜色映射（可自定义）
-    color_map = {'Q1':"#00CC41",'Q2':"#F86C53",'Q3':"#FAC363",'Q4':"#8B92F7"}
     ### 画出bar图并进行显示设置
-    fig1 = go.Figure()
-    # 分组绘制每个季度
-    for quarter in ['Q1','Q2','Q3','Q4']:
-        df_q = df[df[QUARTER] == quarter]
-        fig1.add_trace(go.Bar(
-            x=df_q[YEAR],
-            y=df_q[col],
-            name=quarter,
-            text=df_q[col].map(value_to_str),  # 可以用 value_to_str 替代
-            # textposition='inside',      # 一直 inside
-            # insidetextanchor='middle',
-            cliponaxis=False,           # 不裁剪文字
-            marker_color=color_map[quarter]
-        ))
+    fig1 = go.Figure(data=bar_quarter_traces(df, col))
     # fig1 = px.bar(df, x=YEAR, y=col, color=QUARTER, barmode='group', height=height,
     #             text=df[col].map(value_to_str), category_orders={QUARTER: ['Q1', 'Q2', 'Q3', 'Q4']})
     fig1.update_layout(barmode='group', bargap=0.15,
         height = height,
         # 设置legend
-        legend=dict(
-            x=0,
-            y=1,                # 往上移（>1 代表在绘图区上方）
-            orientation="h",      # 水平放置
-            yanchor="bottom",     # legend 底部对准 y=1
-            xanchor="left",
-            ),
+        legend=BAR_LEGEND,
         # 设置图表title
         title=dict(
             text=f'{col} - {title_suffix}' if title_suffix else col,      # 用 ytitle 当作图表标题
@@ -263,23 +458,38 @@ def plot_bar_quarter_go(df: pd.DataFrame, col: str, title_suffix: str = '', heig
         uniformtext_mode='show',     # 强制显示，不自动缩放
         # hovermode="x unified"      # 打开后在手机上的hover内容一直存在会遮挡数据，效果不太好
         )
-    ### 设置bar上文本的位置，根据阈值计算的结果，按照trace来设置每个柱子文本显示的位置
-    for i, quarter in enumerate(['Q1', 'Q2', 'Q3', 'Q4']):
-        mask = df[QUARTER] == quarter
-        fig1.data[i].textposition = df.loc[mask, "textpos"]
-    # Plotly 在 group bars（分组柱状图）里，会把同一年份多个季度的柱子拆成多条 trace。
-    fig1.update_traces(
-        textfont_size=12,  # 文字大小（默认约10，根据需求调整，如12/14/16）
-        # textposition='inside',  # 文字放在柱子外部（避免内部拥挤），根据threashold来设置
-        textangle=90,  # 文字水平显示（原默认可能倾斜，更易读）
-        insidetextanchor='end',  # 若后续改为内部显示，文字居中 [start, end, middle, left, right]
-        # 设置hover template
-        hovertemplate = '%{x}<br>%{fullData.name}: %{text}<extra></extra>'
-    )
     fig1.update_xaxes(showgrid=True)
     # fig1.update_yaxes(showgrid=True)
     return fig1
 
+def plot_bar_quarter_grid_go(charts: list[tuple[pd.DataFrame, str, str]], height: int = 300) -> go.Figure:
+    """
+    多个bar quarter图画在一个figure中，每个图一行，共用x轴。选择的列很多时，只需要传输和渲染一个图表
+
+    :param charts: [(df, col, title_suffix)]，每个元素对应一个子图，参数和plot_bar_quarter_go相同
+    :param height: height of each subplot
+    """
+    titles = [f'{col} - {title_suffix}' if title_suffix else col for _, col, title_suffix in charts]
+    rows = len(charts)
+    # 子图之间留出约60px给子图标题
+    fig = make_subplots(rows=rows, cols=1, shared_xaxes=True, subplot_titles=titles,
+                        vertical_spacing=min(60 / (height * rows), 1 / rows))
+    for row, (df, col, _) in enumerate(charts, start=1):
+        for trace in bar_quarter_traces(df, col):
+            # 所有子图同一季度的trace为一组，只在第一个子图显示legend，点击legend时同时显示/隐藏所有子图
+            trace.update(legendgroup=trace.name, showlegend=row == 1)
+            fig.add_trace(trace, row=row, col=1)
+    fig.update_layout(barmode='group', bargap=0.15,
+        height = height * rows,
+        legend=BAR_LEGEND,
+        uniformtext_minsize=11,
+        uniformtext_mode='show',
+        )
+    fig.update_annotations(font_size=12)
+    # 共用x轴时默认只有最下面的子图显示年份，每个子图都显示
+    fig.update_xaxes(showgrid=True, showticklabels=True)
+    return fig
+
 
 
 # plot bar chart grouped by quarter. x is year, y is col data. fig1 is col data, fig2 is data of col.pct_change(-4)
@@ -293,13 +503,26 @@ def plot_bar_quarter_with_pct_go(df: pd.DataFrame, col: str, height: int = 300):
     fig2 = plot_bar_quarter_go(df, col_pct, height)
     return fig1, fig2
 
+# 多股对比折线图，df index为报告期，每一列是一只股票
+def plot_compare_lines(df: pd.DataFrame, title: str, height: int = 300) -> go.Figure:
+    fig = go.Figure()
+    for col in df.columns:
+        s = df[col].dropna()
+        fig.add_trace(go.Scatter(x=s.index, y=s, name=col, mode='lines+markers',
+                                 text=s.map(value_to_str),
+                                 hovertemplate='%{x|%Y-%m-%d}<br>%{fullData.name}: %{text}<extra></extra>'))
+    fig.update_layout(height=height,
+        legend=dict(x=0, y=1, orientation="h", yanchor="bottom", xanchor="left"),
+        title=dict(text=title, x=0.5, xanchor='center', yanchor='top', font=dict(size=12)),
+        yaxis_title=None,
+        xaxis_title=None)
+    fig.update_xaxes(showgrid=True)
+    return fig
+
 # 画资产负债表饼图
-# col_maps_dict 报表映射df字典，df_balance [资产负债表-报告期]
-def plot_pie_balance(col_maps_dict, df_balance: pd.DataFrame, height):
-    cols_date = df_balance[REPORT_DATE].dt.strftime('%Y-%m').to_list()
-    st_date = st.selectbox('选择资产负债表饼图日期：', options=cols_date)
-    date_index = cols_date.index(st_date)
-    
+# col_maps_dict 报表映射df字典，df_balance [资产负债表-报告期]，date_index 要画的报告期在df_balance中的行号
+def plot_pie_balance(col_maps_dict, df_balance: pd.DataFrame, date_index: int, height):
+
     # fig = make_subplots(rows=1, cols=2,
     #     specs=[[{"type": "domain"}, {"type": "domain"}]],
     #     subplot_titles=("资产", "负债"))
@@ -309,7 +532,7 @@ def plot_pie_balance(col_maps_dict, df_balance: pd.DataFrame, height):
     cols_asset = [REPORT_DATE] + cols_asset.tolist()
     df = df_balance[[col for col in cols_asset if col in df_balance.columns]]
     # st.write(df)
-    colors = px.colors.qualitative.Set3
+    colors = qualitative.Set3
     fig1 = go.Figure()
     fig1.add_trace(go.Pie(labels=df.columns[1:], values=df.iloc[date_index,1:], text=df.iloc[date_index,1:].map(value_to_str),
             textinfo="label+percent+text",
@@ -336,7 +559,7 @@ def plot_pie_balance(col_maps_dict, df_balance: pd.DataFrame, height):
     cols_liab = [REPORT_DATE] + cols_liab.tolist()
     df = df_balance[[col for col in cols_liab if col in df_balance.columns]]
     # st.write(df)
-    colors = px.colors.qualitative.Set3
+    colors = qualitative.Set3
     fig2 = go.Figure()
     fig2.add_trace(go.Pie(labels=df.columns[1:], values=df.iloc[date_index,1:], text=df.iloc[date_index,1:].map(value_to_str),
             textinfo="label+percent+text",
@@ -364,6 +587,7 @@ def plot_pie_balance(col_maps_dict, df_balance: pd.DataFrame, height):
 # px柱体上文字显示的效果不是很好，文字显示到画布以外就看不到了
 # plot bar chart grouped by quarter. x is year, y is col data. fig1 is col data, fig2 is data of col.pct_change(-4)
 def plot_bar_quarter_with_pct_px(df: pd.DataFrame, col: str, height: int = 300):
+    import plotly.express as px
     ### 计算同比数据
     col_pct = col+'_同比'
     #df[col_pct] = df[col].pct_change(-4)*100
@@ -456,6 +680,10 @@ def plot_bar_quarter_with_pct_px(df: pd.DataFrame, col: str, height: int = 300):
     return fig1, fig2
 
 def plot_bar_quarter_with_pct_plt(df: pd.DataFrame, col: str):
+    import matplotlib.pyplot as plt
+    from matplotlib.ticker import FuncFormatter
+    plt.rcParams['font.sans-serif'] = ['SimHei']
+    plt.rcParams['axes.unicode_minus'] = False
     # 格式化图表上要显示的值
     def val_formatter(val):
         if val==0:
@@ -0,0 +1,169 @@
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from functools import wraps
+
+import pandas as pd
+
+from instrumentation import get_metrics
+
+# 整个进程共用的数据下载调度，不依赖streamlit和akshare
+# 1. 每个数据源一个令牌桶限制请求速率，一个信号量限制同时进行的请求数，多个会话同时访问时不会对同一个数据源突发大量请求
+# 2. 每次请求有超时时间，失败或超时后按指数退避重试
+#    超时的下载函数无法中止，仍然占用数据源的并发名额，直到真正返回才释放，所以挂起的请求不会超过数据源的并发数
+# 3. 相同key的请求正在进行时，后来的请求直接等待同一个结果（两个用户同时打开600519只下载一次）
+# 4. 每次下载的耗时和失败次数记录在instrumentation中（fetch_seconds, fetch_errors_total）
+# 下载函数、时钟和sleep都可以替换，可以用本地的桩函数测试（python -m bench.stub_fetch）
+
+# 每个数据源每秒的请求数和同时进行的请求数，没有列出的数据源共用default的限制
+SOURCE_RATES = {'ths': 2.0, 'em': 5.0, 'sina': 2.0, 'default': 2.0}
+SOURCE_CONCURRENCY = {'ths': 3, 'em': 6, 'sina': 3, 'default': 3}
+# 单次请求超时(秒)，失败后的重试次数，第一次重试前等待的时间(秒)，之后每次加倍
+FETCH_TIMEOUT = 30
+FETCH_RETRIES = 2
+FETCH_BACKOFF = 1.0
+
+
+class FetchTimeout(Exception):
+    pass
+
+
+class TokenBucket:
+    """令牌桶，每秒补充rate个令牌，最多burst个。acquire取不到令牌时等待"""
+    def __init__(self, rate: float, burst: float = 1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = self.clock()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            self.sleep(wait)
+
+
+class FetchScheduler:
+    def __init__(self, rates: dict[str, float] = SOURCE_RATES, concurrency: dict[str, int] = SOURCE_CONCURRENCY,
+                 timeout: float = FETCH_TIMEOUT, retries: int = FETCH_RETRIES, backoff: float = FETCH_BACKOFF,
+                 max_workers: int = 16, clock=time.monotonic, sleep=time.sleep):
+        self.rates = rates
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.clock = clock
+        self.sleep = sleep
+        # _coordinators执行限流、重试的流程，_workers执行实际的下载函数，这样超时的时候可以不等下载函数返回
+        # 下载函数只在取得数据源的并发名额后提交，名额在函数返回后才释放，_workers的线程数等于所有名额之和，不会被挂起的请求占满
+        self._coordinators = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fetch-coordinator')
+        self._workers = ThreadPoolExecutor(max_workers=sum(concurrency.values()), thread_name_prefix='fetch-worker')
+        self._buckets = {}
+        self._semaphores = {}
+        self._inflight = {}
+        # 已经超时、结果被丢弃但还没有返回的下载函数的数量
+        self.abandoned = 0
+        self._lock = threading.RLock()
+
+    def _source_limits(self, source: str) -> tuple[TokenBucket, threading.Semaphore]:
+        if source not in self.concurrency:
+            source = 'default'
+        with self._lock:
+            if source not in self._buckets:
+                self._buckets[source] = TokenBucket(self.rates.get(source, self.rates['default']), clock=self.clock, sleep=self.sleep)
+                self._semaphores[source] = threading.Semaphore(self.concurrency[source])
+            return self._buckets[source], self._semaphores[source]
+
+    def submit(self, key: tuple, source: str, func, *args) -> Future:
+        """
+        提交下载任务，返回Future。key相同的任务正在进行时，返回正在进行的任务的Future，不重复下载
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._coordinators.submit(self._run, source, func, args)
+                self._inflight[key] = future
+                future.add_done_callback(lambda f: self._forget(key, f))
+        return future
+
+    def call(self, key: tuple, source: str, func, *args):
+        """submit并等待结果，失败时抛出最后一次的异常"""
+        return self.submit(key, source, func, *args).result()
+
+    def _forget(self, key: tuple, future: Future):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def _abandoned_done(self, future: Future):
+        with self._lock:
+            self.abandoned -= 1
+
+    def _run(self, source: str, func, args: tuple):
+        bucket, semaphore = self._source_limits(source)
+        name = f'{getattr(func, "__name__", func)}{args}'
+        for attempt in range(self.retries + 1):
+            bucket.acquire()
+            # 名额被之前超时但还在运行的请求占满时，最多等待timeout秒
+            if not semaphore.acquire(timeout=self.timeout):
+                error = FetchTimeout(f'{name} no free {source} slot after {self.timeout}s')
+            else:
+                try:
+                    future = self._workers.submit(func, *args)
+                except BaseException:
+                    semaphore.release()
+                    raise
+                # 下载函数真正返回后才释放名额
+                future.add_done_callback(lambda f: semaphore.release())
+                try:
+                    return future.result(timeout=self.timeout)
+                except TimeoutError:
+                    # 超时的下载函数无法中止，结果会被丢弃，返回前一直占用名额
+                    with self._lock:
+                        self.abandoned += 1
+                    future.add_done_callback(self._abandoned_done)
+                    get_metrics().inc('fetch_abandoned_total', source=source)
+                    error = FetchTimeout(f'{name} timeout after {self.timeout}s')
+                except Exception as e:
+                    error = e
+            get_metrics().inc('fetch_errors_total', source=source, error=type(error).__name__)
+            if attempt < self.retries:
+                # 指数退避，加上随机抖动避免多个任务同时重试
+                self.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1))
+        raise error
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+def get_scheduler() -> FetchScheduler:
+    """整个进程共用的FetchScheduler，第一次使用时创建"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = FetchScheduler()
+        return _scheduler
+
+
+def scheduled_fetch(report_name: str):
+    """
+    装饰器，func(code, source) 形式的报表下载函数通过get_scheduler()调度执行
+    放在persist_report下面，只有真正访问网络的请求才会占用限流的额度
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(code: str, source: str = 'ths') -> pd.DataFrame:
+            # 耗时包括限流等待和重试，是页面实际等待的时间
+            with get_metrics().timer('fetch_seconds', source=source, report=report_name):
+                return get_scheduler().call((report_name, code, source), source, func, code, source)
+        return wrapper
+    return decorator
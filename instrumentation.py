@@ -0,0 +1,170 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 性能统计，不依赖streamlit，整个进程共用一个Metrics
+# 1. 计时：下载（每个数据源和报表）、报表计算的每个步骤、图表和表格的生成，记录次数、总耗时和最大耗时
+# 2. 缓存命中：st.cache_data/st.cache_resource缓存的函数用cached()包装，ReportViews的缓存直接计数
+# 3. 导出：Prometheus文本格式（环境变量METRICS_PORT设置端口时启动http服务）和JSON日志（环境变量METRICS_LOG设置文件路径时定时追加）
+# 名称和标签遵循Prometheus的习惯：计时以_seconds结尾，计数以_total结尾
+
+METRICS_PREFIX = 'stock_report_'
+# JSON日志的写入间隔(秒)
+METRICS_LOG_INTERVAL = 60
+
+
+class Metrics:
+    def __init__(self):
+        # {(name, labels): value}  labels为排序后的 ((key, value), ...)
+        self._counters = {}
+        # {(name, labels): [count, sum, max]}
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            stat = self._timers.setdefault(key, [0, 0.0, 0.0])
+            stat[0] += 1
+            stat[1] += seconds
+            stat[2] = max(stat[2], seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """with metrics.timer('fetch_seconds', source='ths'): ...  出现异常时也记录耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._timers.clear()
+
+    def snapshot(self) -> dict:
+        """{'counters': [{name, labels, value}], 'timers': [{name, labels, count, sum, max}]}"""
+        with self._lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value} for (name, labels), value in self._counters.items()]
+            timers = [{'name': name, 'labels': dict(labels), 'count': count, 'sum': total, 'max': max_seconds}
+                      for (name, labels), (count, total, max_seconds) in self._timers.items()]
+        return {'time': time.time(), 'pid': os.getpid(), 'counters': counters, 'timers': timers}
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), ensure_ascii=False)
+
+    def to_prometheus(self) -> str:
+        """Prometheus文本格式，计时导出为summary（_count和_sum）和单独的_max"""
+        snapshot = self.snapshot()
+        lines = []
+        for name in sorted({c['name'] for c in snapshot['counters']}):
+            lines.append(f'# TYPE {METRICS_PREFIX}{name} counter')
+            lines += [f'{METRICS_PREFIX}{name}{_prometheus_labels(c["labels"])} {c["value"]}'
+                      for c in snapshot['counters'] if c['name'] == name]
+        for name in sorted({t['name'] for t in snapshot['timers']}):
+            timers = [t for t in snapshot['timers'] if t['name'] == name]
+            lines.append(f'# TYPE {METRICS_PREFIX}{name} summary')
+            for t in timers:
+                labels = _prometheus_labels(t['labels'])
+                lines.append(f'{METRICS_PREFIX}{name}_count{labels} {t["count"]}')
+                lines.append(f'{METRICS_PREFIX}{name}_sum{labels} {t["sum"]:.6f}')
+            lines.append(f'# TYPE {METRICS_PREFIX}{name}_max gauge')
+            lines += [f'{METRICS_PREFIX}{name}_max{_prometheus_labels(t["labels"])} {t["max"]:.6f}' for t in timers]
+        return '\n'.join(lines) + '\n'
+
+
+def _prometheus_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels.items()) + '}'
+
+
+_metrics = Metrics()
+def get_metrics() -> Metrics:
+    return _metrics
+
+
+# 每个线程正在进行的cached调用，栈顶的调用在缓存未命中时被标记
+_cache_calls = threading.local()
+
+def cached(cache, name: str | None = None):
+    """
+    给缓存装饰器（如st.cache_data(ttl=3600)）加上命中统计: @cached(st.cache_data(ttl=3600))
+    统计cache_requests_total{cache, result=hit|miss}，未命中时被缓存函数的耗时记录在cache_miss_seconds{cache}
+    返回的函数保留缓存装饰器的clear等属性
+    """
+    def decorator(func):
+        cache_name = name or func.__name__
+
+        @wraps(func)
+        def miss(*args, **kwargs):
+            _cache_calls.stack[-1] = True
+            with _metrics.timer('cache_miss_seconds', cache=cache_name):
+                return func(*args, **kwargs)
+        cached_func = cache(miss)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            stack = _cache_calls.__dict__.setdefault('stack', [])
+            stack.append(False)
+            try:
+                return cached_func(*args, **kwargs)
+            finally:
+                _metrics.inc('cache_requests_total', cache=cache_name, result='miss' if stack.pop() else 'hit')
+        for attr in ('clear',):
+            if hasattr(cached_func, attr):
+                setattr(wrapper, attr, getattr(cached_func, attr))
+        return wrapper
+    return decorator
+
+
+class _PrometheusHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = _metrics.to_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _write_json_log(path: str, interval: float):
+    while True:
+        time.sleep(interval)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(_metrics.to_json() + '\n')
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+def start_exporters(port: int | None = None, log_path: str | None = None, interval: float = METRICS_LOG_INTERVAL):
+    """
+    启动导出线程，只在第一次调用时启动，app每次rerun都可以调用
+    port默认读取环境变量METRICS_PORT，log_path默认读取环境变量METRICS_LOG，都没有设置时不启动
+    """
+    global _exporters_started
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+    port = port or int(os.environ.get('METRICS_PORT', 0))
+    log_path = log_path or os.environ.get('METRICS_LOG')
+    if port:
+        server = ThreadingHTTPServer(('0.0.0.0', port), _PrometheusHandler)
+        threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    if log_path:
+        threading.Thread(target=_write_json_log, args=(log_path, interval), name='metrics-log', daemon=True).start()
@@ -0,0 +1,148 @@
+# 批量预计算：下载stock_list1.csv中所有股票的原始报表，计算全部报表后保存到report_store
+# 下载完成的原始报表攒够--batch只股票后，用面板报表（report_panel.calculate_panel）一起计算，每个计算步骤每批只运行一次
+# app中打开已经预计算过的股票时直接从存储读取，不需要再下载和计算
+# 完成后重新生成全市场筛选用的指标长表
+# 用法: python precompute.py --source ths --workers 4 --rate 2 [--batch 200] [--resume] [--force] [--codes 600519 000001] [--limit 100]
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from common import *
+from report_data import (get_stock_list, get_col_maps_dict, get_all_reports_concurrently, refresh_derived_reports,
+                         save_derived_reports, clear_cached_reports, save_metric_table)
+from report_panel import calculate_panel
+
+# checkpoint文件中这些状态的股票在--resume时跳过
+DONE_STATUS = ('ok', 'skip', 'update')
+
+
+class RateLimiter:
+    """限制每秒开始处理的股票数，多个线程共用。rate<=0 不限制"""
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+# 下载一只股票，返回 (状态, 原始报表)。状态为raw时原始报表需要计算（calculate_batch），计算保存后状态为ok
+# skip-存储中已有未过期数据或没有新的报告期，empty-原始报表下载失败，update-存储中过期的数据增量追加了新的报告期
+def precompute_one(code: str, source: str, col_maps_dict: dict, limiter: RateLimiter,
+                   force: bool = False) -> tuple[str, dict[str, pd.DataFrame] | None]:
+    try:
+        if not force:
+            # 存储中已有的数据只计算新增的报告期，没有新的报告期时不重新计算
+            _, status = refresh_derived_reports(code, source, col_maps_dict, before_download=limiter.wait)
+            if status != 'missing':
+                return {'fresh': 'skip', 'unchanged': 'skip', 'update': 'update', 'stale': 'empty'}[status], None
+        limiter.wait()
+        reports_raw = get_all_reports_concurrently(code, source)
+        if any(df.empty for df in reports_raw.values()):
+            return 'empty', None
+    finally:
+        clear_cached_reports(code, source)
+    return 'raw', reports_raw
+
+
+# 一批股票的原始报表一起计算并保存，返回 {code: 状态}
+def calculate_batch(reports_raw_by_code: dict[str, dict[str, pd.DataFrame]], source: str, col_maps_dict: dict) -> dict[str, str]:
+    for code, reports in calculate_panel(reports_raw_by_code, col_maps_dict, source, compact=True).items():
+        save_derived_reports(code, source, reports)
+    return {code: 'ok' for code in reports_raw_by_code}
+
+
+def load_checkpoint(path: str) -> set[str]:
+    done = set()
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                code, _, status = line.strip().partition('\t')
+                if status in DONE_STATUS:
+                    done.add(code)
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='批量下载并计算所有股票的财务报表，保存到report_store')
+    parser.add_argument('--source', default='ths', choices=list(DATA_SOURCE.values()), help='数据源')
+    parser.add_argument('--workers', type=int, default=4, help='并发处理的股票数')
+    parser.add_argument('--rate', type=float, default=2, help='每秒最多开始处理的股票数，<=0不限制')
+    parser.add_argument('--batch', type=int, default=200, help='每批一起计算的股票数')
+    parser.add_argument('--checkpoint', default=None, help='checkpoint文件，默认 precompute_<source>.checkpoint')
+    parser.add_argument('--resume', action='store_true', help='跳过checkpoint中已完成的股票')
+    parser.add_argument('--force', action='store_true', help='存储中已有未过期的数据也重新下载计算')
+    parser.add_argument('--codes', nargs='*', help='只处理这些股票代码，默认stock_list1.csv中的全部股票')
+    parser.add_argument('--limit', type=int, default=0, help='最多处理的股票数，0不限制')
+    args = parser.parse_args(argv)
+
+    checkpoint = args.checkpoint or f'precompute_{args.source}.checkpoint'
+    if args.codes:
+        codes = [code.strip().zfill(6) for code in args.codes]
+    else:
+        codes = get_stock_list()['code'].astype(str).str.zfill(6).to_list()
+    done = load_checkpoint(checkpoint) if args.resume else set()
+    codes = [code for code in codes if code not in done]
+    if args.limit > 0:
+        codes = codes[:args.limit]
+    col_maps_dict = get_col_maps_dict()
+    limiter = RateLimiter(args.rate)
+    print(f'{len(codes)} stocks to precompute, {len(done)} skipped by checkpoint, source={args.source}')
+
+    counts = {}
+    start = time.monotonic()
+    with open(checkpoint, 'a' if args.resume else 'w', encoding='utf-8') as f_checkpoint, \
+            ThreadPoolExecutor(max_workers=args.workers) as executor:
+        def record(code: str, status: str):
+            # 每处理完一只股票就写入checkpoint，中断后可以用--resume继续。等待计算的股票在计算保存后才写入
+            counts[status] = counts.get(status, 0) + 1
+            f_checkpoint.write(f'{code}\t{status}\n')
+            f_checkpoint.flush()
+
+        def flush_batch():
+            try:
+                statuses = calculate_batch(batch, args.source, col_maps_dict)
+            except Exception as e:
+                print(f'❌ batch of {len(batch)} failed: {e}')
+                statuses = {code: 'failed' for code in batch}
+            for code, status in statuses.items():
+                record(code, status)
+            batch.clear()
+
+        batch = {}
+        futures = {executor.submit(precompute_one, code, args.source, col_maps_dict, limiter, args.force): code for code in codes}
+        for i, future in enumerate(as_completed(futures), 1):
+            code = futures[future]
+            try:
+                status, reports_raw = future.result()
+            except Exception as e:
+                status, reports_raw = 'failed', None
+                print(f'❌ {code} failed: {e}')
+            if status == 'raw':
+                batch[code] = reports_raw
+                if len(batch) >= args.batch:
+                    flush_batch()
+            else:
+                record(code, status)
+            if i % 50 == 0 or i == len(codes):
+                print(f'[{i}/{len(codes)}] {time.monotonic() - start:.0f}s {counts}')
+        if batch:
+            flush_batch()
+            print(f'[{len(codes)}/{len(codes)}] {time.monotonic() - start:.0f}s {counts}')
+    # 重新生成全市场筛选的指标长表
+    table = save_metric_table(args.source)
+    print(f'metric table: {table["code"].nunique()} stocks, {len(table)} rows, {time.monotonic() - start:.0f}s')
+    return counts
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+import threading
+from collections.abc import Mapping
+
+import pandas as pd
+import numpy as np
+
+from common import *
+from report_metrics import evaluate_metrics
+from instrumentation import get_metrics
+
+# 财务报表计算库，不依赖streamlit，不做网络访问，可以在多进程、批量计算和性能分析中直接使用
+# 对外接口：
+#   calculate_reports(reports_raw, col_maps_dict, source) -> {report_name: df}  从三张原始报表计算全部报表
+#   compact_reports(reports) -> reports  float64列在不影响显示时转成float32，用于缓存和保存
+#   LazyReports(reports_raw, col_maps_dict, source)  同上，但每张报表在第一次访问时才计算
+#   merge_report_fields(df, df_fill) -> df  用其他数据源的报表补齐缺失的报告期和字段
+#   update_reports(reports_old, reports_raw, col_maps_dict, source) -> (reports, new_dates)  只计算新增的报告期和依赖它们的报告期
+#   compare_metric(reports_by_code, report_name, metric) -> df  多只股票同一指标按报告期对齐
+# 各个计算步骤也可以单独调用，输入的df不会被修改，自定义指标的公式在report_metrics.METRICS中定义：
+#   format_raw_reports  add_profit_key_cols  add_profit_ratios  calc_cross_report  add_cross_ratios  add_turnover  add_dupont
+
+
+# 计算报表新列，生成单季度和同比报表
+# reports_raw为get_all_reports_concurrently下载的三张原始报表，source为akshare调用的数据源 ths em sina
+# compact=True时结果使用compact_reports压缩，用于缓存和保存
+def calculate_reports(reports_raw: dict[str, pd.DataFrame], col_maps_dict: dict, source: str, compact: bool = False) -> dict[str, pd.DataFrame]:
+    reports = LazyReports(reports_raw, col_maps_dict, source).materialize()
+    return compact_reports(reports) if compact else reports
+
+# 压缩报表占用的内存：float64列在显示结果（numbers_to_str）完全相同时转成float32，内存减半
+# 只在计算完成后用于缓存和保存，计算过程仍然使用float64
+def compact_report(df: pd.DataFrame) -> pd.DataFrame:
+    pos = [i for i, dtype in enumerate(df.dtypes) if dtype == np.float64]
+    if not pos:
+        return df
+    values = df.iloc[:, pos].to_numpy()
+    values32 = values.astype(np.float32)
+    same = (numbers_to_str(values) == numbers_to_str(values32.astype(np.float64))).all(axis=0)
+    # 按位置逐列替换，比df.astype({col: dtype})按列concat快很多
+    df = df.copy(deep=False)
+    for j, i in enumerate(pos):
+        if same[j]:
+            df.isetitem(i, values32[:, j])
+    return df
+
+def compact_reports(reports: dict[str, pd.DataFrame]) -> dict[str, pd.DataFrame]:
+    return {report_name: compact_report(df) for report_name, df in reports.items()}
+
+# 报表计算图 {节点名: (计算函数, 依赖的节点)}，计算函数的参数为 (LazyReports, *依赖节点的df)
+# 以'_'开头的是中间节点，不对外显示
+# 利润表 先计算[利润表-报告期]自定义新列。然后计算 [利润表-单季度]df，[利润表-报告期同比]df， [利润表-单季度同比]df'，自定义新列会被新的df继承
+# [利润表-报告期 和 利润表-单季度 的各种利润率和费用率]不可进行同比计算，同比报表依赖加利润率之前的中间节点
+REPORT_NODES = {
+    '_profit': (lambda r: r.format_raw(PROFIT_BY_REPORT), ()),
+    '_profit_key': (lambda r, df: add_profit_key_cols(df), ('_profit',)),
+    '_profit_quarter': (lambda r, df: get_quarter_report(df, REPORT_DATE, group_col=r.group_col), ('_profit_key',)),
+    PROFIT_BY_REPORT: (lambda r, df: add_profit_ratios(df), ('_profit_key',)),
+    PROFIT_BY_QUARTER: (lambda r, df: add_profit_ratios(df), ('_profit_quarter',)),
+    PROFIT_PCT_BY_REPORT: (lambda r, df: get_yoy_report(df, REPORT_DATE, group_col=r.group_col), ('_profit_key',)),
+    PROFIT_PCT_BY_QUARTER: (lambda r, df: get_yoy_report(df, REPORT_DATE, group_col=r.group_col), ('_profit_quarter',)),
+    CASH_BY_REPORT: (lambda r: r.format_raw(CASH_BY_REPORT), ()),
+    CASH_BY_QUARTER: (lambda r, df: get_quarter_report(df, REPORT_DATE, group_col=r.group_col), (CASH_BY_REPORT,)),
+    CASH_PCT_BY_REPORT: (lambda r, df: get_yoy_report(df, REPORT_DATE, group_col=r.group_col), (CASH_BY_REPORT,)),
+    CASH_PCT_BY_QUARTER: (lambda r, df: get_yoy_report(df, REPORT_DATE, group_col=r.group_col), (CASH_BY_QUARTER,)),
+    BALANCE_BY_REPORT: (lambda r: r.format_raw(BALANCE_BY_REPORT), ()),
+    BALANCE_PCT_BY_REPORT: (lambda r, df: get_yoy_report(df, REPORT_DATE, group_col=r.group_col), (BALANCE_BY_REPORT,)),
+    CROSS_REPORT: (lambda r, df_profit, df_balance, df_cash: calc_cross_report(df_profit, df_balance, df_cash,
+                                                                   cross_items=r.col_maps_dict[CROSS_REPORT]['item'].to_list(),
+                                                                   group_col=r.group_col),
+                   (PROFIT_BY_REPORT, BALANCE_BY_REPORT, CASH_BY_REPORT)),
+}
+
+class LazyReports(Mapping):
+    """
+    按需计算的报表，{report_name: df}，按REPORT_NAMES的顺序迭代
+    第一次访问某张报表时才计算它和它依赖的节点，计算结果缓存在对象中。只看[利润表-单季度]时不需要计算综合分析和同比报表
+    可以在多个线程之间共用，可以pickle（只保存原始报表和已经计算的节点，不保存on_complete）
+    compact为True时，全部报表都计算完成后用compact_reports压缩，并释放中间节点；on_complete(reports)在全部报表计算完成后调用一次，用于保存
+    """
+    # 多只股票纵向拼接计算时的股票代码列（report_panel.PanelReports），None表示只有一只股票
+    group_col = None
+
+    def __init__(self, reports_raw: dict[str, pd.DataFrame], col_maps_dict: dict, source: str,
+                 fill_reports: dict[str, dict[str, pd.DataFrame]] | None = None,
+                 compact: bool = False, on_complete=None):
+        self.reports_raw = reports_raw
+        self.col_maps_dict = col_maps_dict
+        self.source = source
+        # {source: reports_raw} 其他数据源的原始报表，用来补齐source中缺失的报告期和字段
+        self.fill_reports = fill_reports or {}
+        self.compact = compact
+        self.on_complete = on_complete
+        self._nodes = {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_formatted(cls, formatted: dict[str, pd.DataFrame], col_maps_dict: dict, source: str) -> 'LazyReports':
+        """使用已经格式化的三张报表（如只取一部分报告期）计算，不再调用format_report"""
+        reports = cls({}, col_maps_dict, source)
+        reports._nodes.update({'_profit': formatted[PROFIT_BY_REPORT], CASH_BY_REPORT: formatted[CASH_BY_REPORT],
+                               BALANCE_BY_REPORT: formatted[BALANCE_BY_REPORT]})
+        return reports
+
+    def format_raw(self, report_name: str) -> pd.DataFrame:
+        with get_metrics().timer('format_report_seconds', source=self.source, report=report_name):
+            df = format_report(self.reports_raw[report_name], df_col_maps=self.col_maps_dict[report_name], source=self.source)
+        # 各数据源经过col_maps格式化后列名相同，可以按报告期合并
+        for source, reports_raw in self.fill_reports.items():
+            df = merge_report_fields(df, format_report(reports_raw[report_name], df_col_maps=self.col_maps_dict[report_name], source=source))
+        return df
+
+    def node(self, name: str) -> pd.DataFrame:
+        with self._lock:
+            if name not in self._nodes:
+                func, deps = REPORT_NODES[name]
+                dfs = [self.node(dep) for dep in deps]
+                # 只计算这个节点自己的耗时，不包括依赖的节点
+                with get_metrics().timer('derive_seconds', stage=name):
+                    self._nodes[name] = func(self, *dfs)
+                if name in REPORT_NAMES:
+                    self._complete()
+            return self._nodes[name]
+
+    def _complete(self):
+        """全部报表都计算完成时压缩和调用on_complete，只进行一次"""
+        if not (self.compact or self.on_complete) or not all(report_name in self._nodes for report_name in REPORT_NAMES):
+            return
+        reports = {report_name: self._nodes[report_name] for report_name in REPORT_NAMES}
+        if self.compact:
+            # 中间节点只用于计算其他报表，全部计算完成后不再需要
+            reports = compact_reports(reports)
+            self._nodes = dict(reports)
+        on_complete, self.compact, self.on_complete = self.on_complete, False, None
+        if on_complete is not None:
+            on_complete(reports)
+
+    def is_computed(self, report_name: str) -> bool:
+        return report_name in self._nodes
+
+    def materialize(self) -> dict[str, pd.DataFrame]:
+        """计算全部报表，返回普通的dict"""
+        for report_name in REPORT_NAMES:
+            self.node(report_name)
+        # compact为True时最后一张报表计算完成后节点被替换成压缩的报表，重新取
+        return {report_name: self._nodes[report_name] for report_name in REPORT_NAMES}
+
+    def __getitem__(self, report_name: str) -> pd.DataFrame:
+        if report_name not in REPORT_NAMES:
+            raise KeyError(report_name)
+        return self.node(report_name)
+
+    def __contains__(self, report_name) -> bool:
+        return report_name in REPORT_NAMES
+
+    def __iter__(self):
+        return iter(REPORT_NAMES)
+
+    def __len__(self):
+        return len(REPORT_NAMES)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['on_complete'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+# 增量更新：reports_old为之前计算的全部报表，reports_raw为重新下载的原始报表
+# 计算reports_old中没有的新报告期，以及依赖新报告期的旧报告期，替换或追加到reports_old中。返回 (reports, 新报告期)，没有新报告期时返回reports_old
+# 单季度值依赖同一年的上一季度，同比依赖一年前，周转率依赖去年年末。补上缺失的旧报告期时，
+# 同一年后面的季度（单季度）和下一年的全部报告期（同比、周转率）也要重新计算，再往后的报告期不受影响，结果和calculate_reports相同
+# 所以只需要最早的新报告期之前UPDATE_WINDOW_YEARS年的数据。数据源修订旧报告期的数据时，需要用calculate_reports全部重新计算
+UPDATE_WINDOW_YEARS = 2
+def update_reports(reports_old: dict[str, pd.DataFrame], reports_raw: dict[str, pd.DataFrame], col_maps_dict: dict,
+                   source: str) -> tuple[dict[str, pd.DataFrame], list[pd.Timestamp]]:
+    raw_names = [PROFIT_BY_REPORT, CASH_BY_REPORT, BALANCE_BY_REPORT]
+    formatted = dict(zip(raw_names, format_raw_reports(reports_raw, col_maps_dict, source).values()))
+    new_dates = set()
+    for report_name in raw_names:
+        dates = formatted[report_name][REPORT_DATE]
+        new_dates.update(dates[~dates.isin(reports_old[report_name][REPORT_DATE])].dropna())
+    if not new_dates:
+        return reports_old, []
+    # 需要重新计算的报告期：新报告期、同一年中在它之后的报告期、下一年的全部报告期
+    all_dates = pd.Series(pd.concat([df[REPORT_DATE] for df in formatted.values()]).dropna().unique())
+    recalc = pd.Series(False, index=all_dates.index)
+    for date in new_dates:
+        recalc |= ((all_dates.dt.year == date.year) & (all_dates >= date)) | (all_dates.dt.year == date.year + 1)
+    recalc_dates = all_dates[recalc]
+    start = min(new_dates) - pd.DateOffset(years=UPDATE_WINDOW_YEARS)
+    window = LazyReports.from_formatted({report_name: df[df[REPORT_DATE] >= start] for report_name, df in formatted.items()},
+                                        col_maps_dict, source)
+    reports = {}
+    for report_name in REPORT_NAMES:
+        df_old = reports_old[report_name]
+        df_old = df_old[~df_old[REPORT_DATE].isin(recalc_dates)]
+        df_new = window[report_name]
+        df_new = df_new[df_new[REPORT_DATE].isin(recalc_dates)]
+        cols = list(df_old.columns) + [col for col in df_new.columns if col not in df_old.columns]
+        reports[report_name] = (pd.concat([df_new, df_old], axis=0, ignore_index=True)[cols]
+                                .sort_values(by=REPORT_DATE, ascending=False, kind='stable').reset_index(drop=True))
+    return reports, sorted(new_dates)
+
+# 格式化来自(ths, em, sina)的三张原始财务报表，统一格式，方便后续进行操作
+def format_raw_reports(reports_raw: dict[str, pd.DataFrame], col_maps_dict: dict, source: str) -> dict[str, pd.DataFrame]:
+    return {report_name: format_report(reports_raw[report_name], df_col_maps=col_maps_dict[report_name], source=source)
+            for report_name in [PROFIT_BY_REPORT, CASH_BY_REPORT, BALANCE_BY_REPORT]}
+
+# 合并两个数据源经过format_report格式化的同一张报表，df中缺失的报告期和字段（np.nan）用df_fill的值补齐
+# df中的列在前，df_fill中多出的列放到后面，按报告期降序排列
+def merge_report_fields(df: pd.DataFrame, df_fill: pd.DataFrame) -> pd.DataFrame:
+    if df_fill.empty or REPORT_DATE not in df_fill.columns:
+        return df
+    if df.empty or REPORT_DATE not in df.columns:
+        return df_fill
+    cols = list(df.columns) + [col for col in df_fill.columns if col not in df.columns]
+    df_merged = (df.drop_duplicates(REPORT_DATE).set_index(REPORT_DATE)
+                 .combine_first(df_fill.drop_duplicates(REPORT_DATE).set_index(REPORT_DATE)))
+    return df_merged.reset_index()[cols].sort_values(by=REPORT_DATE, ascending=False).reset_index(drop=True)
+
+# [利润表-报告期] 增加关键指标列，关键指标放到报告期列后面
+def add_profit_key_cols(df: pd.DataFrame) -> pd.DataFrame:
+    # 银行和保险行业的报表项目与传统项目不一样，指标注册表中只计算所需列都存在的指标
+    # 浅拷贝，新增和移动列不影响输入的df，已有的列和输入的df共用内存
+    df = evaluate_metrics(df, 'profit').copy(deep=False)
+    # 需判断计算得到的key_cols是否在df中存在，然后把key_cols放到前面
+    key_cols = [col for col in ['*营业总收入', '*毛利润', '*核心利润', '*营业利润', '*净利润', '*归母净利润', '*扣非净利润'] if col in df.columns]
+    start = df.columns.get_loc(REPORT_DATE) + 1
+    for idx, col in enumerate(key_cols):
+        # 关键指标依次插入到报告期后面（一只股票时报告期是第一列）
+        df.insert(start + idx, col, df.pop(col))
+    return df
+
+# [利润表-报告期] 和 [利润表-单季度] 增加各种利润率和费用率
+def add_profit_ratios(df: pd.DataFrame) -> pd.DataFrame:
+    return evaluate_metrics(df, 'profit_ratio')
+
+# 计算 [综合分析] 报表。先从各原始报表中取需要的数据列，再merge和sort，然后计算各种比率、周转和杜邦分析指标
+# cross_items为col_maps中综合分析的item列，用来对列排序
+# group_col 为多只股票纵向拼接在一起时的股票代码列，按 (股票代码, 报告期) 合并，股票代码列放在最前面
+def calc_cross_report(df_profit: pd.DataFrame, df_balance: pd.DataFrame, df_cash: pd.DataFrame, cross_items: list[str],
+                      group_col: str | None = None) -> pd.DataFrame:
+    profit_cols = [REPORT_DATE, '*营业总收入', '*毛利润', '*核心利润', '*营业利润', '*净利润', '营业成本']
+    balance_cols = [REPORT_DATE, '资产总计', '负债合计', '归属于母公司股东权益总计', '股东权益合计',
+                    '应收票据及应收账款', '其中:应收账款', '应收款项融资', '存货', '固定资产合计', '商誉',
+                    '应付票据及应付账款', '其中:应付账款', '预收款项', '合同负债', '短期借款','长期借款', '应付债券']
+    cash_cols = [REPORT_DATE, '期末现金及现金等价物余额']  #, '销售商品、提供劳务收到的现金', '经营活动产生的现金流量净额',
+    #              '投资活动产生的现金流量净额', '筹资活动产生的现金流量净额']
+    keys = [group_col] if group_col else []
+    df1 = df_profit[keys + [col for col in profit_cols if col in df_profit.columns]]
+    df2 = df_balance[keys + [col for col in balance_cols if col in df_balance.columns]]
+    df3 = df_cash[keys + [col for col in cash_cols if col in df_cash.columns]]
+    df = pd.merge(left=df1, right=df2, how='outer', on=keys + [REPORT_DATE])
+    df = pd.merge(left=df, right=df3, how='outer', on=keys + [REPORT_DATE])
+    if group_col:
+        df = df.sort_values(by=keys + [REPORT_DATE], ascending=[True, False]).reset_index(drop=True)
+    else:
+        df = df.sort_values(by=REPORT_DATE, axis=0, ascending=False).reset_index(drop=True)
+    df = add_cross_ratios(df)
+    df = add_turnover(df, group_col)
+    df = add_dupont(df)
+
+    ## 自定义列排序，col_maps中的列放到前面，没在里面的放到后面
+    col_orders = keys + [c for c in cross_items if c in df.columns] + [c for c in df.columns if c not in cross_items + keys]
+    return df[col_orders]
+
+# [综合分析] 应收应付、预收、有息负债、资产负债率等比率
+def add_cross_ratios(df: pd.DataFrame) -> pd.DataFrame:
+    return evaluate_metrics(df, 'cross')
+
+## 计算资产周转率和资产周转天数
+# 总资产周转率 = 营业收入 / 资产总计-平均资产
+# 固定资产周转率 = 营业收入 / 固定资产合计-平均资产
+# 应收账款周转率 = 营业收入 / 应收账款-平均资产产
+# 存货产周转率 = 营业成本 / 存货-平均资产
+# 应付账款周转率 = 营业成本 / 应付账款-平均资产
+# 现金周转天数 = 应收周转天数 + 存货周转天数 - 应付账款周转天数
+# 平均资产 = (本期 + 去年年末)/2，周转天数 = 360/周转率/4*季度
+# 全部使用向量化计算：去年年末的值通过 (股票代码, 年份) merge 得到，不依赖行的顺序
+# group_col 为多只股票纵向拼接在一起时的股票代码列，None表示只有一只股票
+TURNOVER_ITEMS = {'总资产': '资产总计',             # 周转率名称: 资产负债表项目名称
+                  '固定资产': '固定资产合计',
+                  '应收账款': '其中:应收账款',       # '应收票据及应收账款'   '其中:应收账款'
+                  '存货': '存货',
+                  '应付账款': '其中:应付账款',
+                  'tmp1' :'股东权益合计'}           # 只计算平均值，用于杜邦分析
+# 周转率的分子
+TURNOVER_BASE = {'资产总计': '*营业总收入', '固定资产合计': '*营业总收入', '其中:应收账款': '*营业总收入',
+                 '存货': '营业成本', '其中:应付账款': '营业成本'}
+def add_turnover(df: pd.DataFrame, group_col: str | None = None) -> pd.DataFrame:
+    df = df.copy(deep=False)
+    items = [col for col in TURNOVER_ITEMS.values() if col in df.columns]
+    keys = [group_col] if group_col else []
+    periods = pd.DataFrame({'year': df[REPORT_DATE].dt.year, 'quarter': df[REPORT_DATE].dt.quarter})
+    for key in keys:
+        periods[key] = df[key].to_numpy()
+    # 每只股票每年第四季度的值，年份+1后和本期merge，得到去年年末的值
+    year_end = pd.concat([periods, df[items]], axis=1)
+    year_end = year_end[year_end['quarter'] == 4].drop_duplicates(keys + ['year'], keep='first')
+    year_end['year'] += 1
+    prev_year_end = periods[keys + ['year']].merge(year_end.drop(columns='quarter'), how='left', on=keys + ['year'])
+    quarter = periods['quarter'].to_numpy()
+    for key, col in TURNOVER_ITEMS.items():
+        if col not in items:
+            continue
+        df[col + '-平均'] = (df[col] + prev_year_end[col].to_numpy())/2
+        # 计算周转率和周转天数，quarter为季度
+        base = TURNOVER_BASE.get(col)
+        if base is not None and base in df.columns:
+            df[key + '周转率'] = df[base] / df[col + '-平均']
+            df[key + '周转天数'] = 360 / df[key + '周转率'] / 4 * quarter
+    if {'应收账款周转天数', '存货周转天数', '应付账款周转天数'}.issubset(df.columns):
+        df['现金周转天数'] = df['应收账款周转天数'] + df['存货周转天数'] - df['应付账款周转天数']
+    return df
+
+## 计算杜邦分析指标，需要add_turnover计算的平均资产列
+def add_dupont(df: pd.DataFrame) -> pd.DataFrame:
+    return evaluate_metrics(df, 'dupont')
+
+# 多股对比：从每只股票的report_name报表中取出metric列，按报告期对齐
+# 返回 index为报告期（降序），columns为股票代码的df。没有该指标的股票不在结果中
+def compare_metric(reports_by_code: dict[str, dict[str, pd.DataFrame]], report_name: str, metric: str) -> pd.DataFrame:
+    series = {}
+    for code, reports in reports_by_code.items():
+        df = reports[report_name]
+        if metric in df.columns:
+            s = df.set_index(REPORT_DATE)[metric]
+            series[code] = s[~s.index.duplicated()]
+    if not series:
+        return pd.DataFrame()
+    return pd.DataFrame(series).sort_index(ascending=False)
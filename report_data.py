@@ -0,0 +1,380 @@
+import streamlit as st
+import pandas as pd
+import numpy as np
+import logging
+import os, threading, time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+from common import *
+from fetch_scheduler import scheduled_fetch
+from instrumentation import cached, get_metrics
+from report_store import (persist_report, load_report, save_report, touch_reports, iter_reports, is_fresh, STORE_MAX_AGE,
+                          KIND_DERIVED, KIND_SCREEN, ALL_CODES)
+from col_maps import load_col_maps
+from report_calc import calculate_reports, update_reports, compact_reports, LazyReports
+from report_panel import calculate_panel, group_by_schema
+from stock_search import StockSearchIndex
+from report_view import ReportViews
+from screener import Screener, metric_table_from_items
+
+# 下载和缓存财务报表的函数，不包含页面代码，app.py和批量预计算precompute.py都从这里导入
+# 报表的计算都在report_calc.py中，不依赖streamlit
+# 缓存的函数都用instrumentation.cached包装，统计缓存命中次数和未命中时的耗时
+# akshare导入要将近1秒，在下载函数里第一次调用时才导入，不影响页面的首次显示
+
+@cached(st.cache_data(ttl=3600, show_spinner=False))
+def get_stock_list() -> pd.DataFrame:
+    df=pd.read_csv(r'stock_list1.csv', header=0)
+    return df
+# 股票搜索索引，整个进程只建立一次，所有会话共用，不做hash
+@cached(st.cache_resource(show_spinner=False))
+def get_stock_search_index() -> StockSearchIndex:
+    return StockSearchIndex(get_stock_list())
+@cached(st.cache_data(ttl=3600, show_spinner=False))
+# col_maps_dict {report_name: df in sheet_name['ths', 'em', 'sina', 'item', 'item_group']}
+# CROSS_REPORT only have 'item'. {CROSS_REPORT: 'item'}
+def get_col_maps_dict() -> dict[str, pd.DataFrame]:
+    sheet_map = {PROFIT_BY_REPORT: 'profit',
+                 CASH_BY_REPORT: 'cash',
+                 BALANCE_BY_REPORT: 'balance',
+                 PROFIT_BY_QUARTER: 'profit',
+                 CASH_BY_QUARTER: 'cash',
+
+                 PROFIT_PCT_BY_REPORT: 'profit',
+                 PROFIT_PCT_BY_QUARTER: 'profit',
+                 CASH_PCT_BY_REPORT: 'cash',
+                 CASH_PCT_BY_QUARTER: 'cash',
+                 BALANCE_PCT_BY_REPORT: 'balance',
+
+                 CROSS_REPORT: 'cross',
+                 }
+    # sheets_df is a dict. {sheet_name: df in each sheet}，读取预编译的col_maps.json，col_maps.xlsx修改后自动重新生成
+    sheets_df_dict = load_col_maps()
+    # st.write(sheets_df_dict)
+    col_maps_dict = {k: sheets_df_dict[v] for k, v in sheet_map.items()}
+    return col_maps_dict
+
+# 资产负债表 - 报告期
+@cached(st.cache_data(ttl=3600, show_spinner=False))
+@persist_report(BALANCE_BY_REPORT)
+@scheduled_fetch(BALANCE_BY_REPORT)
+def get_balance_sheet_by_report(code: str, source: str = 'ths') -> pd.DataFrame:
+    import akshare as ak
+    if source == 'ths':
+        return ak.stock_financial_debt_ths(symbol=code, indicator="按报告期")
+    elif source == 'em':
+        return ak.stock_balance_sheet_by_report_em(symbol=add_prefix_to_code(code))
+    elif source == 'sina':
+        return ak.stock_financial_report_sina(stock=code, symbol="资产负债表")
+    else:
+        return pd.DataFrame()
+# 利润表 - 报告期和季度, sina 没有提供按季度的报表
+@cached(st.cache_data(ttl=3600, show_spinner=False))
+@persist_report(PROFIT_BY_REPORT)
+@scheduled_fetch(PROFIT_BY_REPORT)
+def get_profit_sheet_by_report(code: str, source: str = 'ths') -> pd.DataFrame:
+    import akshare as ak
+    if source == 'ths':
+        return ak.stock_financial_benefit_ths(symbol=code, indicator="按报告期")
+    elif source == 'em':
+        return ak.stock_profit_sheet_by_report_em(symbol=add_prefix_to_code(code))
+    elif source == 'sina':
+        return ak.stock_financial_report_sina(stock=code, symbol="利润表")
+    else:
+        return pd.DataFrame()
+@cached(st.cache_data(ttl=3600, show_spinner=False))
+@persist_report(PROFIT_BY_QUARTER)
+@scheduled_fetch(PROFIT_BY_QUARTER)
+def get_profit_sheet_by_quarterly(code: str, source: str = 'ths') -> pd.DataFrame:
+    import akshare as ak
+    if source == 'ths':
+        return ak.stock_financial_benefit_ths(symbol=code, indicator="按单季度")
+    elif source == 'em':
+        return ak.stock_profit_sheet_by_quarterly_em(symbol=add_prefix_to_code(code))
+    else:
+        return pd.DataFrame()
+# 现金流量表 - 报告期和季度, sina 没有提供按季度的报表
+@cached(st.cache_data(ttl=3600, show_spinner=False))
+@persist_report(CASH_BY_REPORT)
+@scheduled_fetch(CASH_BY_REPORT)
+def get_cash_sheet_by_report(code: str, source: str = 'ths') -> pd.DataFrame:
+    import akshare as ak
+    if source == 'ths':
+        return ak.stock_financial_cash_ths(symbol=code, indicator="按报告期")
+    elif source == 'em':
+        return ak.stock_cash_flow_sheet_by_report_em(symbol=add_prefix_to_code(code))
+    elif source == 'sina':
+        return ak.stock_financial_report_sina(stock=code, symbol="现金流量表")
+    else:
+        return pd.DataFrame()
+@cached(st.cache_data(ttl=3600, show_spinner=False))
+@persist_report(CASH_BY_QUARTER)
+@scheduled_fetch(CASH_BY_QUARTER)
+def get_cash_sheet_by_quarterly(code: str, source: str = 'ths') -> pd.DataFrame:
+    import akshare as ak
+    if source == 'ths':
+        return ak.stock_financial_cash_ths(symbol=code, indicator="按单季度")
+    elif source == 'em':
+        return ak.stock_cash_flow_sheet_by_quarterly_em(symbol=add_prefix_to_code(code))
+    else:
+        return pd.DataFrame()
+    
+# 下载报表用的线程池，整个进程共用一个，第一次使用时创建
+_fetch_pool = None
+def get_fetch_pool() -> ThreadPoolExecutor:
+    global _fetch_pool
+    if _fetch_pool is None:
+        _fetch_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix='report-fetch')
+    return _fetch_pool
+
+logger = logging.getLogger(__name__)
+
+# 最近一次下载失败的原始报表 {(code, source): {report_name: 错误信息}}，最多保存FETCH_FAILURES_MAX只股票
+# 下载在线程池中进行，没有ScriptRunContext，不能调用st.error。失败记录在这里、日志和fetch_failures_total中，由app在主线程中显示
+FETCH_FAILURES_MAX = 1000
+_fetch_failures = {}
+_fetch_failures_lock = threading.Lock()
+
+def get_fetch_failures(code: str, source: str) -> dict[str, str]:
+    with _fetch_failures_lock:
+        return dict(_fetch_failures.get((code, source), {}))
+
+def _record_fetch_failures(code: str, source: str, failures: dict[str, str]):
+    with _fetch_failures_lock:
+        _fetch_failures.pop((code, source), None)
+        if failures:
+            _fetch_failures[(code, source)] = failures
+            while len(_fetch_failures) > FETCH_FAILURES_MAX:
+                _fetch_failures.pop(next(iter(_fetch_failures)))
+
+# thread function to get report
+# return value {report_name: report_df, ...}
+@cached(st.cache_data(ttl=3600, show_spinner=False))
+def get_all_reports_concurrently(code: str, source: str = 'ths') -> dict[str, pd.DataFrame]:
+    # five reports as 
+    tasks = [(PROFIT_BY_REPORT, get_profit_sheet_by_report, (code, source)),
+             (CASH_BY_REPORT,get_cash_sheet_by_report, (code, source)),
+             (BALANCE_BY_REPORT, get_balance_sheet_by_report, (code, source))]
+            # 单季度数据后面自行计算，不从网上抓取了
+            #  (PROFIT_BY_QUARTER, get_profit_sheet_by_quarterly, (code, source)),
+            #  (CASH_BY_QUARTER, get_cash_sheet_by_quarterly, (code, source))
+    results= {}
+    failures = {}
+    futures_to_tasks = {}
+    # 使用进程共用的线程池，网络请求的限流、超时和重试在fetch_scheduler中进行
+    executor = get_fetch_pool()
+    for name, func, args in tasks:
+        futures_to_tasks[executor.submit(func, *args)] = (name,func.__name__, *args)
+    # futures_to_tasks = {executor.submit(func, *args): name for name, func, args in tasks}
+
+    for future in as_completed(futures_to_tasks.keys()):
+        report_name, func_name, code, source = futures_to_tasks[future]
+        try:
+            # st.write(report_name, func_name, code, source )
+            results[report_name] = future.result()
+        except Exception as e:
+            # 捕获异常，返回空 DataFrame
+            failures[report_name] = f'{type(e).__name__}: {e}'
+            logger.warning('%s download failed (%s, %s): %r', report_name, code, source, e)
+            get_metrics().inc('fetch_failures_total', source=source, report=report_name)
+            results[report_name] = pd.DataFrame()
+    _record_fetch_failures(code, source, failures)
+    
+    # sort reports in results, 按照代码定义区的定义返回reports
+    results = {report_name: results[report_name] for report_name, _, _ in tasks}
+    return results
+
+# 自动选择数据源时，同时进行的各数据源下载任务使用的线程池。任务中会等待get_fetch_pool中的下载，不能使用同一个线程池
+_auto_pool = None
+def get_auto_pool() -> ThreadPoolExecutor:
+    global _auto_pool
+    if _auto_pool is None:
+        _auto_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix='report-auto')
+    return _auto_pool
+
+# 三张原始报表都不为空
+def is_complete_reports(reports_raw: dict[str, pd.DataFrame]) -> bool:
+    return all(not df.empty for df in reports_raw.values())
+
+# 自动选择数据源下载原始报表，返回 (数据源, 原始报表, {其他数据源: 原始报表})
+# 按AUTO_SOURCES的顺序请求，前一个数据源AUTO_HEDGE_DELAY秒内没有完成或者下载失败时，开始请求下一个，返回最先完整下载的数据源
+# merge_sources为True时等待所有数据源完成（最多AUTO_TIMEOUT秒），按AUTO_SOURCES顺序第一个完整的数据源为主，其他数据源的报表用来补齐缺失的字段
+# 所有数据源都失败时返回第一个数据源的结果（空表）
+@cached(st.cache_data(ttl=3600, show_spinner=False))
+def get_all_reports_auto(code: str, merge_sources: bool = False) -> tuple[str, dict[str, pd.DataFrame], dict[str, dict[str, pd.DataFrame]]]:
+    executor = get_auto_pool()
+    deadline = time.monotonic() + AUTO_TIMEOUT
+    pending = {}     # {future: source}
+    results = {}     # {source: reports_raw}
+    sources = iter(AUTO_SOURCES)
+    def start_next() -> bool:
+        source = next(sources, None)
+        if source is not None:
+            pending[executor.submit(get_all_reports_concurrently, code, source)] = source
+        return source is not None
+    # merge_sources时所有数据源一起开始
+    while start_next() and merge_sources:
+        pass
+    while pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        done, _ = wait(pending, timeout=remaining if merge_sources else min(AUTO_HEDGE_DELAY, remaining), return_when=FIRST_COMPLETED)
+        if not done:
+            # 对冲：当前的数据源太慢，同时请求下一个
+            start_next()
+            continue
+        for future in done:
+            source = pending.pop(future)
+            results[source] = future.result()
+            if not merge_sources and is_complete_reports(results[source]):
+                return source, results[source], {}
+            if not is_complete_reports(results[source]) and not pending:
+                # 失败了并且没有正在进行的请求，马上请求下一个
+                start_next()
+    complete = [source for source in AUTO_SOURCES if source in results and is_complete_reports(results[source])]
+    if not complete:
+        return AUTO_SOURCES[0], results.get(AUTO_SOURCES[0], {report_name: pd.DataFrame() for report_name in [PROFIT_BY_REPORT, CASH_BY_REPORT, BALANCE_BY_REPORT]}), {}
+    return complete[0], results[complete[0]], {source: results[source] for source in complete[1:]}
+
+# 清除某只股票原始报表在st.cache_data中的缓存。数据已经保存在存储中，批量预计算时用来避免整个股票池的数据都留在内存中
+def clear_cached_reports(code: str, source: str):
+    for func in [get_profit_sheet_by_report, get_cash_sheet_by_report, get_balance_sheet_by_report, get_all_reports_concurrently]:
+        func.clear(code, source)
+
+# 某只股票报表的筛选视图，缓存筛选结果，sidebar控件变化时不需要重新筛选所有报表
+# 用cache_resource在会话之间共用，不在每次rerun时反序列化全部报表；_col_maps_dict不参与hash
+# 存储中没有计算好的报表时，使用LazyReports，只计算页面用到的报表
+# 页面访问过全部报表（LazyReports全部计算完成）后，压缩的报表才保存到存储；只看了部分报表的股票不保存，由precompute.py批量保存
+# st_data_source为AUTO_SOURCE时自动选择数据源，merge_sources为True时用其他数据源补齐缺失的字段，结果不保存到存储
+@cached(st.cache_resource(ttl=3600, max_entries=64, show_spinner=False))
+def get_report_views(stock_code: str, st_data_source: str, _col_maps_dict: dict, merge_sources: bool = False) -> ReportViews:
+    if st_data_source == AUTO_SOURCE:
+        source, reports_raw, fill_reports = get_all_reports_auto(stock_code, merge_sources)
+        return ReportViews(LazyReports(reports_raw, _col_maps_dict, source, fill_reports, compact=True), _col_maps_dict)
+    source = DATA_SOURCE[st_data_source]
+    reports, _ = refresh_derived_reports(stock_code, source, _col_maps_dict)
+    if reports is None:
+        reports = LazyReports(get_all_reports_concurrently(stock_code, source), _col_maps_dict, source, compact=True,
+                              on_complete=lambda reports: save_derived_reports(stock_code, source, reports))
+    return ReportViews(reports, _col_maps_dict)
+
+# 从存储中读取计算好的报表，缺少任何一张或者超过max_age已过期返回None
+def load_derived_reports(code: str, source: str, max_age: float = STORE_MAX_AGE) -> dict[str, pd.DataFrame] | None:
+    reports = {}
+    for report_name in REPORT_NAMES:
+        df, updated_at = load_report(code, source, report_name, kind=KIND_DERIVED)
+        if df is None or not is_fresh(updated_at, max_age):
+            return None
+        reports[report_name] = df
+    return reports
+
+# 最新报告期的下一个季度末已经过去，数据源中才可能有新的报告期
+def new_period_possible(reports: dict[str, pd.DataFrame]) -> bool:
+    latest = max(reports[report_name][REPORT_DATE].max() for report_name in [PROFIT_BY_REPORT, CASH_BY_REPORT, BALANCE_BY_REPORT])
+    return pd.isna(latest) or pd.Timestamp.now() >= latest + pd.offsets.QuarterEnd(1)
+
+# 增量更新存储中计算好的报表，返回 (reports, status)
+# 过期的报表先判断是否可能有新的报告期，不可能有时不下载；下载后只计算新增的报告期和依赖它们的报告期（update_reports），合并后保存
+# 数据源修订旧报告期的数据不会被更新，需要用 precompute.py --force 全部重新计算
+# status: fresh-未过期  unchanged-没有新的报告期  update-追加了新的报告期  stale-下载失败，返回过期的报表  missing-存储中没有，返回None
+# before_download在下载前调用，用于批量预计算时限速
+def refresh_derived_reports(code: str, source: str, col_maps_dict: dict, before_download=None) -> tuple[dict[str, pd.DataFrame] | None, str]:
+    reports = load_derived_reports(code, source)
+    if reports is not None:
+        return reports, 'fresh'
+    reports = load_derived_reports(code, source, max_age=float('inf'))
+    if reports is None:
+        return None, 'missing'
+    if not new_period_possible(reports):
+        touch_reports(code, source, KIND_DERIVED)
+        return reports, 'unchanged'
+    if before_download is not None:
+        before_download()
+    reports_raw = get_all_reports_concurrently(code, source)
+    if not is_complete_reports(reports_raw):
+        return reports, 'stale'
+    reports, new_dates = update_reports(reports, reports_raw, col_maps_dict, source)
+    if not new_dates:
+        touch_reports(code, source, KIND_DERIVED)
+        return reports, 'unchanged'
+    # 新旧报告期拼接后float32的列会变回float64，保存前重新压缩
+    reports = compact_reports(reports)
+    save_derived_reports(code, source, reports)
+    return reports, 'update'
+
+# 保存计算好的报表。原始报表下载失败（空表）时不保存，避免把不完整的结果写进存储
+# 保存的报表应该先用compact_reports压缩（calculate_reports(..., compact=True)），存储文件和读取后占用的内存都更小
+def save_derived_reports(code: str, source: str, reports: dict[str, pd.DataFrame]):
+    if any(reports[report_name].empty for report_name in [PROFIT_BY_REPORT, CASH_BY_REPORT, BALANCE_BY_REPORT]):
+        return
+    for report_name, df in reports.items():
+        save_report(code, source, report_name, df, kind=KIND_DERIVED)
+
+# 多股对比计算报表用的进程池，整个进程共用一个，第一次使用时创建。计算不占用streamlit进程的GIL
+_process_pool = None
+def get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=os.cpu_count())
+    return _process_pool
+
+# 面板计算每批最多的股票数，批数多于1时分配到进程池的多个进程
+PANEL_BATCH_SIZE = 50
+
+# 多股对比：先从存储中读取计算好的报表，没有的用线程池并发下载原始报表（网络I/O）
+# 再按数据源和报表字段分批，在进程池中用面板报表计算（CPU），每批的所有股票一起计算
+# 返回 {code: reports}，原始报表下载失败的股票不在返回结果中
+# source为AUTO_SOURCE时每只股票的数据源可能不同，不读取也不保存存储（和get_report_views相同）
+@cached(st.cache_data(ttl=3600, show_spinner=False))
+def load_reports_for_codes(codes: tuple[str, ...], source: str, col_maps_dict: dict, max_workers: int = 8) -> dict[str, dict[str, pd.DataFrame]]:
+    reports_by_code = {}
+    codes_to_fetch = []
+    for code in codes:
+        reports, _ = refresh_derived_reports(code, source, col_maps_dict) if source != AUTO_SOURCE else (None, 'missing')
+        if reports is None:
+            codes_to_fetch.append(code)
+        else:
+            reports_by_code[code] = reports
+    if codes_to_fetch:
+        # source为AUTO_SOURCE时每只股票自动选择数据源 {code: (数据源, 原始报表)}
+        if source == AUTO_SOURCE:
+            fetch = lambda code: get_all_reports_auto(code)[:2]
+        else:
+            fetch = lambda code: (source, get_all_reports_concurrently(code, source))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            reports_raw_by_code = dict(zip(codes_to_fetch, executor.map(fetch, codes_to_fetch)))
+        # 原始报表有空表的说明下载失败，不计算
+        reports_raw_by_code = {code: (code_source, reports_raw) for code, (code_source, reports_raw) in reports_raw_by_code.items()
+                               if is_complete_reports(reports_raw)}
+        by_source = {}
+        for code, (code_source, reports_raw) in reports_raw_by_code.items():
+            by_source.setdefault(code_source, {})[code] = reports_raw
+        pool = get_process_pool()
+        futures = [pool.submit(calculate_panel, batch, col_maps_dict, code_source, True)
+                   for code_source, reports_raw_group in by_source.items()
+                   for batch in group_by_schema(reports_raw_group, PANEL_BATCH_SIZE)]
+        for future in futures:
+            for code, reports in future.result().items():
+                reports_by_code[code] = reports
+                if source != AUTO_SOURCE:
+                    save_derived_reports(code, source, reports)
+    # 按输入的股票顺序返回
+    return {code: reports_by_code[code] for code in codes if code in reports_by_code}
+
+# 全市场筛选的指标长表，由存储中所有股票计算好的报表生成，保存在存储中（code为ALL_CODES）
+SCREEN_TABLE = 'metric_table'
+def save_metric_table(source: str) -> pd.DataFrame:
+    report_names = dict.fromkeys(report_name for report_name, _ in SCREEN_METRICS.values())
+    items = ((code, report_name, df) for report_name in report_names for code, df, _ in iter_reports(source, report_name, KIND_DERIVED))
+    table = metric_table_from_items(items)
+    save_report(ALL_CODES, source, SCREEN_TABLE, table, kind=KIND_SCREEN)
+    return table
+
+# 全市场筛选，存储中的指标长表过期时重新生成（批量预计算precompute.py完成后也会重新生成）
+@cached(st.cache_resource(ttl=3600, show_spinner=False))
+def get_screener(source: str) -> Screener:
+    table, updated_at = load_report(ALL_CODES, source, SCREEN_TABLE, kind=KIND_SCREEN)
+    if table is None or not is_fresh(updated_at):
+        table = save_metric_table(source)
+    return Screener(table)
@@ -0,0 +1,171 @@
+import re
+from functools import lru_cache
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+# 自定义指标注册表。每个指标只声明一次名字和公式，由compile_metrics编译成执行计划，evaluate_metrics一次性计算所有可以计算的指标
+# 公式语法：
+#   `列名`      使用df中的列或前面计算出的指标，缺少这一列时该公式不可用
+#   `?列名`     可选列，缺少时为MISSING，参与运算的结果也是MISSING，nzsum会跳过MISSING
+#   nz(x)       np.nan替换为0
+#   nzsum(...)  从0开始依次累加不是MISSING的项，所有项都缺失时结果为0
+# formulas可以有多个，按顺序使用第一个所需列都存在的公式
+# requires为公式以外需要存在的列，unless中的列已存在（或已计算出来）时不计算该指标
+# 指标可以和已有的列同名，用来先对原始列做处理（如研发费用的np.nan替换为0），后面的指标使用处理后的列
+
+
+class Metric(NamedTuple):
+    name: str
+    formulas: list[str]
+    requires: tuple[str, ...] = ()
+    unless: str | None = None
+
+
+# stage: 计算阶段，各阶段在report_calc中不同的位置计算
+METRICS = {
+    # [利润表-报告期] 关键指标
+    'profit': [
+        Metric('*营业总收入', ['`营业总收入`']),
+        # 2018年以前 研发费用属于管理费用，没有研发费用这一列，数据都是np.nan，需要用0来填充，否则计算出来的也是np.nan
+        Metric('研发费用', ['nz(`研发费用`)']),
+        Metric('*毛利润', ['`营业总收入` - `营业成本`']),
+        Metric('*核心利润', ['`营业总收入` - `营业税金及附加` - `营业成本` - `销售费用` - `管理费用` - `研发费用` - `财务费用`',
+                         '`营业总收入` - `营业税金及附加` - `营业成本` - `销售费用` - `管理费用` - `财务费用`']),
+        Metric('*营业利润', ['`营业利润`']),
+        Metric('*净利润', ['`净利润`']),
+        Metric('*归母净利润', ['`归母净利润`']),
+        Metric('*扣非净利润', ['`扣非净利润`']),
+    ],
+    # [利润表-报告期] 和 [利润表-单季度] 的各种利润率和费用率，不可进行同比计算，在同比计算之后计算
+    'profit_ratio': [
+        Metric('毛利润率[%]', ['`*毛利润`/ `营业总收入` * 100']),
+        Metric('核心利润率[%]', ['`*核心利润`/ `营业总收入` * 100']),
+        Metric('营业利润率[%]', ['`*营业利润`/ `营业总收入` * 100']),
+        Metric('净利润率[%]', ['`*净利润`/ `营业总收入` * 100']),
+        Metric('销售费用率[%]', ['`销售费用`/ `营业总收入` * 100']),
+        Metric('管理费用率[%]', ['`管理费用`/ `营业总收入` * 100']),
+        Metric('研发费用率[%]', ['`研发费用`/ `营业总收入` * 100']),
+        Metric('财务费用率[%]', ['`财务费用`/ `营业总收入` * 100']),
+        Metric('四费费率[%]', ['(`销售费用` + `管理费用` + `研发费用` + `财务费用`)/`营业总收入`*100']),
+        Metric('三费费率[%]', ['(`销售费用` + `管理费用` + `财务费用`)/`营业总收入`*100'], unless='四费费率[%]'),
+    ],
+    # [综合分析] 各种比率
+    'cross': [
+        Metric('应收应付总额比[%]', ['(`应收票据及应收账款` + `应收款项融资` - `应付票据及应付账款`)/(`应收票据及应收账款` + `应收款项融资`) *100',
+                                '(`应收票据及应收账款`  - `应付票据及应付账款`)/`应收票据及应收账款` *100']),
+        Metric('应收总额营收比[%]', ['(`应收票据及应收账款` + `应收款项融资`) / `*营业总收入` * 100',
+                                '(`应收票据及应收账款`) / `*营业总收入` * 100']),
+        Metric('存货营业成本比[%]', ['`存货`/`营业成本` * 100']),
+        # 避免na计算后产生na
+        Metric('预收款项', ['nz(`预收款项`)'], requires=('*营业总收入',)),
+        Metric('合同负债', ['nz(`合同负债`)'], requires=('*营业总收入',)),
+        Metric('预收总额营收比[%]', ['nzsum(`?预收款项`/`*营业总收入`*100, `?合同负债`/`*营业总收入`*100)']),
+        Metric('短期借款', ['nz(`短期借款`)']),
+        Metric('长期借款', ['nz(`长期借款`)']),
+        Metric('应付债券', ['nz(`应付债券`)']),
+        Metric('有息负债', ['nzsum(`?短期借款`, `?长期借款`, `?应付债券`)']),
+        Metric('有息负债现金等价物比[%]', ['`有息负债`/`期末现金及现金等价物余额` * 100']),
+        Metric('资产负债率[%]', ['`负债合计`/`资产总计` * 100']),
+        Metric('固定资产总资产比[%]', ['`固定资产合计`/`资产总计` * 100']),
+    ],
+    # [综合分析] 杜邦分析指标，需要add_turnover计算的平均资产列
+    'dupont': [
+        Metric('净资产收益率[%]', ['`*净利润` / `股东权益合计-平均` * 100']),
+        Metric('总资产收益率[%]', ['`*净利润` / `资产总计-平均` * 100']),
+        Metric('净利润率[%]', ['`*净利润` / `*营业总收入` * 100']),
+        Metric('权益乘数', ['`资产总计-平均` / `股东权益合计-平均`']),
+    ],
+}
+
+
+class _Missing:
+    """可选列缺失时的值，参与任何运算结果都是MISSING"""
+    def _op(self, *args):
+        return self
+    __add__ = __radd__ = __sub__ = __rsub__ = __mul__ = __rmul__ = __truediv__ = __rtruediv__ = __neg__ = _op
+
+    def __repr__(self):
+        return 'MISSING'
+
+MISSING = _Missing()
+
+
+def _nz(x):
+    return x if x is MISSING else np.where(np.isnan(x), 0, x)
+
+def _nzsum(*terms):
+    total = 0
+    for term in terms:
+        if term is not MISSING:
+            total = total + term
+    return total
+
+_FUNCS = {'nz': _nz, 'nzsum': _nzsum, '__builtins__': {}}
+
+
+class _Formula(NamedTuple):
+    inputs: frozenset[str]      # 必须存在的列
+    optional: frozenset[str]    # 可选列
+    code: object                # compile后的代码
+
+
+def _compile_formula(formula: str) -> _Formula:
+    inputs, optional = set(), set()
+    def repl(match):
+        (optional if match.group(1) else inputs).add(match.group(2))
+        return f'c[{match.group(2)!r}]'
+    expr = re.sub(r'`(\??)([^`]+)`', repl, formula)
+    return _Formula(frozenset(inputs), frozenset(optional), compile(expr, formula, 'eval'))
+
+
+@lru_cache(maxsize=None)
+def compile_metrics(stage: str) -> list[tuple[Metric, list[_Formula]]]:
+    """
+    编译stage中的所有指标，只在第一次调用时执行。
+    按依赖关系排序（被依赖的指标先计算，没有依赖关系的保持注册表中的顺序），公式编译成代码对象。
+    """
+    metrics = METRICS[stage]
+    compiled = {m.name: [_compile_formula(f) for f in m.formulas] for m in metrics}
+    names = {m.name for m in metrics}
+    deps = {}
+    for m in metrics:
+        used = set(m.requires) | ({m.unless} if m.unless else set())
+        for f in compiled[m.name]:
+            used |= f.inputs | f.optional
+        deps[m.name] = (used & names) - {m.name}
+    plan, done = [], set()
+    while len(plan) < len(metrics):
+        ready = [m for m in metrics if m.name not in done and deps[m.name] <= done]
+        if not ready:
+            raise ValueError(f'metrics in stage {stage} have circular dependencies')
+        plan.append((ready[0], compiled[ready[0].name]))
+        done.add(ready[0].name)
+    return plan
+
+
+def evaluate_metrics(df: pd.DataFrame, stage: str) -> pd.DataFrame:
+    """
+    计算stage中所有可以计算的指标，返回增加了指标列的新df，输入的df不会被修改。
+    列是否存在只在开始时检查一次，之后用计算出的指标更新可用列集合。
+    """
+    available = set(df.columns)
+    values = {}
+    # 全部为空的列（如em、sina银行股没有的字段）可能是object类型的None，统一转成float
+    def get(name):
+        return values[name] if name in values else df[name].to_numpy(dtype=float, na_value=np.nan)
+    for metric, formulas in compile_metrics(stage):
+        if metric.unless in available or not available.issuperset(metric.requires):
+            continue
+        for f in formulas:
+            if f.inputs <= available:
+                env = {name: get(name) for name in f.inputs}
+                env.update({name: get(name) if name in available else MISSING for name in f.optional})
+                with np.errstate(all='ignore'):
+                    value = eval(f.code, _FUNCS, {'c': env})
+                # 常数结果（如nzsum所有项都缺失）扩展成整列
+                values[metric.name] = np.full(len(df), value) if np.ndim(value) == 0 else value
+                available.add(metric.name)
+                break
+    return df.assign(**values) if values else df
@@ -0,0 +1,132 @@
+from collections.abc import Mapping
+
+import pandas as pd
+import numpy as np
+
+from common import *
+from report_calc import LazyReports, compact_reports
+
+# 多只股票的面板报表，不依赖streamlit，用于批量计算和全市场筛选
+# 同一张报表所有股票纵向拼接成一个df，index为 (code, 报告期)，columns为指标，数值列保存在一个连续的float64二维数组中
+# 单季度、同比、利润率、周转率等计算沿用report_calc的计算图，每个步骤对所有股票只运行一次（按股票代码分组的向量化运算）
+# 报表字段不同的股票（一般企业、银行、保险...）自定义指标的公式不同，按原始报表的字段分组计算，每组的结果和逐只股票计算相同
+# 对外接口：
+#   ReportPanel(reports_raw_by_code, col_maps_dict, source)  {report_name: 面板df}
+#   ReportPanel.reports(code) -> {report_name: df}  一只股票的报表，和calculate_reports的结果相同
+#   calculate_panel(...) -> {code: {report_name: df}}  批量计算，代替逐只股票调用calculate_reports
+#   group_by_schema(reports_raw_by_code, max_size) -> [reports_raw_by_code]  按字段分组，每组可以分别在不同进程中计算
+PANEL_CODE = 'code'
+
+
+class PanelReports(LazyReports):
+    """
+    原始报表字段相同的一组股票的按需计算报表，每个节点是所有股票纵向拼接的df，第一列为股票代码PANEL_CODE
+    每只股票的行保持原始报表中的顺序，同一只股票的行是连续的
+    """
+    group_col = PANEL_CODE
+
+    def __init__(self, reports_raw_by_code: Mapping[str, dict[str, pd.DataFrame]], col_maps_dict: dict, source: str):
+        super().__init__({}, col_maps_dict, source)
+        self.reports_raw_by_code = reports_raw_by_code
+
+    def format_raw(self, report_name: str) -> pd.DataFrame:
+        # 先拼接原始报表再统一格式化，字符串转数字等按列的向量化处理对所有股票只做一次
+        raws = [reports_raw[report_name] for reports_raw in self.reports_raw_by_code.values()]
+        raw = pd.concat(raws, axis=0, ignore_index=True)
+        df = format_report(raw, df_col_maps=self.col_maps_dict[report_name], source=self.source)
+        # format_report不改变行的顺序，按行数还原股票代码
+        df.insert(0, PANEL_CODE, np.repeat(np.array(list(self.reports_raw_by_code), dtype=object), [len(df_raw) for df_raw in raws]))
+        return df
+
+
+def _schema(reports_raw: dict[str, pd.DataFrame]) -> tuple:
+    """
+    原始报表的字段和全部为空(None)的object字段，相同的股票可以放在一起计算
+    全部为None的字段在逐只计算时不是数字列（不计算单季度和同比），和其他股票拼接后会变成数字列，所以要分开
+    """
+    schema = []
+    for report_name in [PROFIT_BY_REPORT, CASH_BY_REPORT, BALANCE_BY_REPORT]:
+        df = reports_raw[report_name]
+        empty = (df.dtypes == object).to_numpy() & df.isna().all(axis=0).to_numpy()
+        schema.append((tuple(df.columns), tuple(df.columns[empty])))
+    return tuple(schema)
+
+
+def group_by_schema(reports_raw_by_code: Mapping[str, dict[str, pd.DataFrame]],
+                    max_size: int | None = None) -> list[dict[str, dict[str, pd.DataFrame]]]:
+    """按原始报表的字段分组，每组最多max_size只股票（None不限制）。每组单独调用calculate_panel的结果和一起计算相同"""
+    groups = {}
+    for code, reports_raw in reports_raw_by_code.items():
+        groups.setdefault(_schema(reports_raw), {})[code] = reports_raw
+    batches = []
+    for group in groups.values():
+        codes = list(group)
+        size = max_size or len(codes)
+        batches += [{code: group[code] for code in codes[i:i + size]} for i in range(0, len(codes), size)]
+    return batches
+
+
+def _to_panel(df: pd.DataFrame) -> pd.DataFrame:
+    """股票代码和报告期列转成index，数值列合并成一个float64数组，文本列（如em的SECUCODE）不保留，全部为空的列作为数值列"""
+    cols = [col for col in df.columns.drop([PANEL_CODE, REPORT_DATE])
+            if pd.api.types.is_numeric_dtype(df[col]) or df[col].isna().all()]
+    index = pd.MultiIndex.from_arrays([df[PANEL_CODE], df[REPORT_DATE]], names=[PANEL_CODE, REPORT_DATE])
+    return pd.DataFrame(df[cols].to_numpy(dtype=np.float64, na_value=np.nan), index=index, columns=cols)
+
+
+class ReportPanel(Mapping):
+    """
+    多只股票的面板报表 {report_name: df}，df的index为 (code, 报告期)，columns为所有股票指标的并集
+    按REPORT_NAMES的顺序迭代，每张报表在第一次访问时才计算
+    reports_raw_by_code为 {code: get_all_reports_concurrently下载的三张原始报表}，有空表的股票需要事先去掉
+    """
+    def __init__(self, reports_raw_by_code: Mapping[str, dict[str, pd.DataFrame]], col_maps_dict: dict, source: str):
+        self.codes = list(reports_raw_by_code)
+        self.groups = [PanelReports(group, col_maps_dict, source) for group in group_by_schema(reports_raw_by_code)]
+        self._panels = {}
+
+    def reports(self, code: str) -> dict[str, pd.DataFrame]:
+        """一只股票的全部报表，和calculate_reports的结果相同（只有本组的列，index从0开始）"""
+        group = next(group for group in self.groups if code in group.reports_raw_by_code)
+        return {report_name: _split(group[report_name])[code] for report_name in REPORT_NAMES}
+
+    def split(self) -> dict[str, dict[str, pd.DataFrame]]:
+        """拆分成每只股票的报表 {code: {report_name: df}}，按输入的股票顺序"""
+        result = {code: {} for code in self.codes}
+        for group in self.groups:
+            for report_name in REPORT_NAMES:
+                for code, df in _split(group[report_name]).items():
+                    result[code][report_name] = df
+        return result
+
+    def __getitem__(self, report_name: str) -> pd.DataFrame:
+        if report_name not in REPORT_NAMES:
+            raise KeyError(report_name)
+        if report_name not in self._panels:
+            dfs = [_to_panel(group[report_name]) for group in self.groups]
+            self._panels[report_name] = pd.concat(dfs, axis=0) if len(dfs) > 1 else dfs[0]
+        return self._panels[report_name]
+
+    def __iter__(self):
+        return iter(REPORT_NAMES)
+
+    def __len__(self):
+        return len(REPORT_NAMES)
+
+
+def _split(df: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    """PanelReports的节点按股票代码拆分，去掉股票代码列"""
+    df_values = df.drop(columns=PANEL_CODE)
+    return {code: df_values.take(pos).reset_index(drop=True) for code, pos in df.groupby(PANEL_CODE, sort=False).indices.items()}
+
+
+def calculate_panel(reports_raw_by_code: Mapping[str, dict[str, pd.DataFrame]], col_maps_dict: dict, source: str,
+                    compact: bool = False) -> dict[str, dict[str, pd.DataFrame]]:
+    """
+    多只股票一起计算全部报表，返回 {code: {report_name: df}}，结果和逐只股票调用calculate_reports相同
+    每个计算步骤对所有股票只运行一次，股票数量多时比逐只计算快很多
+    """
+    reports_by_code = ReportPanel(reports_raw_by_code, col_maps_dict, source).split()
+    if compact:
+        return {code: compact_reports(reports) for code, reports in reports_by_code.items()}
+    return reports_by_code
@@ -0,0 +1,122 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+import pandas as pd
+
+# =======================   variable declaration  ======================================
+# ======================================================================================
+# 报表持久化存储，sqlite单文件，key为(code, source, kind, report_name)，value为pickle后的DataFrame
+# 进程重启、重新部署后仍然可以直接从磁盘读取，不需要再访问akshare
+STORE_PATH = os.environ.get('REPORT_STORE_PATH', 'report_store.sqlite')
+# 财务报表只在财报发布后才会变化，超过STORE_MAX_AGE(秒)的数据才重新下载
+STORE_MAX_AGE = float(os.environ.get('REPORT_STORE_MAX_AGE_HOURS', 24)) * 3600
+# kind: raw-从akshare下载的原始报表，derived-计算得到的报表，screen-全市场筛选的指标长表（code为ALL_CODES）
+KIND_RAW = 'raw'
+KIND_DERIVED = 'derived'
+KIND_SCREEN = 'screen'
+ALL_CODES = '*'
+# iter_reports每次从数据库读取的行数
+ITER_BATCH_SIZE = 500
+# ======================================================================================
+# ======================================================================================
+
+_lock = threading.Lock()
+_conn = None
+
+
+def _get_conn() -> sqlite3.Connection:
+    # 整个进程共用一个连接，多线程访问时用_lock保护
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(STORE_PATH, check_same_thread=False)
+        _conn.execute('''CREATE TABLE IF NOT EXISTS reports (
+                            code TEXT NOT NULL,
+                            source TEXT NOT NULL,
+                            kind TEXT NOT NULL,
+                            report_name TEXT NOT NULL,
+                            updated_at REAL NOT NULL,
+                            data BLOB NOT NULL,
+                            PRIMARY KEY (code, source, kind, report_name))''')
+        _conn.commit()
+    return _conn
+
+
+def load_report(code: str, source: str, report_name: str, kind: str = KIND_RAW) -> tuple[pd.DataFrame | None, float]:
+    """
+    从存储中读取报表
+
+    :return: (df, updated_at)。不存在时返回 (None, 0)
+    """
+    with _lock:
+        row = _get_conn().execute('SELECT data, updated_at FROM reports WHERE code=? AND source=? AND kind=? AND report_name=?',
+                                  (code, source, kind, report_name)).fetchone()
+    if row is None:
+        return None, 0
+    return pickle.loads(row[0]), row[1]
+
+
+def save_report(code: str, source: str, report_name: str, df: pd.DataFrame, kind: str = KIND_RAW):
+    data = pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL)
+    with _lock:
+        conn = _get_conn()
+        conn.execute('INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?, ?, ?)',
+                     (code, source, kind, report_name, time.time(), data))
+        conn.commit()
+
+
+def iter_reports(source: str, report_name: str, kind: str = KIND_DERIVED):
+    """
+    按股票代码顺序逐个返回存储中source所有股票的report_name报表 (code, df, updated_at)
+    每次只从数据库读取ITER_BATCH_SIZE行，不会把整个股票池的报表同时放在内存中，也不会长时间占用_lock
+    """
+    last_code = ''
+    while True:
+        with _lock:
+            rows = _get_conn().execute('SELECT code, data, updated_at FROM reports WHERE source=? AND kind=? AND report_name=? AND code>? '
+                                       'ORDER BY code LIMIT ?', (source, kind, report_name, last_code, ITER_BATCH_SIZE)).fetchall()
+        for code, data, updated_at in rows:
+            yield code, pickle.loads(data), updated_at
+        if len(rows) < ITER_BATCH_SIZE:
+            return
+        last_code = rows[-1][0]
+
+
+# 数据没有变化时只更新updated_at，不重新写入数据
+def touch_reports(code: str, source: str, kind: str = KIND_RAW):
+    with _lock:
+        conn = _get_conn()
+        conn.execute('UPDATE reports SET updated_at=? WHERE code=? AND source=? AND kind=?', (time.time(), code, source, kind))
+        conn.commit()
+
+
+def is_fresh(updated_at: float, max_age: float = STORE_MAX_AGE) -> bool:
+    return time.time() - updated_at < max_age
+
+
+def persist_report(report_name: str):
+    """
+    装饰器，给 func(code, source) 形式的报表下载函数加上持久化存储。
+    存储中有未过期的数据直接返回；否则调用func下载并保存。下载失败时如果有过期数据，返回过期数据。
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(code: str, source: str = 'ths') -> pd.DataFrame:
+            df, updated_at = load_report(code, source, report_name)
+            if df is not None and is_fresh(updated_at):
+                return df
+            try:
+                df_new = func(code, source)
+            except Exception:
+                if df is not None:
+                    return df
+                raise
+            # 空表不保存，避免把下载失败或不支持的source写进存储
+            if not df_new.empty:
+                save_report(code, source, report_name, df_new)
+            return df_new
+        return wrapper
+    return decorator
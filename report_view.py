@@ -0,0 +1,154 @@
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+
+import pandas as pd
+import numpy as np
+
+from common import *
+from instrumentation import get_metrics
+
+# 报表筛选视图，不依赖streamlit
+# sidebar的年份、季度、最新季度、隐藏空列、col_maps列筛选条件相同时，直接返回缓存的筛选结果
+# 每张报表的年份和季度只在第一次筛选时计算一次
+# ReportViews.filtered()返回按需筛选的Mapping，只有被访问的报表才会进行筛选
+# 由筛选结果生成的表格和图表也可以通过FilteredReports.cached缓存，其他控件变化时不需要重新画图，图表使用单独的较小的缓存
+# 返回的df和图表是共用的缓存，使用方如果需要修改要先copy。ReportViews可以在多个会话（线程）之间共用
+# 单季度报表中有累计值、但缺少同一年上一季度的报告而无法计算的单元格由underivable()给出，显示时和真正的空值区分
+
+# 每只股票最多缓存的筛选结果（包括表格）数量
+VIEW_CACHE_SIZE = 512
+# 图表（go.Figure）比筛选结果大很多（一个约200KB），每只股票单独用一个小的LRU，最多缓存FIGURE_CACHE_SIZE个图表
+# 默认选择7列时图表页一次显示14个图表（数值和同比），20个可以缓存当前图表页和几个表格中选中行的图表
+# 每只股票的缓存只在查看这只股票的会话之间共用，不同股票的会话不会互相替换图表
+# 每只股票最多约4MB，get_report_views最多保留64只股票，最坏约256MB；内存较小的部署可以用环境变量FIGURE_CACHE_SIZE调小
+FIGURE_CACHE_SIZE = int(os.environ.get('FIGURE_CACHE_SIZE', 20))
+# FilteredReports.cached中key的类型为这些值时，结果是图表
+FIGURE_KINDS = ('bar', 'grid')
+# 单季度报表 -> 计算它的累计报表
+QUARTER_REPORT_SOURCES = {PROFIT_BY_QUARTER: PROFIT_BY_REPORT, CASH_BY_QUARTER: CASH_BY_REPORT}
+
+
+class ReportViews:
+    def __init__(self, reports: Mapping[str, pd.DataFrame], col_maps_dict: dict):
+        self.reports = reports
+        self.col_maps_dict = col_maps_dict
+        # {report_name: (years, quarters)}
+        self._periods = {}
+        # {report_name: 无法计算的单元格mask}
+        self._underivable = {}
+        self._cache = OrderedDict()
+        self._figure_cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def periods(self, report_name: str) -> tuple[np.ndarray, np.ndarray]:
+        """报表每一行报告期的 (年份, 季度)"""
+        if report_name not in self._periods:
+            dates = self.reports[report_name][REPORT_DATE]
+            self._periods[report_name] = (dates.dt.year.to_numpy(), dates.dt.quarter.to_numpy())
+        return self._periods[report_name]
+
+    def year_range(self, report_names: list[str] = (PROFIT_BY_REPORT, CASH_BY_REPORT, BALANCE_BY_REPORT)) -> tuple[int, int]:
+        """report_names中所有报表报告期的 (最小年份, 最大年份)"""
+        years = np.concatenate([self.periods(report_name)[0] for report_name in report_names])
+        years = years[~np.isnan(years)] if years.dtype.kind == 'f' else years
+        return int(years.min()), int(years.max())
+
+    def underivable(self, report_name: str) -> pd.DataFrame | None:
+        """单季度报表中因缺少上一季度报告而无法计算的单元格mask（get_quarter_report的return_underivable），和报表的行列对齐。不是单季度报表时返回None"""
+        if report_name not in QUARTER_REPORT_SOURCES:
+            return None
+        if report_name not in self._underivable:
+            df_cum = self.reports[QUARTER_REPORT_SOURCES[report_name]]
+            _, mask = get_quarter_report(df_cum, REPORT_DATE, return_underivable=True)
+            # 按报告期对齐，保存或增量更新过的报表行号不一定相同
+            mask.index = df_cum[REPORT_DATE]
+            mask = mask[~mask.index.duplicated()]
+            df = self.reports[report_name]
+            mask = mask.reindex(index=df[REPORT_DATE], columns=df.columns, fill_value=False)
+            mask.index = df.index
+            self._underivable[report_name] = mask
+        return self._underivable[report_name]
+
+    def view(self, report_name: str, years: tuple[int, int], quarters: tuple[int, ...],
+             latest: bool = True, na_invisible: bool = True, col_maps_only: bool = True) -> pd.DataFrame:
+        """
+        筛选后的报表
+        1. 年份在years范围内  2. 季度在quarters中  3. latest为True时总是保留最新一期
+        4. na_invisible为True时隐藏全部为空的列  5. col_maps_only为True时只保留col_maps中的item列，并按item排序
+        """
+        key = (report_name, tuple(years), tuple(quarters), latest, na_invisible, col_maps_only)
+        return self.cached(key, lambda: self._filter(report_name, years, quarters, latest, na_invisible, col_maps_only))
+
+    def _filter(self, report_name: str, years: tuple[int, int], quarters: tuple[int, ...],
+                latest: bool, na_invisible: bool, col_maps_only: bool) -> pd.DataFrame:
+        df = self.reports[report_name]
+        year, quarter = self.periods(report_name)
+        mask = (year >= years[0]) & (year <= years[1]) & np.isin(quarter, quarters)
+        # 报表按报告期降序排列，第一行为最新一期
+        if latest and len(mask):
+            mask[0] = True
+        df = df[mask]
+        if na_invisible:
+            df = df.dropna(how='all', axis=1)
+        # CROSS_REPORT报表计算需要的列没在col_maps中，可以隐藏
+        if col_maps_only:
+            df = df[[col for col in self.col_maps_dict[report_name]['item'] if col in df.columns]]
+        return df
+
+    def cached(self, key: tuple, func):
+        """key对应的缓存结果，没有时调用func()计算并缓存。图表和其他结果分别保存在两个LRU中，大小为FIGURE_CACHE_SIZE和VIEW_CACHE_SIZE"""
+        # 筛选结果的kind为view，FilteredReports.cached的kind为key中的类型（如bar、grid、table）
+        kind = key[2] if key[0].startswith('~') and len(key) > 2 else 'view'
+        cache, size = (self._figure_cache, FIGURE_CACHE_SIZE) if kind in FIGURE_KINDS else (self._cache, VIEW_CACHE_SIZE)
+        with self._lock:
+            if key in cache:
+                cache.move_to_end(key)
+                get_metrics().inc('view_cache_requests_total', kind=kind, result='hit')
+                return cache[key]
+        get_metrics().inc('view_cache_requests_total', kind=kind, result='miss')
+        with get_metrics().timer('view_build_seconds', kind=kind):
+            value = func()
+        with self._lock:
+            cache[key] = value
+            while len(cache) > size:
+                cache.popitem(last=False)
+        return value
+
+    def filtered(self, years: tuple[int, int], quarters: tuple[int, ...],
+                 latest: bool = True, na_invisible: bool = True, col_maps_only: bool = True) -> 'FilteredReports':
+        return FilteredReports(self, (tuple(years), tuple(quarters), latest, na_invisible, col_maps_only))
+
+
+class FilteredReports(Mapping):
+    """使用同一组筛选条件的所有报表，访问某张报表时才进行筛选"""
+    def __init__(self, views: ReportViews, filters: tuple):
+        self._views = views
+        self._filters = filters
+
+    def cached(self, report_name: str, key: tuple, func):
+        """
+        由筛选后的report_name报表生成的数据（如图表）的缓存。
+        key为筛选条件以外的参数（如列名、图表高度），筛选条件不变时func()只调用一次
+        """
+        return self._views.cached(('~' + report_name, self._filters) + tuple(key), func)
+
+    def underivable(self, report_name: str) -> pd.DataFrame | None:
+        """筛选后的report_name报表中无法计算的单元格mask，和self[report_name]的行列对齐。不是单季度报表时返回None"""
+        mask = self._views.underivable(report_name)
+        if mask is None:
+            return None
+        df = self[report_name]
+        return mask.loc[df.index, df.columns]
+
+    def __getitem__(self, report_name: str) -> pd.DataFrame:
+        if report_name not in self._views.reports:
+            raise KeyError(report_name)
+        return self._views.view(report_name, *self._filters)
+
+    def __iter__(self):
+        return iter(self._views.reports)
+
+    def __len__(self):
+        return len(self._views.reports)
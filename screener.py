@@ -0,0 +1,142 @@
+from collections.abc import Iterable, Mapping
+
+import pandas as pd
+import numpy as np
+
+from common import *
+
+# 全市场筛选，不依赖streamlit
+# 所有股票的指标保存为一张长表 (code, report_date, metric, value)，每只股票每个报告期每个指标一行，空值不保存
+# code和metric为category，value为float32，按 metric, code, report_date降序 排列，同一指标的数据是连续的一段
+# Screener把长表转成numpy数组，筛选、排序和百分位排名都是向量化的数组运算，5000多只股票的查询在几毫秒内完成
+METRIC_TABLE_COLUMNS = ['code', REPORT_DATE, 'metric', 'value']
+
+
+def build_metric_table(reports_by_code: Mapping[str, Mapping[str, pd.DataFrame]],
+                       metrics: dict[str, tuple[str, str]] = SCREEN_METRICS) -> pd.DataFrame:
+    """
+    reports_by_code为 {code: {report_name: df}}，只需要包含metrics用到的报表
+    返回长表，列为METRIC_TABLE_COLUMNS
+    """
+    return metric_table_from_items(((code, report_name, df) for code, reports in reports_by_code.items()
+                                    for report_name, df in reports.items()), metrics)
+
+
+def metric_table_from_items(items: Iterable[tuple[str, str, pd.DataFrame]],
+                            metrics: dict[str, tuple[str, str]] = SCREEN_METRICS) -> pd.DataFrame:
+    """items为 (code, report_name, df) 的迭代器，可以逐个从存储中读取，不需要同时加载所有股票的报表"""
+    # 同一张报表的指标一起取出 {report_name: ([metric位置], [列名])}
+    by_report = {}
+    for i, (report_name, col) in enumerate(metrics.values()):
+        by_report.setdefault(report_name, ([], []))
+        by_report[report_name][0].append(i)
+        by_report[report_name][1].append(col)
+    codes, dates, metric_pos, values = [], [], [], []
+    for code, report_name, df in items:
+        if report_name not in by_report:
+            continue
+        pos, cols = by_report[report_name]
+        # 二维数组 (报告期, 指标)，按列展开，缺少的列为空
+        value = df.reindex(columns=cols).to_numpy(dtype=np.float64, na_value=np.nan).ravel(order='F')
+        date = np.tile(df[REPORT_DATE].to_numpy(dtype='datetime64[ns]'), len(cols))
+        valid = ~np.isnan(value) & ~np.isnat(date)
+        codes.append(np.full(valid.sum(), code, dtype=object))
+        dates.append(date[valid])
+        metric_pos.append(np.repeat(np.array(pos, dtype=np.int8), len(df))[valid])
+        values.append(value[valid])
+    if not codes:
+        return pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in
+                             zip(METRIC_TABLE_COLUMNS, ['category', 'datetime64[ns]', 'category', np.float32])})
+    table = pd.DataFrame({
+        'code': pd.Categorical(np.concatenate(codes)),
+        REPORT_DATE: np.concatenate(dates),
+        'metric': pd.Categorical.from_codes(np.concatenate(metric_pos), categories=list(metrics)),
+        'value': np.concatenate(values).astype(np.float32),
+    })
+    # 同一只股票同一报告期重复的行只保留第一行
+    table = table.drop_duplicates(subset=['code', REPORT_DATE, 'metric'])
+    return table.sort_values(['metric', 'code', REPORT_DATE], ascending=[True, True, False], kind='stable').reset_index(drop=True)
+
+
+class Screener:
+    def __init__(self, table: pd.DataFrame):
+        self.table = table
+        self.codes = table['code'].cat.categories.to_numpy()
+        self.metrics = list(table['metric'].cat.categories)
+        self._code = table['code'].cat.codes.to_numpy()
+        self._date = table[REPORT_DATE].to_numpy()
+        self._value = table['value'].to_numpy()
+        # 每个指标在长表中的行范围 {metric: (start, end)}
+        metric = table['metric'].cat.codes.to_numpy()
+        bounds = np.searchsorted(metric, np.arange(len(self.metrics) + 1))
+        self._ranges = {m: (bounds[i], bounds[i + 1]) for i, m in enumerate(self.metrics)}
+
+    def report_dates(self) -> list[pd.Timestamp]:
+        """长表中所有的报告期，降序"""
+        return list(pd.DatetimeIndex(np.unique(self._date)[::-1]))
+
+    def _metric_values(self, metric: str, report_date: pd.Timestamp | None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """指标每只股票的 (code位置, 报告期, 值)。report_date为None时取每只股票最新的报告期"""
+        start, end = self._ranges[metric]
+        code, date, value = self._code[start:end], self._date[start:end], self._value[start:end]
+        if report_date is None:
+            # 同一只股票的行是连续的，报告期降序，第一行就是最新的
+            mask = np.r_[True, code[1:] != code[:-1]] if len(code) else np.zeros(0, dtype=bool)
+        else:
+            mask = date == np.datetime64(pd.Timestamp(report_date), 'ns')
+        return code[mask], date[mask], value[mask]
+
+    def _row_dates(self, metrics: list[str]) -> np.ndarray:
+        """每只股票的报告期：第一个指标最新的报告期，股票没有这个指标时依次取后面的指标"""
+        dates = np.full(len(self.codes), np.datetime64('NaT'), dtype='datetime64[ns]')
+        for metric in metrics:
+            code, date, _ = self._metric_values(metric, None)
+            missing = np.isnat(dates[code])
+            dates[code[missing]] = date[missing]
+        return dates
+
+    def wide(self, metrics: list[str], report_date: pd.Timestamp | None = None) -> pd.DataFrame:
+        """
+        每只股票一行，每个指标一列的宽表，index为股票代码，第一列为报告期REPORT_DATE。没有数据的股票不在结果中
+        report_date为None时每只股票取第一个指标最新的报告期（_row_dates），同一行所有指标都是这个报告期的值
+        """
+        if report_date is None:
+            dates = self._row_dates(metrics)
+        else:
+            dates = np.full(len(self.codes), np.datetime64(pd.Timestamp(report_date), 'ns'))
+        values = np.full((len(self.codes), len(metrics)), np.nan, dtype=np.float64)
+        for j, metric in enumerate(metrics):
+            start, end = self._ranges[metric]
+            code, date, value = self._code[start:end], self._date[start:end], self._value[start:end]
+            mask = date == dates[code]
+            values[code[mask], j] = value[mask]
+        has_data = ~np.isnan(values).all(axis=1)
+        df = pd.DataFrame(values[has_data], index=pd.Index(self.codes[has_data], name='code'), columns=metrics)
+        df.insert(0, REPORT_DATE, dates[has_data])
+        return df
+
+    def screen(self, sort_by: str, top: int = 50, ascending: bool = False,
+               filters: dict[str, tuple[float | None, float | None]] | None = None,
+               metrics: list[str] | None = None, report_date: pd.Timestamp | None = None) -> pd.DataFrame:
+        """
+        按sort_by排序，返回前top只股票
+        filters为 {指标: (最小值, 最大值)}，None表示不限制。metrics为结果中另外显示的指标，默认全部指标
+        每个指标增加百分位排名列 '<指标>百分位'，排名在筛选之前按全部有数据的股票计算（包括没有sort_by的股票），值越大百分位越高
+        """
+        filters = filters or {}
+        metrics = list(dict.fromkeys([sort_by] + list(filters) + (self.metrics if metrics is None else list(metrics))))
+        df = self.wide(metrics, report_date)
+        ranks = df[metrics].rank(pct=True) * 100
+        has_sort = df[sort_by].notna().to_numpy()
+        df, ranks = df[has_sort], ranks[has_sort]
+        mask = np.ones(len(df), dtype=bool)
+        for metric, (low, high) in filters.items():
+            values = df[metric].to_numpy()
+            if low is not None:
+                mask &= values >= low
+            if high is not None:
+                mask &= values <= high
+        df, ranks = df[mask], ranks[mask]
+        order = np.argsort(df[sort_by].to_numpy() if ascending else -df[sort_by].to_numpy(), kind='stable')[:top]
+        df = pd.concat([df, ranks.add_suffix('百分位')], axis=1).iloc[order]
+        return df
@@ -0,0 +1,65 @@
+from collections import defaultdict
+
+import pandas as pd
+
+# 股票搜索索引，不依赖streamlit。启动时建立一次，之后每次输入只查索引，不扫描整个股票列表
+# code、name、initial 三个字段分别建立1-gram和2-gram倒排索引：gram -> 包含该gram的行号集合
+# 查询时取输入中所有gram对应行号集合的交集作为候选，再用子串判断确认
+# 结果排序：代码完全相同 > 名称或拼音首字母完全相同 > 前缀匹配 > 子串匹配，同一级别保持股票列表中的顺序
+SEARCH_FIELDS = ['code', 'name', 'initial']
+# 拼音首字母统一用大写匹配
+UPPER_FIELDS = ['initial']
+
+
+def _grams(text: str, n: int) -> set[str]:
+    return {text[i:i+n] for i in range(len(text) - n + 1)}
+
+
+class StockSearchIndex:
+    def __init__(self, df_stock_list: pd.DataFrame):
+        df = df_stock_list.reset_index(drop=True).copy()
+        df['code'] = df['code'].astype(str).str.zfill(6)
+        self.df = df
+        self._values = {field: df[field].fillna('').astype(str).tolist() for field in SEARCH_FIELDS}
+        # {field: {gram: set(row)}}
+        self._index = {}
+        for field, values in self._values.items():
+            index = defaultdict(set)
+            for row, value in enumerate(values):
+                for gram in _grams(value, 1) | _grams(value, 2):
+                    index[gram].add(row)
+            self._index[field] = dict(index)
+
+    def _match_field(self, field: str, text: str) -> set[int]:
+        index = self._index[field]
+        grams = _grams(text, 2) if len(text) > 1 else {text}
+        # 从最短的行号集合开始求交集
+        postings = sorted((index.get(gram, set()) for gram in grams), key=len)
+        rows = set(postings[0]).intersection(*postings[1:])
+        values = self._values[field]
+        # 2-gram都存在不代表子串存在（如 'ABAB' 和 'ABA'），需要再确认
+        return {row for row in rows if text in values[row]}
+
+    def search(self, text: str) -> pd.DataFrame:
+        """
+        返回匹配text的股票列表df，已排序，index从1开始（给用户看）
+        """
+        text = text.strip()
+        if not text:
+            return self.df.iloc[0:0]
+        ranks = {}
+        for field in SEARCH_FIELDS:
+            query = text.upper() if field in UPPER_FIELDS else text
+            values = self._values[field]
+            for row in self._match_field(field, query):
+                if values[row] == query:
+                    rank = 0 if field == 'code' else 1
+                elif values[row].startswith(query):
+                    rank = 2
+                else:
+                    rank = 3
+                ranks[row] = min(rank, ranks.get(row, rank))
+        rows = sorted(ranks, key=lambda row: (ranks[row], row))
+        df = self.df.iloc[rows].reset_index(drop=True)
+        df.index += 1
+        return df